@@ -1,34 +1,33 @@
+import matplotlib
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
-#from model.test_model import globalParameters, population, cars
-from testQQQ.runTenYears import population, cars
+import numpy as np
 
-year = sorted(population.keys())[-1]
+from model import resultsAnalysis
 
-for incomeLevel in population[year].keys():
-    frac = []
-    price = []
-    for (k,v) in population[year][incomeLevel]['cars'].items():
-        frac.append(v['fraction'])
-        price.append(cars[k]['history'][year]['price'])
-    plt.scatter(price,frac)
+# reads the files written by testQQQ/runTenYears.py; run that first
+results = resultsAnalysis.loadResults("results")
+ownership = results['ownership']
 
+year = ownership['year'].max()
+rows = np.nonzero(ownership['year'] == year)[0]
+price = results['cars']['price'][resultsAnalysis.carRowOfOwnership(results)[rows]]
+fraction = ownership['fraction'][rows]
+
+# one point per (income group, car owned), coloured by income group
+(incomeLevels, groupCodes) = np.unique(ownership['incomeLevel'][rows], return_inverse=True)
+points = plt.scatter(price, fraction, c=groupCodes, cmap='tab10', vmin=0, vmax=9)
+plt.legend(points.legend_elements()[0], [str(incomeLevel) for incomeLevel in incomeLevels], title="income")
 plt.savefig("fracByPrice.png")
 
 plt.figure()
 
-accum = {}
-for incomeLevel in population[year].keys():
-    for (k,v) in population[year][incomeLevel]['cars'].items():
-        if (k not in accum): accum[k] = 0
-        accum[k] += v['fraction']
-
-price = []
-frac = []
-for k,v in accum.items():
-    price.append(cars[k]['history'][year]['price'])
-    frac.append(v)
-plt.scatter(price,frac)
+# one point per car: its price, and the fraction of everyone owning it
+(cars, carCodes) = np.unique(ownership['car'][rows], return_inverse=True)
+frac = np.bincount(carCodes, weights=fraction)
+carPrice = np.zeros(len(cars))
+carPrice[carCodes] = price
+plt.scatter(carPrice, frac)
 plt.savefig("fracByPriceTotal.png")
 
-print(sum(frac))
-
+print(frac.sum())
@@ -1,21 +1,24 @@
-#import sys
-#sys.path.append("..")
-from matplotlib import pyplot as plt 
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
 import numpy as np
 
-from model.test_model import globalParameters
+from model.defaultGlobalParameters import globalParameters
+from model import utilityCurves
 
-def plotUtilityFunctions(): 
+# the utility function of every income group, evaluated on the whole range of qualities at once
+def plotUtilityFunctions():
     x = np.linspace(0, 70000, 400)
+    incomeLevels = sorted(globalParameters['peopleGroups'].keys())
+    utility = utilityCurves.groupUtilities([globalParameters['peopleGroups'][incomeLevel]['utilityFunction'] for incomeLevel in incomeLevels], x)
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
-
-    for i in range(7):
-        ax.plot(   x, [globalParameters['peopleGroups'][i]['utilityFunction'](xx) for xx in x]   )
-
-    fig.show()
-    plt.savefig("foo.png")
+    for (g, incomeLevel) in enumerate(incomeLevels):
+        ax.plot(x, utility[g], label=str(incomeLevel))
+    ax.legend(title="income")
+    fig.savefig("foo.png")
+    plt.close(fig)
 
 if __name__ == "__main__":
     plotUtilityFunctions()
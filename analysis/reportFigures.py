@@ -0,0 +1,96 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Figures for reports, rendered in batch from the results directories written by resultsWriter (one directory per scenario).
+#    Each figure shows every year of one or more scenarios, one panel per scenario with shared axes:
+#
+#    priceBands        share of the population owning a car in each price band (stacked)
+#    evShareByIncome   EV share of each income group's cars
+#    priceSeries       mean price of the cars owned, by model
+#
+# renderReport makes each kind of figure for every scenario and for all of them side by side; renderFigures renders any list of
+#    figures.  Figures are spread over a process pool, each worker loading a scenario's results once however many figures use it.
+#
+#    python -m analysis.reportFigures --output report results/base results/highGas results/lowGas
+
+import argparse, concurrent.futures, functools, os
+
+import matplotlib
+matplotlib.use('Agg')                   # files only: no display, and safe in worker processes
+from matplotlib import pyplot as plt
+
+from model import resultsAnalysis
+
+KINDS = ['priceBands', 'evShareByIncome', 'priceSeries']
+PANEL_SIZE = (5, 3.5)
+
+# columnar results of a directory, loaded once per process
+@functools.lru_cache(maxsize=None)
+def scenarioResults(directory):
+    return resultsAnalysis.loadResults(directory)
+
+def drawPriceBands(ax, results, bands=resultsAnalysis.DEFAULT_PRICE_BANDS):
+    (years, bands, share) = resultsAnalysis.shareByPriceBand(results, bands)
+    labels = [str(low) + "-" + str(high) for (low, high) in zip(bands, bands[1:])] + [str(bands[-1]) + "+"]
+    ax.stackplot(years, share.T, labels=labels)
+    ax.set_ylabel("share of population")
+
+def drawEVShareByIncome(ax, results):
+    (years, incomeLevels, share) = resultsAnalysis.evShareByIncomeGroup(results)
+    for (g, incomeLevel) in enumerate(incomeLevels):
+        ax.plot(years, share[:, g], label=str(incomeLevel))
+    ax.set_ylabel("EV share of cars owned")
+
+def drawPriceSeries(ax, results):
+    (years, models, meanPrice) = resultsAnalysis.priceSeries(results)
+    for (m, model) in enumerate(models):
+        ax.plot(years, meanPrice[:, m], label=model)
+    ax.set_ylabel("mean price of cars owned")
+
+DRAW = {'priceBands': drawPriceBands, 'evShareByIncome': drawEVShareByIncome, 'priceSeries': drawPriceSeries}
+
+# render one figure: figure is (kind, [(label, directory), ...], fileName).  Takes a single tuple so it can be handed to a process
+#    pool; returns fileName
+def renderFigure(figure):
+    (kind, scenarios, fileName) = figure
+    (fig, axes) = plt.subplots(1, len(scenarios), sharey=True, squeeze=False,
+                               figsize=(PANEL_SIZE[0] * len(scenarios), PANEL_SIZE[1]))
+    for (ax, (label, directory)) in zip(axes[0], scenarios):
+        DRAW[kind](ax, scenarioResults(directory))
+        ax.set_title(label)
+        ax.set_xlabel("year")
+    axes[0][-1].legend(fontsize='small', loc='center left', bbox_to_anchor=(1, 0.5))
+    fig.savefig(fileName, bbox_inches='tight')
+    plt.close(fig)                      # a batch of hundreds of figures must not keep them all open
+    return fileName
+
+# render every figure (see renderFigure) and return their file names.  workers=1 renders in this process; None uses one process
+#    per CPU.  Figures of the same scenarios are kept together in each task, so a worker loads few results
+def renderFigures(figures, workers=None):
+    figures = sorted(figures, key=lambda figure: (figure[1], figure[0]))
+    if (workers == 1):
+        return list(map(renderFigure, figures))
+    batchSize = max(1, len(figures) // (4 * (workers or os.cpu_count())))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(renderFigure, figures, chunksize=batchSize))
+
+# every kind of figure for each scenario, and for all scenarios side by side, written to outputDirectory as <kind>-<label>.png
+#    and <kind>-all.png.  scenarios is [(label, directory), ...]; returns the file names
+def renderReport(scenarios, outputDirectory, workers=None, kinds=KINDS):
+    os.makedirs(outputDirectory, exist_ok=True)
+    figures = []
+    for kind in kinds:
+        figures += [(kind, [scenario], os.path.join(outputDirectory, kind + "-" + scenario[0] + ".png")) for scenario in scenarios]
+        if (len(scenarios) > 1):
+            figures.append((kind, list(scenarios), os.path.join(outputDirectory, kind + "-all.png")))
+    return renderFigures(figures, workers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="render report figures from results directories")
+    parser.add_argument('directories', nargs='+', help="results directories written by resultsWriter, one per scenario")
+    parser.add_argument('--output', default="report")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    scenarios = [(os.path.basename(os.path.normpath(directory)), directory) for directory in args.directories]
+    fileNames = renderReport(scenarios, args.output, args.workers)
+    print(len(fileNames), "figures written to", args.output)
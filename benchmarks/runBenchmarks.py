@@ -0,0 +1,217 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Benchmarks of the simulation hot paths on synthetic configurations, saved as JSON so that runs on different commits can be
+#    compared.
+#
+# A configuration scales the default parameters along four axes:
+#    carTypes      number of car models (the defaults' three are repeated with spread-out qualities)
+#    curveLength   number of entries in each depreciation curve, i.e. how many model years of each car are on the road
+#    groups        number of income groups
+#    years         number of years simulated before the year that is measured (cars accumulate as years go by)
+# Starting from BASE_CONFIGURATION, each axis in SCALING is varied on its own, giving a scaling curve per axis.
+#
+# For each configuration, each stage is timed (best of --repeat runs, each on a fresh copy of the same state) and then run once
+#    more under tracemalloc for peakBytes, its peak memory, and liveBytes and liveBlocks, the bytes and number of memory blocks
+#    it allocated that are still allocated when it returns.  liveBlocks is not a count of all allocations: blocks allocated and
+#    freed within the stage do not show in it, and tracemalloc has no way to count those.  The stages are:
+#    initializeYear           adding the new year to cars and population
+#    determineBuyers          buyers of every car at its initial price, in quality order, as determinePrices does it
+#    determinePriceAndBuyers  pricing and trading every car in quality order
+#    determinePrices          one full year of pricing (with the configured pricingBackend)
+# and the warm-up run itself is reported as stage runYears.  The numpy backend, and 'equilibrium' (the joint price solver, given
+#    as a backend here), only have the initializeYear and determinePrices stages.
+#
+#    python -m benchmarks.runBenchmarks                                  # writes benchmarks/results/<commit>.json
+#    python -m benchmarks.runBenchmarks --quick --compare old.json       # smaller grid, and print time ratios against old.json
+
+import argparse, copy, datetime, gc, json, os, platform, subprocess, sys, time, tracemalloc
+
+from model import genericModel, specificModel
+from model.defaultGlobalParameters import globalParameters as defaultGlobalParameters
+
+START_YEAR = 2022
+
+BASE_CONFIGURATION = {'carTypes': 3, 'curveLength': 11, 'groups': 7, 'years': 2, 'pricingBackend': 'dict'}
+SCALING = {'carTypes': [3, 6, 12], 'curveLength': [11, 21, 41], 'groups': [7, 14, 28], 'years': [2, 6, 18]}
+QUICK_SCALING = {'carTypes': [3, 6], 'curveLength': [11, 21], 'groups': [7, 14], 'years': [2, 6]}
+
+# default parameters scaled to a configuration.  Extra car types are copies of the default ones with their quality shifted, so
+#    the quality ladder gets denser rather than just longer; income groups are spread evenly over the default income range
+def syntheticParameters(configuration, baseParameters=None):
+    baseParameters = defaultGlobalParameters if (baseParameters is None) else baseParameters
+    # 'equilibrium' is measured like a backend, though its results differ; it takes no pricingBackend
+    if (configuration['pricingBackend'] == 'equilibrium'):
+        parameters = dict(baseParameters, pricingMode='equilibrium')
+        parameters.pop('pricingBackend', None)
+    else:
+        parameters = dict(baseParameters, pricingMode='sequential', pricingBackend=configuration['pricingBackend'])
+
+    baseTypes = list(baseParameters['carTypes'].items())
+    curveLength = configuration['curveLength']
+    parameters['carTypes'] = {}
+    for i in range(configuration['carTypes']):
+        (model, carType) = baseTypes[i % len(baseTypes)]
+        scale = 1 + 0.1 * (i // len(baseTypes))
+        curve = carType['depreciationCurve']
+        # stretch the default curve to curveLength entries, ending at 0 as every depreciation curve does
+        stretched = {age: curve[min(round(age * (len(curve)-1) / (curveLength-1)), len(curve)-1)] for age in range(curveLength)}
+        stretched[curveLength-1] = 0
+        parameters['carTypes'][model + ("" if (scale == 1) else str(i // len(baseTypes)))] = dict(carType,
+            initialQuality=carType['initialQuality'] * scale, depreciationCurve=stretched)
+
+    # income levels and utility peaks are interpolated between those of the default groups; other settings come from the nearest
+    baseGroups = sorted(baseParameters['peopleGroups'].items())
+    peaks = [group['utilityFunction'].peak() for (incomeLevel, group) in baseGroups]
+    if (None in peaks):
+        raise ValueError("synthetic groups interpolate utility peaks, so every base group needs a peaked utility curve")
+    numGroups = configuration['groups']
+    parameters['peopleGroups'] = {}
+    for i in range(numGroups):
+        position = i * (len(baseGroups)-1) / max(numGroups-1, 1)
+        (low, high, weight) = (int(position), min(int(position)+1, len(baseGroups)-1), position - int(position))
+        incomeLevel = round(baseGroups[low][0] * (1-weight) + baseGroups[high][0] * weight)
+        parameters['peopleGroups'][incomeLevel] = dict(baseGroups[round(position)][1], fraction=1.0/numGroups,
+                                                      utilityFunction=specificModel.peakedUtility(peaks[low] * (1-weight) + peaks[high] * weight))
+
+    # the model looks 5 years ahead at fuel costs, so extend the cost tables past the last simulated year
+    lastYear = START_YEAR + configuration['years'] + 1 + 5
+    for key in ('gasCost', 'electricityCost'):
+        costs = dict(baseParameters[key])
+        for year in range(max(costs.keys())+1, lastYear+1):
+            costs[year] = costs[year-1]
+        parameters[key] = costs
+    return parameters
+
+# the state at the start of the measured year, and the time taken to get there
+def warmUp(parameters, years):
+    cars = specificModel.initializeCars(START_YEAR, parameters)
+    population = specificModel.initializePopulation(cars, START_YEAR, parameters)
+    start = time.perf_counter()
+    population, cars = genericModel.runYears(population, cars, years, parameters)
+    return population, cars, time.perf_counter() - start
+
+# each stage is (setup, run): setup(population, cars, parameters) gets a private copy of the warmed-up state and returns the
+#    arguments for run, so only run is measured
+def setupInitializeYear(population, cars, parameters):
+    return (population, cars, parameters)
+
+def setupPricing(population, cars, parameters):
+    population, cars = genericModel.initializeYear(population, cars, parameters)
+    thisYear = sorted(population.keys())[-1]
+    for car in cars.values(): car['numSellers'] = 0
+    sortedCarNames = genericModel.carsSortedByQuality(cars, thisYear)
+    denominatorTable = genericModel.initializeDenominatorTable(sortedCarNames, genericModel.operatingCostTable(thisYear, parameters),
+                                                               parameters)
+    return (thisYear, population, cars, sortedCarNames, denominatorTable, parameters)
+
+def runDetermineBuyers(thisYear, population, cars, sortedCarNames, denominatorTable, parameters):
+    for carName in sortedCarNames:
+        genericModel.determineBuyers(thisYear, population, cars, sortedCarNames, carName, denominatorTable, parameters)
+
+def runDeterminePriceAndBuyers(thisYear, population, cars, sortedCarNames, denominatorTable, parameters):
+    for carName in sortedCarNames:
+        genericModel.determinePriceAndBuyers(thisYear, population, cars, sortedCarNames, carName, denominatorTable, parameters)
+
+def setupDeterminePrices(population, cars, parameters):
+    return genericModel.initializeYear(population, cars, parameters) + (parameters,)
+
+STAGES = {
+    'initializeYear': (setupInitializeYear, genericModel.initializeYear),
+    'determineBuyers': (setupPricing, runDetermineBuyers),
+    'determinePriceAndBuyers': (setupPricing, runDeterminePriceAndBuyers),
+    'determinePrices': (setupDeterminePrices, genericModel.determinePrices),
+}
+DICT_ONLY_STAGES = {'determineBuyers', 'determinePriceAndBuyers'}
+
+def measureStage(stage, population, cars, parameters, repeat):
+    (setup, run) = STAGES[stage]
+    times = []
+    for i in range(repeat):
+        args = setup(*copy.deepcopy((population, cars)), parameters)
+        gc.collect()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+
+    # memory is measured on a separate run, since tracemalloc slows everything down
+    args = setup(*copy.deepcopy((population, cars)), parameters)
+    gc.collect()
+    tracemalloc.start()
+    run(*args)
+    (liveBytes, peakBytes) = tracemalloc.get_traced_memory()
+    liveBlocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    return {'seconds': min(times), 'meanSeconds': sum(times) / len(times), 'peakBytes': peakBytes, 'liveBytes': liveBytes,
+            'liveBlocks': liveBlocks}
+
+def benchmarkConfiguration(configuration, repeat):
+    parameters = syntheticParameters(configuration)
+    population, cars, warmUpSeconds = warmUp(parameters, configuration['years'])
+    numCars = len(cars)
+    results = [{'stage': 'runYears', 'seconds': warmUpSeconds, 'secondsPerYear': warmUpSeconds / max(configuration['years'], 1)}]
+    for stage in STAGES.keys():
+        if ((configuration['pricingBackend'] != 'dict') and (stage in DICT_ONLY_STAGES)): continue
+        results.append(dict(measureStage(stage, population, cars, parameters, repeat), stage=stage))
+    return [dict(result, configuration=configuration, cars=numCars) for result in results]
+
+# BASE_CONFIGURATION with one axis at a time set to each of its values, for every backend; the base itself appears once
+def configurations(scaling, backends):
+    result = []
+    for pricingBackend in backends:
+        base = dict(BASE_CONFIGURATION, pricingBackend=pricingBackend)
+        result.append(base)
+        for (axis, values) in scaling.items():
+            result.extend(dict(base, **{axis: value}) for value in values if (value != base[axis]))
+    return result
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def resultKey(result):
+    return (json.dumps(result['configuration'], sort_keys=True), result['stage'])
+
+# print the time of each (configuration, stage) in newResults relative to the same one in oldResults
+def compareResults(oldResults, newResults):
+    old = {resultKey(result): result for result in oldResults['results']}
+    print("commit", oldResults.get('commit'), "->", newResults.get('commit'))
+    for result in newResults['results']:
+        if (resultKey(result) not in old): continue
+        ratio = result['seconds'] / old[resultKey(result)]['seconds'] if (old[resultKey(result)]['seconds'] > 0) else float('inf')
+        print("%-60s %-24s %10.4fs %7.2fx" % (resultKey(result)[0], result['stage'], result['seconds'], ratio))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths and save the results as JSON")
+    parser.add_argument('--output', help="JSON file to write (default benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="earlier JSON results to compare against")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage; the best is reported")
+    parser.add_argument('--backends', nargs='+', default=['dict', 'numpy'], help="any of dict, numpy, equilibrium")
+    parser.add_argument('--quick', action='store_true', help="smaller scaling grid")
+    args = parser.parse_args(argv)
+
+    commit = gitCommit()
+    results = []
+    for configuration in configurations(QUICK_SCALING if (args.quick) else SCALING, args.backends):
+        configurationResults = benchmarkConfiguration(configuration, args.repeat)
+        results.extend(configurationResults)
+        print(configuration, ", ".join("%s %.4fs" % (result['stage'], result['seconds']) for result in configurationResults),
+              file=sys.stderr)
+    report = {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'machine': platform.machine(), 'repeat': args.repeat, 'results': results}
+
+    output = args.output or os.path.join('benchmarks', 'results', (commit or 'unknown') + '.json')
+    if (os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("wrote", len(results), "results to", output)
+
+    if (args.compare):
+        with open(args.compare) as f:
+            compareResults(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
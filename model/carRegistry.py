@@ -0,0 +1,138 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Compact storage for the 'cars' data structure.  Each (model, model year, EV) gets an integer id when it is registered, and
+#    everything about the cars is stored column-wise, one entry per id:
+#
+#    registry.ids         {('luxury', 2021, False): 7, ...}
+#    registry.names       ['luxury-2022-False', ...]              -- the keys used in population and the documented cars structure
+#    registry.model       ['luxury', ...]
+#    registry.modelYear   array of int
+#    registry.isEV        array of bool (stored as bytes)
+#    registry.comparable  array of int: id of the same model and EV one model year older, or -1 if there is none
+#    registry.history     {2022: {'price': array of float, 'quality': array of float, 'batteryValue': array of float}, ...}
+#
+# Every registered car gets an entry in every year from the year it was registered, so history[year] has one entry for each
+#    car registered up to and including that year.  The columns are stdlib arrays, so numpyBackend can view them without copying.
+#
+# genericModel.initializeYear and determinePrices accept a CarRegistry wherever they accept a cars dict; registry.toCars() exports
+#    the documented JSON-like cars structure for analysis code.
+
+from array import array
+
+# the key of a car in the documented cars structure, for example 'luxury-2021-False'
+def carName(model, modelYear, isEV):
+    return model + "-" + str(modelYear) + "-" + str(isEV)
+
+class CarRegistry:
+    __slots__ = ('ids', 'names', 'model', 'modelYear', 'isEV', 'comparable', 'history')
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.model = []
+        self.modelYear = array('l')
+        self.isEV = array('b')
+        self.comparable = array('l')
+        self.history = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    # add a car first seen in year; returns its id
+    def register(self, model, modelYear, isEV, year, price, quality, batteryValue=0):
+        carId = len(self.names)
+        self.ids[(model, modelYear, isEV)] = carId
+        self.names.append(carName(model, modelYear, isEV))
+        self.model.append(model)
+        self.modelYear.append(modelYear)
+        self.isEV.append(isEV)
+        self.comparable.append(self.ids.get((model, modelYear-1, isEV), -1))
+        newer = self.ids.get((model, modelYear+1, isEV))
+        if (newer is not None):
+            self.comparable[newer] = carId
+
+        if (year not in self.history):
+            self.history[year] = {'price': array('d'), 'quality': array('d'), 'batteryValue': array('d')}
+        self.history[year]['price'].append(price)
+        self.history[year]['quality'].append(quality)
+        self.history[year]['batteryValue'].append(batteryValue)
+        return carId
+
+    # registry counterpart of genericModel.addYearToCar, for every registered car at once.  tables are
+    #    electricVehicles.yearTables(year): lists indexed by age, so the loop below does no dict lookups per car
+    def addYear(self, year, tables):
+        lastYear = self.history[year-1]
+        price = array('d')
+        quality = array('d')
+        batteryValue = array('d')
+        for carId in range(len(lastYear['price'])):
+            age = year - self.modelYear[carId]
+            table = tables[(self.model[carId], bool(self.isEV[carId]))]
+            if (age < len(table['quality'])):
+                quality.append(table['quality'][age])
+                batteryValue.append(table['batteryValue'][age])
+            else:
+                quality.append(0)
+                batteryValue.append(0)
+            # for the initial price this year, use the price of a car of this model and age from last year (or its own, as in
+            #    genericModel.addYearToCar)
+            comparable = self.comparable[carId]
+            if (comparable >= 0):
+                price.append(lastYear['price'][comparable])
+            else:
+                price.append(lastYear['price'][carId] if (quality[-1] > 0) else 0)
+        self.history[year] = {'price': price, 'quality': quality, 'batteryValue': batteryValue}
+
+    # ids of the cars in year, sorted by quality; ties keep registration order, as in genericModel.carsSortedByQuality
+    def sortedIds(self, year, reverse=True):
+        quality = self.history[year]['quality']
+        return sorted(range(len(quality)), key=quality.__getitem__, reverse=reverse)
+
+    # a registry of the cars registered by year, sharing this one's history up to year -- to continue a run from year differently,
+    #    leaving this run as it is (a run only ever writes the history of the year it is pricing)
+    def upToYear(self, year):
+        numCars = len(self.history[year]['price'])
+        registry = fromColumns(self.model[:numCars], self.modelYear[:numCars], self.isEV[:numCars], self.comparable[:numCars])
+        registry.history = {pastYear: columns for (pastYear, columns) in self.history.items() if (pastYear <= year)}
+        return registry
+
+    # the documented JSON-like cars structure, built from the columns
+    def toCars(self):
+        cars = {}
+        for (carId, name) in enumerate(self.names):
+            cars[name] = {'model': self.model[carId], 'year': self.modelYear[carId], 'EV': bool(self.isEV[carId]), 'history': {}}
+        for (year, columns) in sorted(self.history.items()):
+            for carId in range(len(columns['price'])):
+                cars[self.names[carId]]['history'][year] = {'price': columns['price'][carId], 'quality': columns['quality'][carId],
+                                                           'batteryValue': columns['batteryValue'][carId]}
+        return cars
+
+# build a registry from a cars dict, for example from specificModel.initializeCars.  Each car is registered in the first year of
+#    its history, in the dict's order within a year
+def fromCars(cars):
+    registry = CarRegistry()
+    for year in sorted({year for car in cars.values() for year in car['history'].keys()}):
+        # cars registered in earlier years come first in the columns, in id order
+        if (len(registry) > 0):
+            registry.history[year] = {key: array('d') for key in ('price', 'quality', 'batteryValue')}
+            for (carId, name) in enumerate(registry.names):
+                history = cars[name]['history'].get(year, {'price': 0, 'quality': 0, 'batteryValue': 0})
+                for (key, column) in registry.history[year].items(): column.append(history[key])
+        for car in cars.values():
+            if (min(car['history'].keys()) == year):
+                registry.register(car['model'], car['year'], car['EV'], year, **car['history'][year])
+    return registry
+
+# a registry with these columns (one entry per car id) and no history yet, e.g. read back from a file
+def fromColumns(model, modelYear, isEV, comparable):
+    registry = CarRegistry()
+    registry.model = [str(m) for m in model]
+    registry.modelYear.extend(int(y) for y in modelYear)
+    registry.isEV.extend(bool(ev) for ev in isEV)
+    registry.comparable.extend(int(c) for c in comparable)
+    for carId in range(len(registry.model)):
+        key = (registry.model[carId], registry.modelYear[carId], bool(registry.isEV[carId]))
+        registry.ids[key] = carId
+        registry.names.append(carName(*key))
+    return registry
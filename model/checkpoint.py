@@ -0,0 +1,84 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Checkpoints of the simulation state at the end of a year, so a long run can be resumed after a crash, or forked at some year
+#    into several policy variants without re-running the common years.
+#
+# A checkpoint is one compressed numpy .npz file holding just what the next year needs, stored column-wise:
+#    version, year                                            -- CHECKPOINT_VERSION, and the year the state is for
+#    carModel, carModelYear, carIsEV, carComparable            -- CarRegistry columns, one entry per car id
+#    price, quality, batteryValue                             -- the cars' history for that year
+#    incomeLevels, groupFractions                             -- income groups, in row order
+#    fraction, owned                                          -- that year's OwnershipMatrix
+#    ownedOrder                                               -- runs kept in dicts only: (group, car id) of each owned car, in the
+#                                                                order of the population dict
+# loadCheckpoint returns the run in the form it was saved from, holding only that year: a CarRegistry and an OwnershipMatrix, or
+#    cars and population dicts in their original order (the dict engine's sums run in dict order), and continuing from them gives
+#    results bit-identical to the uninterrupted run on the same path.
+
+import os
+from array import array
+
+import numpy as np
+
+from model import carRegistry, ownershipMatrix
+
+CHECKPOINT_VERSION = 1
+
+def checkpointFileName(directory, year):
+    return os.path.join(directory, "checkpoint-" + str(year) + ".npz")
+
+# save the state of population and cars for year (default: the latest year)
+def saveCheckpoint(fileName, population, cars, year=None):
+    year = sorted(population.keys())[-1] if (year is None) else year
+    extra = {}
+    # dicts are converted one year at a time, so a checkpoint costs the same in every year
+    if (not isinstance(cars, carRegistry.CarRegistry)):
+        cars = carRegistry.fromCars({carName: dict(car, history={year: car['history'][year]}) for (carName, car) in cars.items()
+                                     if (year in car['history'])})
+    if (not isinstance(population, ownershipMatrix.OwnershipMatrix)):
+        carIds = {carName: carId for (carId, carName) in enumerate(cars.names)}
+        extra['ownedOrder'] = np.array([(g, carIds[carName]) for (g, group) in enumerate(population[year].values())
+                                        for carName in group['cars'].keys()], dtype=int).reshape(-1, 2)
+        population = ownershipMatrix.fromPopulation({year: population[year]}, cars)
+    numCars = population.fraction[year].shape[1]
+
+    with open(fileName, 'wb') as f:
+        np.savez_compressed(f, version=CHECKPOINT_VERSION, year=year,
+            carModel=np.array(cars.model[:numCars]), carModelYear=np.array(cars.modelYear[:numCars]),
+            carIsEV=np.array(cars.isEV[:numCars], dtype=bool), carComparable=np.array(cars.comparable[:numCars]),
+            price=np.array(cars.history[year]['price'][:numCars]), quality=np.array(cars.history[year]['quality'][:numCars]),
+            batteryValue=np.array(cars.history[year]['batteryValue'][:numCars]),
+            incomeLevels=np.array(population.incomeLevels), groupFractions=np.array([population.groupFractions[incomeLevel]
+                                                                                     for incomeLevel in population.incomeLevels]),
+            fraction=population.fraction[year], owned=population.owned[year], **extra)
+
+# the (population, cars) saved in fileName: an OwnershipMatrix and a CarRegistry, or dicts if the run was kept in dicts
+def loadCheckpoint(fileName):
+    with np.load(fileName, allow_pickle=False) as data:
+        if (int(data['version']) != CHECKPOINT_VERSION):
+            raise ValueError("checkpoint " + fileName + " has version " + str(int(data['version'])) + ", expected " +
+                             str(CHECKPOINT_VERSION))
+        year = int(data['year'])
+
+        cars = carRegistry.fromColumns(data['carModel'], data['carModelYear'], data['carIsEV'], data['carComparable'])
+        cars.history[year] = {key: array('d', data[key].tobytes()) for key in ('price', 'quality', 'batteryValue')}
+
+        incomeLevels = [int(incomeLevel) for incomeLevel in data['incomeLevels']]
+        population = ownershipMatrix.OwnershipMatrix(incomeLevels, dict(zip(incomeLevels, (float(f) for f in data['groupFractions']))),
+                                                     cars.names)
+        population.fraction[year] = np.array(data['fraction'])
+        population.owned[year] = np.array(data['owned'])
+        if ('ownedOrder' in data.files):
+            populationYear = {incomeLevel: {'fraction': population.groupFractions[incomeLevel], 'cars': {}} for incomeLevel in incomeLevels}
+            for (g, carId) in data['ownedOrder']:
+                populationYear[incomeLevels[g]]['cars'][cars.names[carId]] = {'fraction': float(population.fraction[year][g, carId])}
+            return {year: populationYear}, cars.toCars()
+    return population, cars
+
+# an observer for genericModel.runYears that writes a checkpoint into directory after every year
+def checkpointWriter(directory):
+    os.makedirs(directory, exist_ok=True)
+    def writeCheckpoint(year, population, cars):
+        saveCheckpoint(checkpointFileName(directory, year), population, cars, year)
+    return writeCheckpoint
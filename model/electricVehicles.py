@@ -0,0 +1,76 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# The EV dimension of the cars: which new cars are offered each year, what their batteries are worth as they age, and the
+#    mandate on the share of new cars that are EVs.  Uses these globalParameters (documented at the top of genericModel):
+#    carTypes[model]['batteryCost']   value of a new battery for this model at batteryPriceCurve 1.0
+#    batteryPriceCurve                {year: factor}, the price of new batteries relative to batteryCost
+#    batteryDepreciationCurve         {age: factor}, the value left in a battery of this age
+#    newCarEVMandate                  {year: share}, the smallest share of a model's new cars that must be EVs
+# Parameters without newCarEVMandate describe a market with no EVs, as before EVs were modelled.
+#
+# The quality of an EV is the quality of the car plus the value of its battery, while the car is on the road (a car whose
+#    depreciation curve has reached 0 is scrapped with its battery).  A new EV is priced at the car's initial quality plus the
+#    battery.  Both are looked up in per-year tables indexed by age, built once for all cars in a year.
+#
+# The mandate is applied per model: new EVs are priced first (their battery puts them above the gas car of the same model in the
+#    quality order), and then no more than share (1 - mandate) / mandate times the EVs sold of the new gas car may be sold; if
+#    more people want it, its price rises until demand fits.  From a mandate of 1, new gas cars are no longer offered.
+
+def evEnabled(parameters):
+    return 'newCarEVMandate' in parameters
+
+def mandate(year, parameters):
+    return parameters['newCarEVMandate'].get(year, 0) if (evEnabled(parameters)) else 0
+
+# a value from a {year: value} curve, holding its first and last values before and after the years it covers
+def curveValue(curve, year):
+    return curve[min(max(year, min(curve.keys())), max(curve.keys()))]
+
+# (model, isEV) of the new cars offered in year, in the order they are added
+def newCarTypes(year, parameters):
+    offered = []
+    for model in parameters['carTypes'].keys():
+        if (mandate(year, parameters) < 1): offered.append((model, False))
+        if (evEnabled(parameters)): offered.append((model, True))
+    return offered
+
+def newBatteryValue(year, model, parameters):
+    return parameters['carTypes'][model]['batteryCost'] * curveValue(parameters['batteryPriceCurve'], year)
+
+# (price, quality, batteryValue) of a new car of this model in year
+def newCarValues(year, model, isEV, parameters):
+    quality = parameters['carTypes'][model]['initialQuality']
+    if (not isEV):
+        return quality, quality, 0
+    batteryValue = newBatteryValue(year, model, parameters)
+    return quality + batteryValue, quality + batteryValue, batteryValue
+
+# For every (model, isEV), lists indexed by the age of the car in year: {(model, isEV): {'quality': [...], 'batteryValue': [...]}}.
+#    Past the end of the lists, quality and battery value are 0
+def yearTables(year, parameters):
+    tables = {}
+    for (model, carType) in parameters['carTypes'].items():
+        curve = carType['depreciationCurve']
+        quality = [carType['initialQuality'] * curve[age] if (age in curve) else 0 for age in range(max(curve.keys())+1)]
+        tables[(model, False)] = {'quality': quality, 'batteryValue': [0] * len(quality)}
+        if (not evEnabled(parameters)): continue
+        batteryCurve = parameters['batteryDepreciationCurve']
+        batteryValue = [newBatteryValue(year - age, model, parameters) * batteryCurve.get(age, 0) if (quality[age] > 0) else 0
+                        for age in range(len(quality))]
+        tables[(model, True)] = {'quality': [q + b for (q, b) in zip(quality, batteryValue)], 'batteryValue': batteryValue}
+    return tables
+
+# (quality, batteryValue) of a car of this model, EV and age, from yearTables
+def agedValues(tables, model, isEV, age):
+    table = tables[(model, isEV)]
+    if (age >= len(table['quality'])):
+        return 0, 0
+    return table['quality'][age], table['batteryValue'][age]
+
+# how many of a model's new gas cars may be sold, given how many of its new EVs were sold; None when there is no limit
+def gasCarCap(year, evsSold, parameters):
+    share = mandate(year, parameters)
+    if (share <= 0):
+        return None
+    return evsSold * (1 - share) / share
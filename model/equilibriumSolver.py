@@ -0,0 +1,189 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Joint market clearing: all of a year's used-car prices are solved together, instead of one approximate adjustment per car in
+#    quality order.  Selected by setting globalParameters['pricingMode'] to 'equilibrium' (the default, 'sequential', is the
+#    original pricing in genericModel / numpyBackend).  Each iteration works on dense [group, car, car] arrays, so it is far slower
+#    than sequential pricing with many cars or income groups.
+#
+# Choice model.  An owner of car o in income group g either keeps it, or sells it and buys one higher-quality car c that the group
+#    has some utility for.  With the same weights as the sequential pricing,
+#       keep[g, o]   = exp((utility[g, o] - operatingCost[g, o]) / scale[o])          (0 if the car has no utility for the group)
+#       buy[g, o, c] = exp((utility[g, c] - price[c] + price[o] - operatingCost[g, c] + operatingCost[g, o] - transactionCost) / scale[o])
+#    each option is chosen with probability weight / (keep + sum of buy weights) -- the sequential pricing's chain of "buy this
+#    car, or else consider the next one down" is the same thing, when all prices are known.  scale[o] is utilityScale times the
+#    price of o at the start of the year, with a floor of 500, as in the sequential pricing.
+# Market clearing.  Demand for c is the owners of lower-quality cars choosing c; supply is the owners of c choosing anything
+#    else.  New cars are sold at their list price to whoever wants them.  For every used car the price solves demand = supply, or
+#    is 0 if supply exceeds demand even at 0 (the unsold cars are retired).  Cars that nobody owns keep their price.
+#    Under the EV mandate (see electricVehicles) a new gas car may sell no more than ratio times the new EVs of its model sold;
+#    as in sequential pricing, its price rises above the list price until demand fits the cap, and stays at the list price if
+#    demand is below it.  Both sides of the cap move with the prices, so they are solved together with the used cars.
+# Solver.  Newton iteration on excess demand for all used-car prices at once, with the Jacobian computed analytically from one
+#    vectorized evaluation of the choice probabilities, and step halving while far from the solution.  It starts
+#    from the prices initializeYear gives the year -- last year's price for a car of the same model and age -- so in a steady
+#    market only a few iterations are needed.  Stops when every |demand - supply| is below globalParameters['equilibriumTolerance']
+#    (default 1e-9, in fractions of the population), or after globalParameters['equilibriumMaxIterations'] (default 50).
+#    Iteration counts go to runMetrics.  Failing to converge is recorded as a modelLog 'nonConvergence' event and logged as a
+#    warning, and the year keeps the unconverged prices.
+
+import numpy as np
+
+from model import electricVehicles, modelLog, numpyBackend, runMetrics
+
+DEFAULT_TOLERANCE = 1e-9
+DEFAULT_MAX_ITERATIONS = 50
+
+# available[g, o, c] is True when owners of o in group g may buy c: c is above o in the quality order, and has utility for g
+def availableOptions(market):
+    numCars = len(market['price'])
+    higherQuality = np.tri(numCars, numCars, -1, dtype=bool)
+    return higherQuality[np.newaxis, :, :] & (market['utility'] > 0)[:, np.newaxis, :]
+
+# the caps of the EV mandate on this year's new gas cars: market['capped'] is True for a capped gas car c, which may sell no more
+#    than market['capRatio'][c] times the sales of the EV market['capEV'][c] of the same model.  market['floor'] is the lowest
+#    price of each car: its list price for a capped car, 0 for the others
+def addSalesCaps(year, market, parameters):
+    numCars = len(market['price'])
+    (capped, capEV, capRatio) = (np.zeros(numCars, dtype=bool), np.zeros(numCars, dtype=int), np.zeros(numCars))
+    ratio = electricVehicles.gasCarCap(year, 1, parameters)
+    for ((model, isEV), c) in market['newCars'].items():
+        if ((not isEV) and (ratio is not None) and ((model, True) in market['newCars'])):
+            (capped[c], capEV[c], capRatio[c]) = (True, market['newCars'][(model, True)], ratio)
+    market.update({'capped': capped, 'capEV': capEV, 'capRatio': capRatio, 'floor': np.where(capped, market['price'], 0)})
+
+# log-weights of every option for the given prices: logBuy[g, o, c] and logKeep[g, o], -inf where an option is not available
+def logWeights(market, price, scale, parameters):
+    utility = market['utility']
+    operatingCost = market['operatingCost']
+    available = market['available']
+    exponent = (utility[:, np.newaxis, :] - price[np.newaxis, np.newaxis, :] + price[np.newaxis, :, np.newaxis] -
+                operatingCost[:, np.newaxis, :] + operatingCost[:, :, np.newaxis] - parameters['transactionCost'])
+    logBuy = np.where(available, exponent / scale[np.newaxis, :, np.newaxis], -np.inf)
+    logKeep = np.where(utility > 0, (utility - operatingCost) / scale[np.newaxis, :], -np.inf)
+    return logBuy, logKeep
+
+# choice probabilities buy[g, o, c] and keep[g, o] (keep is 1 for owners with no option at all)
+def choiceProbabilities(market, price, scale, parameters):
+    (logBuy, logKeep) = logWeights(market, price, scale, parameters)
+    largest = np.maximum(logBuy.max(axis=2), logKeep)                 # subtracted before exp, so nothing overflows
+    noOption = np.isneginf(largest)
+    largest[noOption] = 0
+    buy = np.exp(logBuy - largest[:, :, np.newaxis])
+    keep = np.exp(logKeep - largest)
+    total = keep + buy.sum(axis=2)
+    total[noOption] = 1
+    keep[noOption] = 1
+    return buy / total[:, :, np.newaxis], keep / total
+
+# demand and supply of every car at these prices
+def marketBalance(market, price, scale, parameters):
+    fraction = market['fraction']
+    (buy, keep) = choiceProbabilities(market, price, scale, parameters)
+    return {'buy': buy, 'keep': keep, 'demand': (fraction[:, :, np.newaxis] * buy).sum(axis=(0, 1)),
+            'supply': (fraction * (1 - keep)).sum(axis=0)}
+
+# excess demand of every car: demand - supply, and for a capped gas car, demand - the cap
+def excessDemand(market, balance):
+    demand = balance['demand']
+    return np.where(market['capped'], demand - market['capRatio'] * demand[market['capEV']], demand - balance['supply'])
+
+# Jacobian of excess demand with respect to the prices, restricted to the cars in solved.  Prices enter the choice of an owner of
+#    o only through the buy weights, as (price[o] - price[c]) / scale[o], so with p = buy[g, o, :]:
+#       d buy[g, o, c] / d price[k] = buy[g, o, c] / scale[o] * (p[k] - [c == k] + [o == k] keep[g, o])
+#       d keep[g, o] / d price[k]   = keep[g, o] / scale[o] * (p[k] - [o == k] (1 - keep[g, o]))
+#    Nobody owns a new car yet, so the cap of a capped car only adds the demand for its EV, which is never solved (c != k)
+def excessDemandJacobian(market, balance, scale, solved):
+    (buy, keep) = (balance['buy'][:, :, solved], balance['keep'])
+    ownerWeight = market['fraction'] / scale[np.newaxis, :]                    # [g, o]
+    weightedBuy = ownerWeight[:, :, np.newaxis] * buy
+    keepWeight = (ownerWeight * keep)[:, solved]                             # [g, k] for owners of solved car k
+    sellerChoice = np.einsum('gk,gkc->ck', keepWeight, buy[:, solved, :])   # [c, k]: owners of k buying c, weighted by keep
+    demandJacobian = np.einsum('goc,gok->ck', weightedBuy, buy) - np.diag(weightedBuy.sum(axis=(0, 1))) + sellerChoice
+    supplyJacobian = -sellerChoice.T + np.diag((keepWeight * (1 - keep[:, solved])).sum(axis=0))
+    capped = market['capped'][solved]
+    if (capped.any()):
+        evs = market['capEV'][solved][capped]
+        evBuy = balance['buy'][:, :, evs]                                      # [g, o, e]
+        evJacobian = (np.einsum('goe,gok->ek', ownerWeight[:, :, np.newaxis] * evBuy, buy) +
+                      np.einsum('gk,gke->ek', keepWeight, evBuy[:, solved, :]))
+        supplyJacobian[capped] = market['capRatio'][solved][capped][:, np.newaxis] * evJacobian
+    return demandJacobian - supplyJacobian
+
+# cars whose price is cleared: used cars that somebody owns, and capped new gas cars
+def solvedCars(market):
+    return (~market['isNew'] & (market['fraction'].sum(axis=0) > 0)) | market['capped']
+
+# excess demand of the solved cars, not counting cars held at their lowest price with excess supply (used cars at 0 are
+#    retired; capped cars at their list price sell less than the cap)
+def residuals(market, price, balance, solved):
+    excess = excessDemand(market, balance)
+    held = (price <= market['floor']) & (excess < 0)
+    return np.where(solved & ~held, excess, 0)
+
+# solve the year's prices, starting from market['price']; returns the prices, the market balance at those prices, and the number
+#    of iterations
+def solvePrices(year, market, parameters):
+    tolerance = parameters.get('equilibriumTolerance', DEFAULT_TOLERANCE)
+    maxIterations = parameters.get('equilibriumMaxIterations', DEFAULT_MAX_ITERATIONS)
+    price = market['price'].copy()
+    scale = price * parameters['utilityScale']
+    scale[scale <= 500] = 500
+    addSalesCaps(year, market, parameters)
+    solved = solvedCars(market)
+    market['available'] = availableOptions(market)
+
+    balance = marketBalance(market, price, scale, parameters)
+    excess = residuals(market, price, balance, solved)
+    iterations = 0
+    while ((np.abs(excess).max(initial=0) > tolerance) and (iterations < maxIterations)):
+        # Newton step for the cars not held at their lowest price; cars nobody wants at all fall straight to it
+        free = solved & ~((price <= market['floor']) & (excessDemand(market, balance) < 0))
+        step = np.zeros(len(price))
+        jacobian = excessDemandJacobian(market, balance, scale, free)
+        step[free] = np.linalg.lstsq(jacobian, -excess[free], rcond=None)[0]
+        noDemand = free & (balance['demand'] <= 0)
+        step[noDemand] = market['floor'][noDemand] - price[noDemand]
+        # the step is shortened (keeping its direction) so no price moves by more than half its scale, and halved while it makes
+        #    things worse -- far from the solution a full Newton step can overshoot
+        step /= max(1, np.abs(step / scale).max(initial=0) / 0.5)
+        for halving in range(8):
+            newPrice = np.maximum(price + step, market['floor'])
+            newBalance = marketBalance(market, newPrice, scale, parameters)
+            newExcess = residuals(market, newPrice, newBalance, solved)
+            if (np.square(newExcess).sum() < np.square(excess).sum()): break
+            step /= 2
+        (price, balance, excess) = (newPrice, newBalance, newExcess)
+        iterations += 1
+
+    runMetrics.count(market['metrics'], 'iterations', iterations)
+    runMetrics.count(market['metrics'], 'pairs', (iterations + 1) * int(market['available'].sum()))
+    if (iterations >= maxIterations):
+        residual = float(np.abs(excess).max(initial=0))
+        modelLog.recordEvent('nonConvergence', year=year, iterations=iterations, residual=residual)
+        modelLog.logger.warning("equilibrium prices for %s did not converge in %d iterations (largest |demand - supply| %.3g); "
+                                "keeping the unconverged prices", year, iterations, residual)
+    return price, balance, iterations
+
+# same inputs and outputs as genericModel.determinePrices: population and cars are updated for the latest year.  cars may be a cars
+#    dict or a CarRegistry, and population a population dict or (with a CarRegistry) an OwnershipMatrix
+def determinePrices(population, cars, parameters, runState=None):
+    thisYear = sorted(population.keys())[-1]
+    start = runMetrics.clock()
+    market = numpyBackend.marketArrays(thisYear, population, cars, parameters, runState)
+    metrics = market['metrics']
+    start = runMetrics.endStage(metrics, 'operatingCosts', start)
+
+    (price, balance, iterations) = solvePrices(thisYear, market, parameters)
+    start = runMetrics.endStage(metrics, 'adjustPrice', start)
+    for residual in residuals(market, price, balance, solvedCars(market)):
+        runMetrics.recordResidual(metrics, float(residual))
+
+    # everyone makes the choice they would make at the solved prices
+    fraction = market['fraction']
+    bought = fraction[:, :, np.newaxis] * balance['buy']
+    newFraction = fraction * balance['keep'] + bought.sum(axis=1)
+    market.update({'price': price, 'fraction': newFraction, 'owned': newFraction > 0})
+    population, cars = numpyBackend.writeBack(thisYear, population, cars, market, balance['supply'])
+    runMetrics.endStage(metrics, 'updateOwnership', start)
+    return population, cars
@@ -41,11 +41,26 @@
 #   'batteryPriceCurve': {2022: 1.0, 2023: 0.93, ...},
 #   'newCarEVMandate': {2022: 0.1, ... 2035: 1.0, 2036: 1.0, ...},
 # }
+# (the battery and mandate parameters are used as described in electricVehicles.py)
 
-import itertools, functools, copy, math
+import itertools, functools, math
+
+from model import carRegistry, electricVehicles, modelLog, runMetrics
 
 globalParameters = {}                             # the program that loads us will replace this
 
+# Every function that needs the parameters takes them as an optional last argument, so that several scenarios can run side by
+#    side; if it is omitted, the module-level globalParameters above is used
+def _parameters(parameters): return globalParameters if (parameters is None) else parameters
+
+# what a run carries from one year to the next besides population and cars: its metrics (see runMetrics).  Passed to
+#    initializeYear and determinePrices like parameters -- one per run, never shared between runs; runYears makes one if it is not
+#    given, and the year functions make a fresh one each call (losing nothing but the metrics of initializeYear)
+def newRunState():
+    return {'metrics': runMetrics.newRunMetrics()}
+
+def _runState(runState): return newRunState() if (runState is None) else runState
+
 def _scaledExp(scale, x): return math.exp(x/scale)
 
 def scaledExpCurried(scale):
@@ -61,61 +76,98 @@ def carsSortedByQuality(cars, year, reverse=True):
     return allModels
 
 # for a particular car (in the 'cars' data structure with key "model-year-isEV"), update the dict by adding
-#    year to the history key
-def addYearToCar(year, cars, car):
-    age = year - car['year']
-    initialValue = globalParameters['carTypes'][car['model']]['initialQuality']
-
-    depreciatedValue = initialValue * globalParameters['carTypes'][car['model']]['depreciationCurve'][age] if (
-        age in globalParameters['carTypes'][car['model']]['depreciationCurve']) else 0
-    # for the initial price this year, use the price of a car of this model and age from last year's history
+#    year to the history key.  tables are electricVehicles.yearTables(year), built once for all the cars of the year
+def addYearToCar(year, cars, car, parameters=None, tables=None):
+    tables = electricVehicles.yearTables(year, _parameters(parameters)) if (tables is None) else tables
+    (depreciatedValue, batteryValue) = electricVehicles.agedValues(tables, car['model'], car['EV'], year - car['year'])
+    # for the initial price this year, use the price of a car of this model and age from last year's history (or, when there was
+    #    none -- the first used year of a new kind of car, such as the first EVs -- this car's own price last year)
     # As part of the simulation, a later function will update this initial price based on market conditions
-    key = car['model'] + "-" + str(car['year']-1) + "-" + str(car['EV'])    # for example, 'luxury-2021-False'
-    comparableCar = cars[key] if key in cars else {'history': {year-1: {'price': 0}}}
+    key = carRegistry.carName(car['model'], car['year']-1, car['EV'])    # for example, 'luxury-2021-False'
+    if (key in cars):
+        price = cars[key]['history'][year-1]['price']
+    else:
+        price = car['history'][year-1]['price'] if (depreciatedValue > 0) else 0
     # now add new year to car history
     car['history'][year] = {
-        'price': comparableCar['history'][year-1]['price'],
+        'price': price,
         'quality': depreciatedValue,
-        'batteryValue': 0
+        'batteryValue': batteryValue
     }
 
 # for a car that is new this model year, returns the relevant entry for the cars data structure
-def addNewCar(year, isEV, model):
-    key = model + "-" + str(year) + "-" + str(isEV)    # e.g. "luxury-2022-False"
-    quality = globalParameters['carTypes'][model]['initialQuality']
-    value = {'model': model, 'year': year, 'EV': isEV, 'history': {year: {'price': quality, 'quality': quality, 'batteryValue': 0}}}
+def addNewCar(year, isEV, model, parameters=None):
+    key = carRegistry.carName(model, year, isEV)    # e.g. "luxury-2022-False"
+    (price, quality, batteryValue) = electricVehicles.newCarValues(year, model, isEV, _parameters(parameters))
+    value = {'model': model, 'year': year, 'EV': isEV, 'history': {year: {'price': price, 'quality': quality, 'batteryValue': batteryValue}}}
     return {key: value}
 
+# copy of one year of the population, two levels deep -- the market simulation only changes the car fractions, so there is no
+#    need for a general-purpose deepcopy of every dict
+def copyPopulationYear(populationYear):
+    return {incomeLevel: {'fraction': group['fraction'], 'cars': {carName: {'fraction': val['fraction']} for (carName, val) in group['cars'].items()}}
+            for (incomeLevel, group) in populationYear.items()}
+
 # the first step for setting prices and doing sales for a new year is to create the new year in the population data structure, and
-#    for each car, add the new year to the history
-def initializeYear(population, cars):
-    # just copy the most recent year forward; then other functions will price and purchase cars
+#    for each car, add the new year to the history.  cars may be a cars dict or a CarRegistry; population may be a population dict
+#    or an OwnershipMatrix (whose cars must then be in a CarRegistry)
+def initializeYear(population, cars, parameters=None, runState=None):
+    metrics = runMetrics.beginYear(_runState(runState)['metrics'])
+    start = runMetrics.clock()
+    parameters = _parameters(parameters)
     lastYear = sorted(population.keys())[-1]
+    tables = electricVehicles.yearTables(lastYear+1, parameters)          # quality and battery value by model, EV and age
+
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        cars.addYear(lastYear+1, tables)
+        for (model, isEV) in electricVehicles.newCarTypes(lastYear+1, parameters):
+            (price, quality, batteryValue) = electricVehicles.newCarValues(lastYear+1, model, isEV, parameters)
+            cars.register(model, lastYear+1, isEV, lastYear+1, price, quality, batteryValue)
+    else:
+        addThisYearToCar = functools.partial(addYearToCar, lastYear+1, cars, parameters=parameters, tables=tables)   # prefill first argument of addYearToCar
+        # list() causes map object to evaluate
+        list(map(addThisYearToCar, list(cars.values())))              # every value in the cars dict is a dict representing one model-year
+
+        # now add new cars for this year: gas cars (unless the EV mandate has reached 100%) and EVs
+        [cars.update(addNewCar(lastYear+1, isEV, model, parameters)) for (model, isEV) in electricVehicles.newCarTypes(lastYear+1, parameters)]
+
+    # just copy the most recent year forward; then other functions will price and purchase cars
     # to be a true pure function we should copy population and add the new data to the copy; but I
     #    don't think that buys us anything...  A later function will change car ownership statistics by
     #    simulating the market for the new year
-    population[lastYear+1] = copy.deepcopy(population[lastYear])
+    if (isinstance(population, dict)):
+        population[lastYear+1] = copyPopulationYear(population[lastYear])
+    else:
+        population.advanceYear()           # OwnershipMatrix: copy-on-advance of the latest matrices, after the new cars are registered
 
-    addThisYearToCar = functools.partial(addYearToCar, lastYear+1, cars)   # prefill first argument of addYearToCar
-    # list() causes map object to evaluate
-    list(map(addThisYearToCar, list(cars.values())))              # every value in the cars dict is a dict representing one model-year
+    runMetrics.endStage(metrics, 'initializeYear', start)
+    return population, cars
 
-    # now add new cars for this year
-    [cars.update(addNewCar(lastYear+1, False, model)) for model in globalParameters['carTypes'].keys()]
 
-    return population, cars
 
 
 
+# to follow one car and income group through the calculations, use modelLog.setTrace([("luxury-2020-False", 100000)])
 
 
-debugCarName = "luxury-2020-False"
-debugIncomeLevel = 100000
+OPERATING_COST_YEARS = 5           # buyers consider this many years of operating costs
 
+# operating cost of a car of this model (EV or not) in one year, before discounting
+def yearlyOperatingCost(model, isEV, year, parameters=None):
+    parameters = _parameters(parameters)
+    costThisYear = 0
 
-def operatingCosts(cars, carName, incomeLevel, thisYear):
-    model = cars[carName]['model']
-    isEV = cars[carName]['EV']
+    if (isEV):
+        costThisYear += 10000 / parameters['carTypes'][model]['mpkwh'] * parameters['electricityCost'][year]
+        costThisYear += parameters['carTypes'][model]['evRepairs']
+    else:
+        costThisYear += 10000 / parameters['carTypes'][model]['mpg'] * parameters['gasCost'][year]
+        costThisYear += parameters['carTypes'][model]['gasRepairs']
+    return costThisYear
+
+# operating costs of a car of this model (EV or not) over the next 5 years, discounted at the rate of this income group
+def modelOperatingCosts(model, isEV, incomeLevel, thisYear, parameters=None):
+    parameters = _parameters(parameters)
     # at some point I may try age-dependent operating costs, but not yet
     #modelYear = cars[carName]['year']
     #age = thisYear - modelYear
@@ -123,109 +175,185 @@ def operatingCosts(cars, carName, incomeLevel, thisYear):
     # consider 5 years of operating costs in deciding what to buy
     operatingCosts = 0
 
-    for year in range(thisYear, thisYear+5):
-        discount = pow(1 - globalParameters['peopleGroups'][incomeLevel]['discountRate'], year - thisYear)
-        costThisYear = 0
-
-        if (isEV):
-            costThisYear += 10000 / globalParameters['carTypes'][model]['mpkwh'] * globalParameters['electricityCost'][year]
-            costThisYear += globalParameters['carTypes'][model]['evRepairs']
-        else:
-            costThisYear += 10000 / globalParameters['carTypes'][model]['mpg'] * globalParameters['gasCost'][year]
-            costThisYear += globalParameters['carTypes'][model]['gasRepairs']
-
-        operatingCosts += discount * costThisYear
+    for year in range(thisYear, thisYear+OPERATING_COST_YEARS):
+        discount = pow(1 - parameters['peopleGroups'][incomeLevel]['discountRate'], year - thisYear)
+        operatingCosts += discount * yearlyOperatingCost(model, isEV, year, parameters)
     return operatingCosts
 
+def operatingCosts(cars, carName, incomeLevel, thisYear, parameters=None):
+    return modelOperatingCosts(cars[carName]['model'], cars[carName]['EV'], incomeLevel, thisYear, parameters)
+
+# Operating costs depend only on model, EV, income level and year, but the pricing loops need them for every pair of cars.  This
+#    table holds every combination for one year, computed once; build it at the start of a pricing pass and use it throughout.
+# Format: {incomeLevel: {(model, isEV): cost, ...}, ...}
+def operatingCostTable(year, parameters=None):
+    parameters = _parameters(parameters)
+    return {incomeLevel: {(model, isEV): modelOperatingCosts(model, isEV, incomeLevel, year, parameters)
+                          for model in parameters['carTypes'].keys() for isEV in (False, True)}
+            for incomeLevel in parameters['peopleGroups'].keys()}
+
+# The denominator of a buy probability is the chance of keeping the owned car plus the chance of buying any car from the
+#    candidate up to (but not including) the owned car.  Summing that range afresh for every candidate makes a year cost
+#    O(groups x cars^3), so instead we remember, for each income group and owned car, the terms and running sums of that
+#    range, accumulated upward from the owned car.  The denominator for any candidate is then a single lookup.
+# Every term uses the price of a car no higher in quality than the current candidate, and determinePrices does not change
+#    those prices until that car has been priced itself -- so entries computed on demand stay valid for the rest of the year.
+# The table also carries 'salesCaps', the most of each new gas car that may be sold under the EV mandate (see electricVehicles),
+#    set as the new EV of the same model is priced.
+# The year's metrics (runMetrics) are kept in the table too, as 'metrics'.
+# Format: {'rank': {carName: 0, ...}, 'parameters': parameters, 'salesCaps': {carName: 0.012, ...}, 'metrics': {...},
+#          'groups': {incomeLevel: {'operatingCosts': {(model, isEV): 1234, ...}, 'utility': {carName: 5678, ...},
+#                                   'owned': {carName: {'utilityScale': 1500, 'terms': [...], 'sums': [0, ...]}, ...}}}}
+# where 'operatingCosts' is this group's part of operatingCostTable(year)
+def initializeDenominatorTable(sortedCarNames, costTable, parameters=None, metrics=None):
+    return {'rank': {carName: rank for (rank, carName) in enumerate(sortedCarNames)}, 'operatingCosts': costTable,
+            'parameters': _parameters(parameters), 'salesCaps': {}, 'groups': {},
+            'metrics': runMetrics.newYearMetrics() if (metrics is None) else metrics}
+
+# per-income-group part of the denominator table; cached values of utility for each car
+def groupDenominatorTable(denominatorTable, incomeLevel):
+    if (incomeLevel not in denominatorTable['groups']):
+        denominatorTable['groups'][incomeLevel] = {'operatingCosts': denominatorTable['operatingCosts'][incomeLevel],
+                                                   'utility': {}, 'owned': {}}
+    return denominatorTable['groups'][incomeLevel]
+
+def groupOperatingCosts(groupTable, cars, carName):
+    return groupTable['operatingCosts'][(cars[carName]['model'], cars[carName]['EV'])]
+
+def cachedUtility(groupTable, cars, carName, utilityFunction, year):
+    if (carName not in groupTable['utility']):
+        groupTable['utility'][carName] = utilityFunction(cars[carName]['history'][year]['quality'])
+    return groupTable['utility'][carName]
+
+# how many of the cars ranked from firstRank up to (not including) lastRank have some utility for this group: a difference of
+#    counts of useful cars above each rank, built the first time the group needs them
+def usefulCarsBetween(groupTable, cars, sortedCarNames, utilityFunction, year, firstRank, lastRank):
+    if ('usefulAbove' not in groupTable):
+        usefulAbove = [0]
+        for carName in sortedCarNames:
+            usefulAbove.append(usefulAbove[-1] + (cachedUtility(groupTable, cars, carName, utilityFunction, year) != 0))
+        groupTable['usefulAbove'] = usefulAbove
+    return groupTable['usefulAbove'][lastRank] - groupTable['usefulAbove'][firstRank]
+
+# for owners (in one income group) of otherCarName, make sure the running sums reach up to the car at rank firstRank, and return
+#    the entry: entry['terms'][k-1] is the term for the car k places above otherCarName; entry['sums'][k] is the sum of the k terms
+#    for the cars immediately above it
+def ownedCarDenominators(denominatorTable, year, cars, sortedCarNames, incomeLevel, otherCarName, firstRank):
+    parameters = denominatorTable['parameters']
+    groupTable = groupDenominatorTable(denominatorTable, incomeLevel)
+    utilityFunction = parameters['peopleGroups'][incomeLevel]['utilityFunction']
+    if (otherCarName not in groupTable['owned']):
+        priceOtherCar = cars[otherCarName]['history'][year]['price']
+        utilityScale = priceOtherCar * parameters['utilityScale']
+        if (utilityScale <= 500):
+            # low-priced carrs leads to an unrealistically small scale; and if price is zero, scale is zero, and
+            #    we have to avoid divide-by-zero
+            utilityScale = 500
+        groupTable['owned'][otherCarName] = {'utilityScale': utilityScale, 'price': priceOtherCar, 'terms': [], 'sums': [0],
+            'operatingCosts': groupOperatingCosts(groupTable, cars, otherCarName)}
+    entry = groupTable['owned'][otherCarName]
+
+    otherRank = denominatorTable['rank'][otherCarName]
+    if (otherRank - firstRank >= len(entry['sums'])):
+        scaledExp = scaledExpCurried(entry['utilityScale'])    # scaledExp(x) = exp(x/scale)
+        priceOtherCar = entry['price']
+        operatingCostsOtherCar = entry['operatingCosts']
+        transactionCost = parameters['transactionCost']
+        for thirdRank in range(otherRank - len(entry['sums']), firstRank - 1, -1):
+            thirdCarName = sortedCarNames[thirdRank]
+            priceThirdCar = cars[thirdCarName]['history'][year]['price']
+            operatingCostsThirdCar = groupOperatingCosts(groupTable, cars, thirdCarName)
+            term = scaledExp(cachedUtility(groupTable, cars, thirdCarName, utilityFunction, year) - priceThirdCar + priceOtherCar -
+                             operatingCostsThirdCar + operatingCostsOtherCar - transactionCost)
+            entry['terms'].append(term)
+            entry['sums'].append(entry['sums'][-1] + term)
+    return entry
+
 # how many owners of lower-quality cars would buy this car if the price were at its initial value?  Later the price, and the number
-#    of buyers, will be adjusted
-def determineBuyers(year, population, cars, sortedCarNames, carName):
-    priceThisCar = cars[carName]['history'][year]['price']
+#    of buyers, will be adjusted.  denominatorTable carries running sums between calls in the same year (see above); pass the
+#    same table for every car priced in a year
+def determineBuyers(year, population, cars, sortedCarNames, carName, denominatorTable=None, parameters=None):
+    if (denominatorTable is None):
+        denominatorTable = initializeDenominatorTable(sortedCarNames, operatingCostTable(year, parameters), parameters)
+    parameters = denominatorTable['parameters']
     qualityThisCar = cars[carName]['history'][year]['quality']
     # cannot calculate operating costs yet because discount rates depend on income level
-    lowerQualityCarNames = sortedCarNames[sortedCarNames.index(carName)+1:]
-    transactionCost = globalParameters['transactionCost']    # may later try making it proportional to prices
-    print("***", carName)
+    thisRank = denominatorTable['rank'][carName]
+    rank = denominatorTable['rank']
+    modelLog.logger.debug("pricing %s", carName)
 
     buyerMemory = {}                 # for efficiency only - remember some intermediate results and return them
     numBought = 0
+    numPairs = 0
     for (incomeLevel, peopleGroup) in population[year].items():
-        operatingCostsThisCar = operatingCosts(cars, carName, incomeLevel, year)
-        utilityFunction = globalParameters['peopleGroups'][incomeLevel]['utilityFunction']    #[thing['utilityFunction'] for thing in globalParameters['peopleGroups'] if thing['income'] == incomeLevel][0]
-        #utilityScale = globalParameters['utilityScale'] * cars[carName]['history'][year]['quality']
-        #scaledExp = scaledExpCurried(utilityScale)    # scaledExp(x) = exp(x/scale)
+        utilityFunction = parameters['peopleGroups'][incomeLevel]['utilityFunction']    #[thing['utilityFunction'] for thing in globalParameters['peopleGroups'] if thing['income'] == incomeLevel][0]
         # if the people group has no utility for a car this expensive (or this cheap), skip them
         if (utilityFunction(qualityThisCar) == 0): continue
+        groupTable = groupDenominatorTable(denominatorTable, incomeLevel)
+        traced = modelLog.tracedCars(incomeLevel)       # empty unless tracing is on for this group
 
-        for otherCarName in lowerQualityCarNames:
-            if (otherCarName not in peopleGroup['cars'].keys()): continue
+        # only owners of lower-quality cars can buy this car; visiting just the cars this group owns, in quality order, keeps the
+        #    cost proportional to what is owned rather than to every car on the market
+        for otherCarName in sorted((name for name in peopleGroup['cars'].keys() if (rank[name] > thisRank)), key=rank.__getitem__):
+            numPairs += 1
 
-            priceOtherCar = cars[otherCarName]['history'][year]['price']
-            utilityScale = priceOtherCar * globalParameters['utilityScale']
-            if (utilityScale <= 500):
-                # low-priced carrs leads to an unrealistically small scale; and if price is zero, scale is zero, and
-                #    we have to avoid divide-by-zero
-                utilityScale = 500
+            entry = ownedCarDenominators(denominatorTable, year, cars, sortedCarNames, incomeLevel, otherCarName, thisRank)
+            utilityScale = entry['utilityScale']
             scaledExp = scaledExpCurried(utilityScale)    # scaledExp(x) = exp(x/scale)
-            qualityOtherCar = cars[otherCarName]['history'][year]['quality']
-            operatingCostsOtherCar = operatingCosts(cars, otherCarName, incomeLevel, year)
-            numerator = scaledExp(utilityFunction(qualityThisCar) - priceThisCar + priceOtherCar - operatingCostsThisCar + 
-                                  operatingCostsOtherCar - transactionCost)
-            if (utilityFunction(qualityOtherCar) > 0):
-                denominator = scaledExp(utilityFunction(qualityOtherCar)- operatingCostsOtherCar)   # probability of keeping other car
+            numAbove = denominatorTable['rank'][otherCarName] - thisRank    # number of cars from carName down to otherCarName
+            # the numerator is the term for carName itself in the running sums
+            numerator = entry['terms'][numAbove-1]
+            utilityOtherCar = cachedUtility(groupTable, cars, otherCarName, utilityFunction, year)
+            if (utilityOtherCar > 0):
+                denominator = scaledExp(utilityOtherCar - entry['operatingCosts'])   # probability of keeping other car
             else:
                 denominator = 0                                             # other car has no utility, no chance of keeping it
-            if (otherCarName == debugCarName and incomeLevel == debugIncomeLevel):
-                print("   ***", "Initial denominator =", denominator, "; Initial fraction", peopleGroup['cars'][otherCarName]['fraction'],
-                      "; numerator car", carName)
+            if (traced and otherCarName in traced):
+                modelLog.trace("%s %s: initial denominator %s; initial fraction %s; numerator car %s", otherCarName, incomeLevel,
+                               denominator, peopleGroup['cars'][otherCarName]['fraction'], carName)
             # now add to denominator probability of buying any other higher-quality car ((up to and including carName) -- if this
             #    buyer has positive utility for any car of higher quality than carName, that transaction has already been calculated
-            higherQualityCarNames = sortedCarNames[sortedCarNames.index(carName):sortedCarNames.index(otherCarName)]
-            for thirdCarName in higherQualityCarNames:
-                priceThirdCar = cars[thirdCarName]['history'][year]['price']
-                qualityThirdCar = cars[thirdCarName]['history'][year]['quality']
-                operatingCostsThirdCar = operatingCosts(cars, thirdCarName, incomeLevel, year)
-                denominator += scaledExp(utilityFunction(qualityThirdCar) - priceThirdCar + priceOtherCar - operatingCostsThirdCar +
-                                         operatingCostsOtherCar - transactionCost)
-                if (otherCarName == debugCarName and incomeLevel == debugIncomeLevel):
-                    print("      ***", "Denominator includes", thirdCarName)
+            denominator += entry['sums'][numAbove]
             # now numerator/denominator is probability owner of thirdCarName chose to buy carName
-            #print("***", peopleGroup)
             assert(numerator <= denominator)
-            if (otherCarName == debugCarName and incomeLevel == debugIncomeLevel):
-                print(   "***","Final numerator and denominator:", numerator, denominator)
+            if (traced and otherCarName in traced):
+                modelLog.trace("%s %s: final numerator and denominator %s %s", otherCarName, incomeLevel, numerator, denominator)
 
             numBuyer = peopleGroup['cars'][otherCarName]['fraction'] * numerator / denominator
             numBought += numBuyer
-            # if (carName == debugCarName):
-            #     print("   ***", "Owners of", otherCarName, ": ", peopleGroup['cars'][otherCarName]['fraction'], "tentatively buy", 
-            #        peopleGroup['cars'][otherCarName]['fraction'] * numerator / denominator)
-            #     print("      ", numerator, denominator)
-            # if (otherCarName == debugCarName):
-            #     print("***","Owners of", debugCarName, ": ", peopleGroup['cars'][otherCarName]['fraction'], "tentatively sell", 
-            #        peopleGroup['cars'][otherCarName]['fraction'] * numerator / denominator)
             if (incomeLevel not in buyerMemory): buyerMemory[incomeLevel] = {'cars': []}
             buyerMemory[incomeLevel]['cars'].append( {'model': otherCarName, 'numerator': numerator, 'denominator': denominator,
                                                       'utilityFunction': utilityFunction, 'utilityScale': utilityScale, 'numBuyer': numBuyer} )
         # end of loop over cars owned by this peopleGroup
     # end of loop over people groups
+    runMetrics.count(denominatorTable['metrics'], 'pairs', numPairs)
     return numBought, buyerMemory
 
 
 # for a single model-year-EV, decide an equilibrium price and which owners of lower-quality cars choose to buy at that price
-def determinePriceAndBuyers(year, population, cars, sortedCarNames, carName):
+def determinePriceAndBuyers(year, population, cars, sortedCarNames, carName, denominatorTable=None, parameters=None):
+    parameters = _parameters(parameters)
+    if (denominatorTable is None):
+        denominatorTable = initializeDenominatorTable(sortedCarNames, operatingCostTable(year, parameters), parameters)
     # the scale of fluctuations is set to a fraction of the quality of this car; this scale of fluctuation is used for all
     #    calculations involving purchase of this car
-    utilityScale = globalParameters['utilityScale'] * cars[carName]['history'][year]['quality']
+    utilityScale = parameters['utilityScale'] * cars[carName]['history'][year]['quality']
     scaledExp = scaledExpCurried(utilityScale)    # scaledExp(x) = exp(scale*x)
 
     # for all owners of a lower-quality car, decide if they choose to buy this car (at its current price)
     # we maintain some intermediate results in buyerMemory, for efficiency only
-    (numBuyers, buyerMemory) = determineBuyers(year, population, cars, sortedCarNames, carName)
+    metrics = denominatorTable['metrics']
+    start = runMetrics.clock()
+    (numBuyers, buyerMemory) = determineBuyers(year, population, cars, sortedCarNames, carName, denominatorTable, parameters)
+    start = runMetrics.endStage(metrics, 'determineBuyers', start)
     # if (carName == debugCarName):
     #     print("\n\n*** buyerMemory", buyerMemory,"\n\n")
 
-    if (cars[carName]['year'] == year):               # this is a new car -- all buyers will buy at pre-set price
+    salesCaps = denominatorTable['salesCaps']
+    if (carName in salesCaps):                        # a new gas car under the EV mandate -- no more than the cap can be sold
+        numSellers = min(numBuyers, salesCaps[carName])
+        if (numSellers == 0): buyerMemory = {}        # none at all this year
+    elif (cars[carName]['year'] == year):             # this is a new car -- all buyers will buy at pre-set price
         numSellers = numBuyers                        # this causes deltaP (calculated momentarily) to be zero
     else:
         # number of sellers is already determined by those who have decided to buy a higher-quality car
@@ -258,9 +386,11 @@ def determinePriceAndBuyers(year, population, cars, sortedCarNames, carName):
     #     print("***", "Saved numSellers for", carName, "is", numSellers, "tentative buyers is", numBuyers, "deltaP is", deltaP)
     # to this point we haven't changed population or cars; now update cars with the new price
     cars[carName]['history'][year]['price'] += deltaP
-    # now update population for buyers of this car, and move their lower-quality car to the must-sell list
-    totalBuy = 0
+    start = runMetrics.endStage(metrics, 'adjustPrice', start)
+    # now decide how much each group's owners of each lower-quality car trade in for this one ...
+    trades = []
     for incomeLevel in buyerMemory.keys():
+        traced = modelLog.tracedCars(incomeLevel)       # empty unless tracing is on for this group
         #print("***", "Population[", incomeLevel, "]['cars']:\n", population[year][incomeLevel]['cars'].keys())
         #print("\n***", "buyerMemory[", incomeLevel, "]['cars']:\n", [c['model'] for c in buyerMemory[incomeLevel]['cars']])
         for previouslyOwnedCarRecord in buyerMemory[incomeLevel]['cars']:
@@ -269,8 +399,8 @@ def determinePriceAndBuyers(year, population, cars, sortedCarNames, carName):
             numerator = previouslyOwnedCarRecord['numerator'] * scaledExp(-deltaP)       # adjust buy probability by new price
             denominator = previouslyOwnedCarRecord['denominator']
             tradeProbability = numerator / denominator
-            if (previousModelName == debugCarName and incomeLevel == debugIncomeLevel):
-                print("***","final numerator and trade probability", numerator, tradeProbability)
+            if (traced and previousModelName in traced):
+                modelLog.trace("%s %s: final numerator and trade probability %s %s", previousModelName, incomeLevel, numerator, tradeProbability)
             if (tradeProbability > 1):
                 # for some low-valued cars, there are more sellers than even possible buyers
                 tradeProbability = 1            # this will leave a few cars being sold but not bought, i.e. retired
@@ -282,37 +412,82 @@ def determinePriceAndBuyers(year, population, cars, sortedCarNames, carName):
             if (utilityFunction(cars[previousModelName]['history'][year]['quality']) == 0):
                 # we know carName has positive utility, or this income level would not show up in buyer memory.  Now see if there is any
                 #    lower-quality car that still has utility
-                carsToTest = sortedCarNames[sortedCarNames.index(carName)+1:sortedCarNames.index(previousModelName)]
-                if (not any([utilityFunction(cars[testCarName]['history'][year]['quality']) for testCarName in carsToTest])):
-                    print("!!! Increasing trade probability of useless car from", tradeProbability,"to 1;", year, incomeLevel, previousModelName)
+                groupTable = groupDenominatorTable(denominatorTable, incomeLevel)
+                if (usefulCarsBetween(groupTable, cars, sortedCarNames, utilityFunction, year,
+                                      denominatorTable['rank'][carName]+1, denominatorTable['rank'][previousModelName]) == 0):
+                    modelLog.recordEvent('retirement', year=year, incomeLevel=incomeLevel, car=previousModelName, buyer=carName,
+                                         tradeProbability=tradeProbability)
                     tradeProbability = 1
-            numToTrade = population[year][incomeLevel]['cars'][previousModelName]['fraction'] * tradeProbability
-            # if (previousModelName == debugCarName):
-            #     print("***", "Owners of", previousModelName, ": ", population[year][incomeLevel]['cars'][previousModelName]['fraction'],
-            #        "finally sell", numToTrade)
-            #     print("   ", numerator, denominator)
-            if (tradeProbability > 0.999):
-                del(population[year][incomeLevel]['cars'][previousModelName])      # all cars sold, delete from data structure
-            else:
-                population[year][incomeLevel]['cars'][previousModelName]['fraction'] -= numToTrade  # leaving number not traded
-            # if (previousModelName == debugCarName):
-            #     print("***", "Leaving", population[year][incomeLevel]['cars'][previousModelName]['fraction'])
-            if (carName not in population[year][incomeLevel]['cars']):
-                population[year][incomeLevel]['cars'][carName] = {'fraction': 0}
-            population[year][incomeLevel]['cars'][carName]['fraction'] += numToTrade
-            # if (carName == debugCarName):
-            #     print("***", "Previous owners of", previousModelName, "now own", numToTrade, "of", carName)
-            #     print("   ", numerator, denominator)
-            cars[previousModelName]['numSellers'] += numToTrade
-            totalBuy += numToTrade
+            trades.append((incomeLevel, previousModelName, tradeProbability))
+    if (carName in salesCaps):
+        # the buy probabilities at the adjusted price only approximately sell numSellers; under the EV mandate the cap is a limit,
+        #    so scale the trades down to it
+        tentative = sum(population[year][incomeLevel]['cars'][previousModelName]['fraction'] * tradeProbability
+                        for (incomeLevel, previousModelName, tradeProbability) in trades)
+        if (tentative > numSellers):
+            trades = [(incomeLevel, previousModelName, tradeProbability * numSellers / tentative)
+                      for (incomeLevel, previousModelName, tradeProbability) in trades]
+
+    # ... and update population for those buyers, and move their lower-quality car to the must-sell list
+    totalBuy = 0
+    for (incomeLevel, previousModelName, tradeProbability) in trades:
+        numToTrade = population[year][incomeLevel]['cars'][previousModelName]['fraction'] * tradeProbability
+        # if (previousModelName == debugCarName):
+        #     print("***", "Owners of", previousModelName, ": ", population[year][incomeLevel]['cars'][previousModelName]['fraction'],
+        #        "finally sell", numToTrade)
+        #     print("   ", numerator, denominator)
+        if (tradeProbability > 0.999):
+            del(population[year][incomeLevel]['cars'][previousModelName])      # all cars sold, delete from data structure
+        else:
+            population[year][incomeLevel]['cars'][previousModelName]['fraction'] -= numToTrade  # leaving number not traded
+        # if (previousModelName == debugCarName):
+        #     print("***", "Leaving", population[year][incomeLevel]['cars'][previousModelName]['fraction'])
+        if (carName not in population[year][incomeLevel]['cars']):
+            population[year][incomeLevel]['cars'][carName] = {'fraction': 0}
+        population[year][incomeLevel]['cars'][carName]['fraction'] += numToTrade
+        # if (carName == debugCarName):
+        #     print("***", "Previous owners of", previousModelName, "now own", numToTrade, "of", carName)
+        #     print("   ", numerator, denominator)
+        cars[previousModelName]['numSellers'] += numToTrade
+        totalBuy += numToTrade
+    if (cars[carName]['EV'] and (cars[carName]['year'] == year)):
+        # the new gas car of this model (priced next, as it has no battery) may only sell in proportion to this EV
+        gasCarName = carRegistry.carName(cars[carName]['model'], year, False)
+        cap = electricVehicles.gasCarCap(year, totalBuy, parameters)
+        if ((cap is not None) and (gasCarName in cars)):
+            salesCaps[gasCarName] = cap
+    runMetrics.endStage(metrics, 'updateOwnership', start)
+    runMetrics.recordResidual(metrics, totalBuy - numSellers)
     if (abs(totalBuy - numSellers) > 0.005):
-        print("!!! Discrepancy for", carName, "sellers:", numSellers, "adjusted buyers:", totalBuy, "deltaP:", deltaP)
+        modelLog.recordEvent('discrepancy', year=year, car=carName, sellers=numSellers, buyers=totalBuy, deltaP=deltaP)
     # if (carName == debugCarName):
     #     print("***", "final buyers of", carName, ":", totalBuy)
     return (population, cars)
 
+DEFAULT_PRICING_MODE = 'sequential'
+
 # given this year's population and last year's prices, determine this year's prices to balance supply and demand
-def determinePrices(population, cars):
+#    globalParameters['pricingMode'] chooses the economics: 'sequential' (the default) prices one car at a time in quality order,
+#    'equilibrium' solves all prices jointly (see equilibriumSolver; much slower with many cars or income groups).  For sequential
+#    pricing, globalParameters['pricingBackend'] chooses the implementation: 'dict' (the default, and the reference) or 'numpy'
+#    (the array-based version in numpyBackend); the equilibrium solver always uses arrays, so giving a pricingBackend with it is a
+#    ValueError.  A CarRegistry is always priced with arrays.  runState is the run's, see newRunState
+def determinePrices(population, cars, parameters=None, runState=None):
+    parameters = _parameters(parameters)
+    runState = _runState(runState)
+    if (parameters.get('pricingMode', DEFAULT_PRICING_MODE) == 'equilibrium'):
+        if ('pricingBackend' in parameters):
+            raise ValueError("pricingBackend only applies to sequential pricing; equilibrium pricing always uses arrays")
+        from model import equilibriumSolver
+        population, cars = equilibriumSolver.determinePrices(population, cars, parameters, runState)
+        runMetrics.endYear(runState['metrics'], sorted(population.keys())[-1])
+        return population, cars
+    if ((parameters.get('pricingBackend', 'dict') == 'numpy') or isinstance(cars, carRegistry.CarRegistry)):
+        from model import numpyBackend          # imported here so the dict path does not need numpy
+        population, cars = numpyBackend.determinePrices(population, cars, parameters, runState)
+        runMetrics.endYear(runState['metrics'], sorted(population.keys())[-1])
+        return population, cars
+
     thisYear = sorted(population.keys())[-1]                # this function runs after population has been updated for this year
 
     # Create a field in cars to keep track of number that must be sold because owner has already decided to buy a higher-quality car
@@ -322,9 +497,28 @@ def determinePrices(population, cars):
     #    Except for new cars, #sellers is already set, as number of people who own this car who have already committed to buying 
     #    a higher-quality car
     sortedCarNames = carsSortedByQuality(cars, thisYear)    # this function runs after cars has been updated for this year
+    metrics = runMetrics.currentYear(runState['metrics'])
+    start = runMetrics.clock()
+    denominatorTable = initializeDenominatorTable(sortedCarNames, operatingCostTable(thisYear, parameters), parameters, metrics)
+    runMetrics.endStage(metrics, 'operatingCosts', start)
     for carName in sortedCarNames:
-        (population, cars) = determinePriceAndBuyers(thisYear, population, cars, sortedCarNames, carName)
+        (population, cars) = determinePriceAndBuyers(thisYear, population, cars, sortedCarNames, carName, denominatorTable, parameters)
+
+    runMetrics.count(metrics, 'denominatorTerms', sum(len(entry['terms']) for groupTable in denominatorTable['groups'].values()
+                                                      for entry in groupTable['owned'].values()))
+    runMetrics.endYear(runState['metrics'], thisYear)
+    return population, cars
 
+# the year loop: advance numYears, pricing each year.  After each year every function in observers is called as
+#    observer(year, population, cars), e.g. to write checkpoints, results or runMetrics.  runState (see newRunState) is made
+#    here if it is not given; give one to read it from an observer, e.g. runMetrics.metricsWriter
+def runYears(population, cars, numYears, parameters=None, observers=(), runState=None):
+    runState = _runState(runState)
+    for i in range(numYears):
+        population, cars = determinePrices(*initializeYear(population, cars, parameters, runState), parameters, runState)
+        thisYear = sorted(population.keys())[-1]
+        for observer in observers:
+            observer(thisYear, population, cars)
     return population, cars
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Income groups read from a file, for runs with many more groups than the 7 of defaultGlobalParameters -- e.g. one per
+#    percentile of census microdata.  The file is CSV with a header row and one row per group:
+#
+#    incomeLevel,fraction,utilityPeak,discountRate
+#    10000,0.01,2000,0.10
+#    10500,0.01,2100,0.10
+#    ...
+#
+# incomeLevel is an integer (the group's key, as in peopleGroups), fraction is its share of the population (the shares must add
+#    up to 1), and the group's utility function is specificModel.peakedUtility(utilityPeak).
+#
+# With many groups, run on the array path -- a CarRegistry and an OwnershipMatrix -- where income groups are a dimension of the
+#    pricing arrays (see numpyBackend) instead of a loop over dicts:
+#
+#    parameters = dict(globalParameters, peopleGroups=incomeGroups.loadPeopleGroups("groups.csv"))
+#    population, cars = specificModel.initializeArrays(2022, parameters)
+#    population, cars = genericModel.runYears(population, cars, 30, parameters)
+
+import csv, math
+
+from model import specificModel
+
+COLUMNS = ['incomeLevel', 'fraction', 'utilityPeak', 'discountRate']
+
+# peopleGroups (the globalParameters entry) described by the file
+def loadPeopleGroups(fileName):
+    peopleGroups = {}
+    with open(fileName, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in COLUMNS if (column not in (reader.fieldnames or []))]
+        if (missing):
+            raise ValueError(fileName + " has no column " + ", ".join(missing))
+        for row in reader:
+            incomeLevel = int(row['incomeLevel'])
+            if (incomeLevel in peopleGroups):
+                raise ValueError(fileName + " has income level " + str(incomeLevel) + " more than once")
+            peopleGroups[incomeLevel] = {'fraction': float(row['fraction']),
+                                         'utilityFunction': specificModel.peakedUtility(float(row['utilityPeak'])),
+                                         'discountRate': float(row['discountRate'])}
+    total = sum(group['fraction'] for group in peopleGroups.values())
+    if (not math.isclose(total, 1, abs_tol=1e-6)):
+        raise ValueError("the fractions in " + fileName + " add up to " + str(total) + ", not 1")
+    return peopleGroups
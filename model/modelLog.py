@@ -0,0 +1,50 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Logging, tracing and events for the model, in place of print statements.
+#
+# Log messages go through the standard logging module, to the logger 'model' (progress and events) and 'model.trace' (tracing of
+#    individual cars); configure them with logging.basicConfig(level=...) or the like.  Nothing is shown by default below WARNING.
+#
+# Tracing follows the buy/sell calculation for chosen (car, income group) pairs, e.g.
+#    modelLog.setTrace([('luxury-2020-False', 100000)])
+# With no pairs set, the pricing loops only test an empty set once per income group, so tracing costs nothing when it is off.
+#
+# Events are notable things the market simulation had to fix up: 'discrepancy' (buyers and sellers of a car did not balance
+#    after the price adjustment) and 'retirement' (owners of a car with no utility left were made to sell all of them).  Each
+#    event is counted in counters, passed to every function in eventSinks as a dict {'kind': ..., ...}, and logged at INFO.
+
+import collections, logging
+
+logger = logging.getLogger('model')
+traceLogger = logging.getLogger('model.trace')
+
+counters = collections.Counter()            # number of events of each kind since the last resetCounters()
+eventSinks = []                             # functions called with each event dict
+
+NOT_TRACED = frozenset()
+_tracedCars = {}                            # {incomeLevel: frozenset of car names being traced}
+
+# trace the given (carName, incomeLevel) pairs; an empty list turns tracing off
+def setTrace(pairs):
+    _tracedCars.clear()
+    for (carName, incomeLevel) in pairs:
+        _tracedCars[incomeLevel] = _tracedCars.get(incomeLevel, NOT_TRACED) | {carName}
+
+# car names traced for this income group; an empty (false) set if none, so callers can skip all tracing with one test
+def tracedCars(incomeLevel):
+    return _tracedCars.get(incomeLevel, NOT_TRACED)
+
+def trace(message, *args):
+    traceLogger.debug(message, *args)
+
+def recordEvent(kind, **fields):
+    counters[kind] += 1
+    if (eventSinks):
+        event = dict(fields, kind=kind)
+        for sink in eventSinks:
+            sink(event)
+    logger.info("%s %s", kind, fields)
+
+def resetCounters():
+    counters.clear()
@@ -0,0 +1,93 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Monte Carlo ensembles: run many members, each with parameters sampled from distributions on top of
+#    model/defaultGlobalParameters.py, and summarize each year as percentile bands across the members.
+#
+# The uncertainty is described as data, e.g.
+#    {'utilityScale':    {'distribution': 'uniform', 'low': 0.1, 'high': 0.2},
+#     'transactionCost': {'distribution': 'normal', 'mean': 500, 'sd': 100},
+#     'gasCost':         {'distribution': 'randomWalk', 'drift': 0.02, 'volatility': 0.1},
+#     'discountRate':    {'distribution': 'lognormal', 'sigma': 0.2}}
+# Scalar parameters take 'uniform', 'normal' or 'lognormal' (mu, sigma of the log) draws.  Yearly cost paths ('gasCost',
+#    'electricityCost') take 'randomWalk': the default path times exp of a random walk whose yearly steps are normal with mean
+#    drift and sd volatility, starting from the first year.  'discountRate' is one 'lognormal' factor per member that multiplies
+#    every income group's discount rate.
+#
+# Member i samples from numpy's generator seeded with (seed, i), so a member's parameters do not depend on how many members there
+#    are or how they are spread over processes.  Members are run through scenarioSweep, in batches of several members per task
+#    so large ensembles do not pay for one round trip per member; the per-year summaries (scenarioSweep.yearSummary) are
+#    gathered into one array [member, year, metric] and reduced to percentile bands.
+
+import csv, math, os
+
+import numpy as np
+
+from model import scenarioSweep
+from model.defaultGlobalParameters import globalParameters as defaultGlobalParameters
+
+METRICS = ['ownedShare', 'newCarShare', 'evShare', 'meanPrice', 'meanQuality']
+PERCENTILES = [5, 25, 50, 75, 95]
+
+def sampleScalar(spec, rng):
+    if (spec['distribution'] == 'uniform'):
+        return float(rng.uniform(spec['low'], spec['high']))
+    if (spec['distribution'] == 'normal'):
+        return float(rng.normal(spec['mean'], spec['sd']))
+    if (spec['distribution'] == 'lognormal'):
+        return float(rng.lognormal(spec.get('mu', 0), spec['sigma']))
+    raise ValueError("unknown distribution " + str(spec['distribution']))
+
+def samplePath(spec, rng, basePath):
+    if (spec['distribution'] != 'randomWalk'):
+        raise ValueError("yearly paths take a 'randomWalk' distribution, not " + str(spec['distribution']))
+    years = sorted(basePath.keys())
+    steps = rng.normal(spec['drift'], spec['volatility'], len(years) - 1)
+    factors = np.exp(np.concatenate([[0], np.cumsum(steps)]))
+    return {year: basePath[year] * float(factor) for (year, factor) in zip(years, factors)}
+
+# overrides (for scenarioSweep.mergeParameters) for one member
+def sampleOverrides(uncertainty, seed, member, baseParameters=None):
+    baseParameters = defaultGlobalParameters if (baseParameters is None) else baseParameters
+    rng = np.random.default_rng([seed, member])
+    overrides = {}
+    for key in sorted(uncertainty.keys()):                  # a fixed order, so the draws do not depend on how the dict was built
+        spec = uncertainty[key]
+        if (key in ('gasCost', 'electricityCost')):
+            overrides[key] = samplePath(spec, rng, baseParameters[key])
+        elif (key == 'discountRate'):
+            factor = sampleScalar(spec, rng)
+            overrides['peopleGroups'] = {incomeLevel: {'discountRate': group['discountRate'] * factor}
+                                         for (incomeLevel, group) in baseParameters['peopleGroups'].items()}
+        else:
+            overrides[key] = sampleScalar(spec, rng)
+    return overrides
+
+# run numMembers members and return (years, values), where values[member, year, metric] follows the order of METRICS.  workers=1
+#    runs in this process; None uses one process per CPU
+def runEnsemble(uncertainty, numMembers, seed=0, startYear=2022, numYears=10, workers=None, baseParameters=None):
+    baseParameters = defaultGlobalParameters if (baseParameters is None) else baseParameters
+    members = [sampleOverrides(uncertainty, seed, member, baseParameters) for member in range(numMembers)]
+    batchSize = max(1, math.ceil(numMembers / (4 * (workers or os.cpu_count()))))
+    rows = scenarioSweep.runSweep(members, startYear, numYears, workers, baseParameters, batchSize)
+    years = sorted({row['year'] for row in rows})
+    values = np.empty((numMembers, len(years), len(METRICS)))
+    for row in rows:
+        values[row['scenario'], years.index(row['year'])] = [row[metric] for metric in METRICS]
+    return years, values
+
+# percentile bands across members, yielded a year at a time as one dict per metric:
+#    {'year': 2023, 'metric': 'evShare', 'mean': ..., 'p5': ..., 'p25': ..., ...}
+def percentileBands(years, values, percentiles=PERCENTILES):
+    for (y, year) in enumerate(years):
+        bands = np.percentile(values[:, y, :], percentiles, axis=0)     # [percentile, metric]
+        means = values[:, y, :].mean(axis=0)
+        for (m, metric) in enumerate(METRICS):
+            yield dict({'year': year, 'metric': metric, 'mean': float(means[m])},
+                       **{'p' + str(p): float(bands[k, m]) for (k, p) in enumerate(percentiles)})
+
+def writeBands(bands, fileName, percentiles=PERCENTILES):
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['year', 'metric', 'mean'] + ['p' + str(p) for p in percentiles])
+        writer.writeheader()
+        writer.writerows(bands)
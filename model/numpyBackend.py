@@ -0,0 +1,259 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Array-based version of genericModel.determinePrices.  It is selected by setting globalParameters['pricingBackend'] to
+#    'numpy'; the dict-based functions in genericModel remain the reference implementation.
+#
+# The year's cars (sorted by quality, highest first) and income groups are laid out as dense arrays:
+#    price[car], quality[car], isNew[car]                       -- one entry per car, in quality order
+#    utility[group, car], operatingCost[group, car]             -- one row per income group
+#    fraction[group, car], owned[group, car]                    -- ownership, updated as each car is priced
+# Income groups are a dimension of the arrays rather than a Python loop, so runs with thousands of groups (see incomeGroups) stay
+#    practical.  The buy probabilities for every (group, owned car, candidate car) triple are computed in one batch, for the
+#    (group, owned car) pairs owned at the start of the year:
+#    terms[candidate, pair] = exp((utility - price + priceOwned - operatingCost + operatingCostOwned - transactionCost) / scale)
+#    is the numerator, and the denominator is the chance of keeping the owned car plus the sum of terms from the candidate down to
+#    (but not including) the owned car -- a reverse cumulative sum along the candidate axis.
+# As in the dict path, every term only involves cars that have not been priced yet when it is used, so the whole table can be
+#    built before any price changes.  The cars are then priced one at a time in quality order, since each sale changes who is
+#    left to sell lower-quality cars.
+
+import numpy as np
+
+from model import genericModel
+from model import carRegistry, electricVehicles, modelLog, ownershipMatrix, runMetrics, utilityCurves
+
+# per-car columns for this year, in quality order, from either a cars dict or a CarRegistry.  'ids' are registry ids (None for a dict)
+def carColumns(year, cars):
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        ids = cars.sortedIds(year)
+        columns = cars.history[year]
+        return {'carNames': [cars.names[carId] for carId in ids], 'ids': ids,
+                'price': np.frombuffer(columns['price'])[ids], 'quality': np.frombuffer(columns['quality'])[ids],
+                'isNew': np.array(cars.modelYear)[ids] == year,
+                'modelKeys': [(cars.model[carId], bool(cars.isEV[carId])) for carId in ids]}
+    sortedCarNames = genericModel.carsSortedByQuality(cars, year)
+    return {'carNames': sortedCarNames, 'ids': None,
+            'price': np.array([cars[carName]['history'][year]['price'] for carName in sortedCarNames], dtype=float),
+            'quality': np.array([cars[carName]['history'][year]['quality'] for carName in sortedCarNames], dtype=float),
+            'isNew': np.array([cars[carName]['year'] == year for carName in sortedCarNames], dtype=bool),
+            'modelKeys': [(cars[carName]['model'], cars[carName]['EV']) for carName in sortedCarNames]}
+
+# operatingCost[group, car] for cars of these (model, isEV) keys: genericModel.modelOperatingCosts for every group, with the same
+#    arithmetic, as one sum over the years of [group] discount factors times the yearly cost of each key
+def operatingCostArray(year, incomeLevels, modelKeys, parameters):
+    distinctKeys = sorted(set(modelKeys))
+    keyIndex = np.array([distinctKeys.index(modelKey) for modelKey in modelKeys], dtype=int)
+    operatingCost = np.zeros((len(incomeLevels), len(distinctKeys)))
+    for t in range(genericModel.OPERATING_COST_YEARS):
+        discount = np.array([pow(1 - parameters['peopleGroups'][incomeLevel]['discountRate'], t) for incomeLevel in incomeLevels])
+        yearlyCost = np.array([genericModel.yearlyOperatingCost(model, isEV, year + t, parameters) for (model, isEV) in distinctKeys])
+        operatingCost += discount[:, np.newaxis] * yearlyCost[np.newaxis, :]
+    return operatingCost[:, keyIndex]
+
+# lay out this year's market as arrays; see top of file.  The market also carries the year's metrics from runState (runMetrics)
+def marketArrays(year, population, cars, parameters, runState=None):
+    isMatrix = isinstance(population, ownershipMatrix.OwnershipMatrix)
+    incomeLevels = population.incomeLevels if (isMatrix) else list(population[year].keys())
+    market = carColumns(year, cars)
+    sortedCarNames = market['carNames']
+    rank = {carName: i for (i, carName) in enumerate(sortedCarNames)}
+    quality = market['quality']
+    modelKeys = market['modelKeys']
+
+    # utility and operating costs are properties of (group, car) only, so they are evaluated once per pair rather than once per
+    #    triple, for all the groups at once
+    operatingCost = operatingCostArray(year, incomeLevels, modelKeys, parameters)
+    utility = utilityCurves.groupUtilities([parameters['peopleGroups'][incomeLevel]['utilityFunction'] for incomeLevel in incomeLevels],
+                                           quality)
+    if (isMatrix):
+        fraction = population.fraction[year][:, market['ids']]
+        owned = population.owned[year][:, market['ids']]
+    else:
+        fraction = np.zeros((len(incomeLevels), len(sortedCarNames)))
+        owned = np.zeros((len(incomeLevels), len(sortedCarNames)), dtype=bool)
+        for (g, incomeLevel) in enumerate(incomeLevels):
+            for (carName, val) in population[year][incomeLevel]['cars'].items():
+                fraction[g, rank[carName]] = val['fraction']
+                owned[g, rank[carName]] = True
+
+    # newCars finds this year's new cars by (model, isEV); salesCaps holds the caps on new gas cars set as the EVs are priced
+    newCars = {modelKey: c for (c, modelKey) in enumerate(modelKeys) if (market['isNew'][c])}
+    runState = genericModel.newRunState() if (runState is None) else runState
+    market.update({'incomeLevels': incomeLevels, 'rank': rank, 'operatingCost': operatingCost, 'utility': utility,
+                   'fraction': fraction, 'owned': owned, 'newCars': newCars, 'salesCaps': {},
+                   'metrics': runMetrics.currentYear(runState['metrics'])})
+    return market
+
+# numerators and denominators of the buy probability for every (owner, candidate car), where the owners are the (group, owned car)
+#    pairs of the start of the year: tables['numerators'][c, p] is for pair p = (tables['groups'][p], tables['ownedCars'][p]).
+#    Only those pairs ever buy -- anyone who buys a car this year buys it before any lower-quality car is priced -- so the tables
+#    grow with what each group owns rather than with groups x cars x cars.  Entries with c >= the owned car are meaningless (an
+#    owner only buys a higher-quality car) and are left as zero numerators
+def buyProbabilityTables(market, parameters):
+    price = market['price']
+    utility = market['utility']
+    operatingCost = market['operatingCost']
+    numCars = len(price)
+    (groups, ownedCars) = np.nonzero(market['owned'])
+
+    # the scale of fluctuations is set by the price of the owned car, with a floor to avoid divide-by-zero for worthless cars
+    utilityScale = price * parameters['utilityScale']
+    utilityScale[utilityScale <= 500] = 500
+
+    # same order of operations as the dict path, broadcast over [c, p]
+    exponent = (utility[groups, :].T - price[:, np.newaxis] + price[np.newaxis, ownedCars] -
+                operatingCost[groups, :].T + operatingCost[groups, ownedCars][np.newaxis, :] - parameters['transactionCost'])
+    higherQuality = np.arange(numCars)[:, np.newaxis] < ownedCars[np.newaxis, :]       # [c, p] is True when c is above the owned car
+    exponent = np.where(higherQuality, exponent / utilityScale[np.newaxis, ownedCars], -np.inf)
+    numerators = np.exp(exponent)
+
+    # probability of keeping the owned car; zero if the owned car has no utility for this group
+    ownedUtility = utility[groups, ownedCars]
+    keep = np.where(ownedUtility > 0, np.exp((ownedUtility - operatingCost[groups, ownedCars]) / utilityScale[ownedCars]), 0)
+    # running sums from each candidate down to the owned car
+    denominators = keep[np.newaxis, :] + np.cumsum(numerators[::-1, :], axis=0)[::-1, :]
+
+    # useful cars (with some utility for the group) ranked above each owned car, not counting the car itself; owners of a useless
+    #    car with no useful car left between it and the car they buy sell out (see priceCar)
+    useful = utility > 0
+    usefulThrough = np.cumsum(useful, axis=1)            # usefulThrough[g, k] = number of useful cars at ranks 0..k
+    usefulAbove = usefulThrough[groups, ownedCars] - useful[groups, ownedCars]
+
+    return {'groups': groups, 'ownedCars': ownedCars, 'numerators': numerators, 'denominators': denominators,
+            'ownedScale': utilityScale[ownedCars], 'ownedUseful': useful[groups, ownedCars], 'usefulAbove': usefulAbove,
+            'usefulThrough': usefulThrough}
+
+# price one car and move buyers into it; the array counterpart of genericModel.determinePriceAndBuyers.  Updates market in place
+#    and returns the new price
+def priceCar(year, market, tables, sellers, c, parameters):
+    (groups, ownedCars) = (tables['groups'], tables['ownedCars'])
+    (numerators, denominators) = (tables['numerators'][c], tables['denominators'][c])
+    utility = market['utility']
+    fraction = market['fraction']
+    owned = market['owned']
+    carName = market['carNames'][c]
+    metrics = market['metrics']
+    start = runMetrics.clock()
+
+    # owners of lower-quality cars, in groups that have some utility for this car
+    buying = owned[groups, ownedCars] & (ownedCars > c) & (utility[groups, c] > 0)
+
+    probability = np.zeros(len(groups))
+    probability[buying] = numerators[buying] / denominators[buying]
+    assert(np.all(probability <= 1 + 1e-12))
+    ownedFraction = fraction[groups, ownedCars]
+    numBuyer = ownedFraction * probability
+    numBuyers = numBuyer.sum()
+    runMetrics.count(metrics, 'pairs', int(buying.sum()))
+    start = runMetrics.endStage(metrics, 'determineBuyers', start)
+
+    if (c in market['salesCaps']):                      # a new gas car under the EV mandate, see electricVehicles
+        numSellers = min(numBuyers, market['salesCaps'][c])
+        if (numSellers == 0): buying[:] = False          # none at all this year
+    else:
+        numSellers = numBuyers if market['isNew'][c] else sellers[c]
+    priceThisCar = market['price'][c]
+    if ((numBuyers > 0) and (numSellers > 0)):
+        # approximation: compute a weighted average for utilityScale; use that to turn a fraction into a price
+        utilityScale = numBuyers / (numBuyer / tables['ownedScale']).sum()
+        deltaP = -utilityScale*np.log(numSellers / numBuyers)
+        if (deltaP < -priceThisCar):
+            deltaP = -priceThisCar
+    elif (numBuyers == 0):
+        deltaP = -priceThisCar
+    else:
+        deltaP = 0
+    start = runMetrics.endStage(metrics, 'adjustPrice', start)
+
+    if (buying.any()):
+        # adjust buy probability by new price; the scale here is the one for this car, as in determinePriceAndBuyers
+        carScale = parameters['utilityScale'] * market['quality'][c]
+        tradeProbability = np.zeros(len(groups))
+        tradeProbability[buying] = (numerators[buying] * np.exp(-deltaP / carScale)) / denominators[buying]
+        tradeProbability[tradeProbability > 1] = 1
+
+        # owners of a useless car who have no lower-quality car with utility left to buy after this one trade 100% of their stock
+        usefulBetween = tables['usefulAbove'] - tables['usefulThrough'][groups, c]
+        useless = buying & ~tables['ownedUseful'] & (usefulBetween == 0)
+        for p in np.nonzero(useless)[0]:
+            modelLog.recordEvent('retirement', year=year, incomeLevel=market['incomeLevels'][groups[p]], car=market['carNames'][ownedCars[p]],
+                                 buyer=carName, tradeProbability=float(tradeProbability[p]))
+        tradeProbability[useless] = 1
+        if (c in market['salesCaps']):
+            # the cap is a limit: scale the trades down to it, as in determinePriceAndBuyers
+            tentative = (ownedFraction * tradeProbability).sum()
+            if (tentative > numSellers):
+                tradeProbability = tradeProbability * numSellers / tentative
+
+        numToTrade = ownedFraction * tradeProbability
+        soldOut = buying & (tradeProbability > 0.999)
+        fraction[groups, ownedCars] = ownedFraction - numToTrade
+        fraction[groups[soldOut], ownedCars[soldOut]] = 0
+        owned[groups[soldOut], ownedCars[soldOut]] = False
+
+        numGroups = fraction.shape[0]
+        fraction[:, c] += np.bincount(groups, weights=numToTrade, minlength=numGroups)
+        owned[np.bincount(groups[buying], minlength=numGroups) > 0, c] = True
+        sellers += np.bincount(ownedCars, weights=numToTrade, minlength=len(sellers))
+        totalBuy = numToTrade.sum()
+    else:
+        totalBuy = 0
+    (model, isEV) = market['modelKeys'][c]
+    if (isEV and market['isNew'][c] and ((model, False) in market['newCars'])):
+        cap = electricVehicles.gasCarCap(year, totalBuy, parameters)
+        if (cap is not None): market['salesCaps'][market['newCars'][(model, False)]] = cap
+    runMetrics.endStage(metrics, 'updateOwnership', start)
+
+    runMetrics.recordResidual(metrics, float(totalBuy - numSellers))
+    if (abs(totalBuy - numSellers) > 0.005):
+        modelLog.recordEvent('discrepancy', year=year, car=carName, sellers=float(numSellers), buyers=float(totalBuy), deltaP=float(deltaP))
+    market['price'][c] = priceThisCar + deltaP
+    return market['price'][c]
+
+# array counterpart of genericModel.determinePrices: same inputs and outputs, population and cars are updated for the latest year.
+#    cars may be a cars dict or a CarRegistry, and population a population dict or (with a CarRegistry) an OwnershipMatrix
+def determinePrices(population, cars, parameters, runState=None):
+    thisYear = sorted(population.keys())[-1]
+    start = runMetrics.clock()
+    market = marketArrays(thisYear, population, cars, parameters, runState)
+    metrics = market['metrics']
+    start = runMetrics.endStage(metrics, 'operatingCosts', start)
+    sortedCarNames = market['carNames']
+    tables = buyProbabilityTables(market, parameters)
+    runMetrics.endStage(metrics, 'determineBuyers', start)
+    runMetrics.count(metrics, 'denominatorTerms', int(tables['ownedCars'].sum()))     # one per car above each owned car
+    sellers = np.zeros(len(sortedCarNames))
+
+    for c in range(len(sortedCarNames)):
+        priceCar(thisYear, market, tables, sellers, c, parameters)
+
+    start = runMetrics.clock()
+    population, cars = writeBack(thisYear, population, cars, market, sellers)
+    runMetrics.endStage(metrics, 'updateOwnership', start)
+    return population, cars
+
+# copy the market's prices and ownership back into the cars and population structures, keeping the order in which the dict path
+#    adds and removes cars; sellers[c] is the number of owners of car c who sold it
+def writeBack(thisYear, population, cars, market, sellers):
+    sortedCarNames = market['carNames']
+    if (market['ids'] is not None):
+        for (c, carId) in enumerate(market['ids']):
+            cars.history[thisYear]['price'][carId] = market['price'][c]
+    else:
+        for (c, carName) in enumerate(sortedCarNames):
+            cars[carName]['history'][thisYear]['price'] = float(market['price'][c])
+            cars[carName]['numSellers'] = float(sellers[c])
+    if (isinstance(population, ownershipMatrix.OwnershipMatrix)):
+        population.fraction[thisYear][:, market['ids']] = market['fraction']
+        population.owned[thisYear][:, market['ids']] = market['owned']
+        return population, cars
+    for (g, incomeLevel) in enumerate(market['incomeLevels']):
+        carsThisGroup = population[thisYear][incomeLevel]['cars']
+        for carName in [carName for carName in carsThisGroup if not market['owned'][g, market['rank'][carName]]]:
+            del(carsThisGroup[carName])
+        for (c, carName) in enumerate(sortedCarNames):
+            if (market['owned'][g, c]):
+                carsThisGroup.setdefault(carName, {'fraction': 0})['fraction'] = float(market['fraction'][g, c])
+
+    return population, cars
@@ -0,0 +1,92 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Array storage for the 'population' data structure, for runs whose cars are kept in a CarRegistry.  Each year is a pair of
+#    (income group x car id) matrices:
+#
+#    ownership.incomeLevels    [10000, 20000, ...]                -- row order
+#    ownership.groupFractions  {10000: 0.05, ...}                  -- fraction of the population in each income group
+#    ownership.fraction        {2022: array[group, car id], ...}   -- fraction of the whole population owning each car
+#    ownership.owned           {2022: bool array[group, car id]}   -- True where the documented population would have an entry
+#
+# Only the latest year is writable.  Advancing a year copies the latest matrices once (a flat memcpy, padded with columns for cars
+#    registered since) and freezes the old ones, so no year is ever deep-copied and past years cannot change under the analysis.
+#
+# ownership[year] returns that year in the documented JSON-like population format, so code that reads population[year] keeps
+#    working; it is built on demand from the matrices.
+
+import numpy as np
+
+class OwnershipMatrix:
+    __slots__ = ('incomeLevels', 'groupFractions', 'carNames', 'fraction', 'owned')
+
+    # carNames is the registry's names list (shared, so it sees cars registered later)
+    def __init__(self, incomeLevels, groupFractions, carNames):
+        self.incomeLevels = list(incomeLevels)
+        self.groupFractions = dict(groupFractions)
+        self.carNames = carNames
+        self.fraction = {}
+        self.owned = {}
+
+    def keys(self):
+        return self.fraction.keys()
+
+    def __contains__(self, year):
+        return year in self.fraction
+
+    def __getitem__(self, year):
+        fraction = self.fraction[year]
+        owned = self.owned[year]
+        return {incomeLevel: {'fraction': self.groupFractions[incomeLevel],
+                              'cars': {self.carNames[carId]: {'fraction': float(fraction[g, carId])} for carId in np.nonzero(owned[g])[0]}}
+                for (g, incomeLevel) in enumerate(self.incomeLevels)}
+
+    # start a new year as a copy of the latest one, with room for every car registered so far; the latest year becomes read-only
+    def advanceYear(self):
+        lastYear = max(self.fraction.keys())
+        (numGroups, numCars) = self.fraction[lastYear].shape
+        fraction = np.zeros((numGroups, len(self.carNames)))
+        owned = np.zeros((numGroups, len(self.carNames)), dtype=bool)
+        fraction[:, :numCars] = self.fraction[lastYear]
+        owned[:, :numCars] = self.owned[lastYear]
+        self.fraction[lastYear].setflags(write=False)
+        self.owned[lastYear].setflags(write=False)
+        self.fraction[lastYear+1] = fraction
+        self.owned[lastYear+1] = owned
+        return lastYear+1
+
+    # a run that ends at year, sharing this one's matrices (read-only) -- to continue from year differently, e.g. with other
+    #    parameters, leaving this run as it is.  carNames is the names list of the registry the new run will use
+    def upToYear(self, year, carNames):
+        ownership = OwnershipMatrix(self.incomeLevels, self.groupFractions, carNames)
+        for pastYear in [pastYear for pastYear in self.keys() if (pastYear <= year)]:
+            for (matrices, shared) in ((self.fraction, ownership.fraction), (self.owned, ownership.owned)):
+                shared[pastYear] = matrices[pastYear].view()
+                shared[pastYear].setflags(write=False)
+        return ownership
+
+    # the whole run in the documented population format
+    def toPopulation(self):
+        return {year: self[year] for year in sorted(self.keys())}
+
+# build an OwnershipMatrix from a documented population (e.g. from specificModel.initializePopulation) and the registry of its cars
+def fromPopulation(population, registry):
+    years = sorted(population.keys())
+    incomeLevels = list(population[years[0]].keys())
+    ownership = OwnershipMatrix(incomeLevels, {incomeLevel: group['fraction'] for (incomeLevel, group) in population[years[0]].items()},
+                                registry.names)
+    carIds = {carName: carId for (carId, carName) in enumerate(registry.names)}
+    for year in years:
+        fraction = np.zeros((len(incomeLevels), len(registry)))
+        owned = np.zeros((len(incomeLevels), len(registry)), dtype=bool)
+        for (g, incomeLevel) in enumerate(incomeLevels):
+            for (carName, val) in population[year][incomeLevel]['cars'].items():
+                carId = carIds[carName]
+                fraction[g, carId] = val['fraction']
+                owned[g, carId] = True
+        if (year != years[-1]):
+            fraction.setflags(write=False)
+            owned.setflags(write=False)
+        ownership.fraction[year] = fraction
+        ownership.owned[year] = owned
+    return ownership
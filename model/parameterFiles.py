@@ -0,0 +1,208 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# globalParameters described in data files (JSON, or TOML) instead of Python, read through a loader that checks them.  Reading
+#    a file only needs this module and utilityCurves -- not the model, numpy or any plotting library -- so short-lived worker
+#    processes start quickly.  The defaults are model/defaultParameters.json.
+#
+# The file holds the same entries as globalParameters, with the series stored as arrays:
+#    {"carTypes": {"luxury": {"initialQuality": 70000, ..., "depreciationCurve": [1.0, 0.7, ..., 0]}, ...},   -- by age
+#     "peopleGroups": {"10000": {"fraction": 0.05, "utilityPeak": 2000, "discountRate": 0.1}, ...},
+#     "gasCost": {"startYear": 2022, "values": [3.5, 3.5, ...]},                                             -- by year
+#     "batteryDepreciationCurve": [1.0, 0.9, ...],
+#     "transactionCost": 500, "utilityScale": 0.15, ...}
+# A group's utility is given either as "utilityPeak" (specificModel.peakedUtility) or as "utilityFunction", a utility curve spec
+#    (utilityCurves.fromSpec).  Group fractions and mandate shares are between 0 and 1, and a file with a newCarEVMandate
+#    also needs batteryDepreciationCurve, batteryPriceCurve and each car type's batteryCost.  A scenario file can name another file as its "base" (a path relative to the scenario file) and
+#    give only what differs; objects are merged key by key, anything else is replaced.
+#
+#    parameters = parameterFiles.loadParameters("scenarios/highGas.json")
+
+import json, math, os
+
+from model import utilityCurves
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'defaultParameters.json')
+
+REQUIRED = ['carTypes', 'peopleGroups', 'gasCost', 'electricityCost', 'transactionCost', 'utilityScale']
+OPTIONAL = ['batteryDepreciationCurve', 'batteryPriceCurve', 'newCarEVMandate', 'pricingMode', 'pricingBackend',
+            'equilibriumTolerance', 'equilibriumMaxIterations']
+YEAR_SERIES = ['gasCost', 'electricityCost', 'batteryPriceCurve', 'newCarEVMandate']
+CAR_TYPE_REQUIRED = ['initialQuality', 'salvageValue', 'mpg', 'mpkwh', 'gasRepairs', 'evRepairs', 'depreciationCurve']
+CAR_TYPE_POSITIVE = ['mpg', 'mpkwh']                # divided by, in the running costs
+PEOPLE_GROUP_REQUIRED = ['fraction', 'discountRate']
+CHOICES = {'pricingMode': ['sequential', 'equilibrium'], 'pricingBackend': ['dict', 'numpy']}
+MANDATE_REQUIRED = ['batteryDepreciationCurve', 'batteryPriceCurve']   # EVs are priced with their battery (electricVehicles)
+
+def readFile(fileName):
+    with open(fileName, 'rb') as f:
+        text = f.read().decode('utf-8')
+    if (fileName.endswith('.toml')):
+        try:
+            import tomllib                  # standard library from Python 3.11
+        except ImportError:
+            import toml as tomllib          # the toml package, for older Pythons
+        return tomllib.loads(text)
+    return json.loads(text)
+
+# a copy of base with overrides merged in: objects are merged key by key, anything else is replaced
+def mergeData(base, overrides):
+    merged = dict(base)
+    for (key, value) in overrides.items():
+        if (isinstance(value, dict) and isinstance(merged.get(key), dict)):
+            merged[key] = mergeData(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+# the data of a file, with its base (if any) merged under it
+def resolvedData(fileName):
+    data = readFile(fileName)
+    if ('base' not in data):
+        return data
+    base = resolvedData(os.path.join(os.path.dirname(os.path.abspath(fileName)), data['base']))
+    return mergeData(base, {key: value for (key, value) in data.items() if (key != 'base')})
+
+def _check(condition, where, message):
+    if (not condition):
+        raise ValueError(where + ": " + message)
+
+def _number(value, where):
+    _check(isinstance(value, (int, float)) and not isinstance(value, bool), where, "expected a number, not " + repr(value))
+    return value
+
+def _positive(value, where):
+    _check(_number(value, where) > 0, where, "must be positive, not " + repr(value))
+    return value
+
+def _fraction(value, where):
+    _check(0 <= _number(value, where) <= 1, where, "must be between 0 and 1, not " + repr(value))
+    return value
+
+def _integer(value, where):
+    _check(isinstance(value, int) and not isinstance(value, bool), where, "expected a whole number, not " + repr(value))
+    return value
+
+def _choice(value, where):
+    _check(value in CHOICES[where], where, "expected one of " + ", ".join(CHOICES[where]) + ", not " + repr(value))
+    return value
+
+# the scalar entries of the file, each with its check
+SCALARS = {'transactionCost': _number, 'utilityScale': _number, 'pricingMode': _choice, 'pricingBackend': _choice,
+           'equilibriumTolerance': _positive, 'equilibriumMaxIterations': lambda value, where: _positive(_integer(value, where), where)}
+
+# a series by year; check is applied to every value
+def yearSeries(data, where, check=_number):
+    _check(isinstance(data, dict) and (set(data.keys()) == {'startYear', 'values'}), where, "expected {startYear, values}")
+    _integer(data['startYear'], where + ".startYear")
+    _check(isinstance(data['values'], list) and (len(data['values']) > 0), where, "values must be a non-empty list")
+    return {int(data['startYear']) + i: check(value, where) for (i, value) in enumerate(data['values'])}
+
+def ageCurve(data, where):
+    _check(isinstance(data, list) and (len(data) > 0), where, "expected a list of values by age")
+    return {age: _number(value, where) for (age, value) in enumerate(data)}
+
+# a utility curve from its spec (utilityCurves.fromSpec), checked here so a bad one is reported like any other entry
+def utilitySpec(spec, where):
+    _check(isinstance(spec, dict) and (set(spec.keys()) == {'type', 'qualities', 'utilities'}), where,
+           "expected {type, qualities, utilities}")
+    _check(spec['type'] == 'piecewiseLinear', where + ".type", "expected piecewiseLinear, not " + repr(spec['type']))
+    for key in ('qualities', 'utilities'):
+        _check(isinstance(spec[key], list), where + "." + key, "expected a list of numbers")
+        for value in spec[key]:
+            _number(value, where + "." + key)
+    _check((len(spec['qualities']) == len(spec['utilities'])) and (len(spec['qualities']) >= 2), where,
+           "qualities and utilities must have the same length, at least 2")
+    _check(all(q0 < q1 for (q0, q1) in zip(spec['qualities'], spec['qualities'][1:])), where + ".qualities", "must increase")
+    return utilityCurves.fromSpec(spec)
+
+def peopleGroup(data, where):
+    _check(isinstance(data, dict), where, "expected an object")
+    missing = [key for key in PEOPLE_GROUP_REQUIRED if (key not in data)]
+    _check(not missing, where, "missing entries " + ", ".join(missing))
+    _check(('utilityPeak' in data) != ('utilityFunction' in data), where, "give exactly one of utilityPeak and utilityFunction")
+    if ('utilityPeak' in data):
+        utilityFunction = utilityCurves.peakedUtility(_positive(data['utilityPeak'], where + ".utilityPeak"))
+    else:
+        utilityFunction = utilitySpec(data['utilityFunction'], where + ".utilityFunction")
+    return {'fraction': _fraction(data['fraction'], where + ".fraction"), 'utilityFunction': utilityFunction,
+            'discountRate': _number(data['discountRate'], where + ".discountRate")}
+
+def carType(data, where, needsBattery):
+    _check(isinstance(data, dict), where, "expected an object")
+    missing = [key for key in CAR_TYPE_REQUIRED + (['batteryCost'] if (needsBattery) else []) if (key not in data)]
+    _check(not missing, where, "missing entries " + ", ".join(missing))
+    return {key: ageCurve(value, where + "." + key) if (key == 'depreciationCurve') else
+                 _positive(value, where + "." + key) if (key in CAR_TYPE_POSITIVE) else _number(value, where + "." + key)
+            for (key, value) in data.items()}
+
+# an income level, the key of a group in peopleGroups
+def _incomeLevel(key, where):
+    _check(str(key).isdigit(), where, "income levels must be whole numbers, not " + repr(key))
+    return int(key)
+
+# globalParameters from the (resolved) data of a file; raises ValueError naming the first entry that is wrong
+def fromData(data):
+    unknown = [key for key in data.keys() if (key not in REQUIRED + OPTIONAL)]
+    _check(not unknown, "parameters", "unknown entries " + ", ".join(unknown))
+    missing = [key for key in REQUIRED if (key not in data)]
+    _check(not missing, "parameters", "missing entries " + ", ".join(missing))
+    missing = [key for key in MANDATE_REQUIRED if (key not in data)] if ('newCarEVMandate' in data) else []
+    _check(not missing, "newCarEVMandate", "needs entries " + ", ".join(missing))
+
+    parameters = {}
+    for (key, value) in data.items():
+        if (key in ('carTypes', 'peopleGroups')):
+            _check(isinstance(value, dict) and (len(value) > 0), key, "expected a non-empty object")
+        if (key == 'carTypes'):
+            parameters[key] = {model: carType(carData, "carTypes." + model, 'newCarEVMandate' in data) for (model, carData) in value.items()}
+        elif (key == 'peopleGroups'):
+            parameters[key] = {_incomeLevel(incomeLevel, "peopleGroups." + str(incomeLevel)):
+                               peopleGroup(group, "peopleGroups." + str(incomeLevel)) for (incomeLevel, group) in value.items()}
+        elif (key in YEAR_SERIES):
+            parameters[key] = yearSeries(value, key, _fraction if (key == 'newCarEVMandate') else _number)
+        elif (key == 'batteryDepreciationCurve'):
+            parameters[key] = ageCurve(value, key)
+        else:
+            parameters[key] = SCALARS[key](value, key)
+    _check((parameters.get('pricingMode') != 'equilibrium') or ('pricingBackend' not in parameters), "pricingBackend",
+           "only applies to sequential pricing, not to pricingMode equilibrium")
+    total = sum(group['fraction'] for group in parameters['peopleGroups'].values())
+    _check(math.isclose(total, 1, abs_tol=1e-6), "peopleGroups", "fractions add up to " + str(total) + ", not 1")
+    return parameters
+
+# globalParameters from a parameter file
+def loadParameters(fileName=DEFAULT_FILE):
+    return fromData(resolvedData(fileName))
+
+# inverse of fromData, for writing parameters built in Python to a file.  Series must cover consecutive years (or ages from 0)
+def toData(parameters):
+    def series(curve, where):
+        keys = sorted(curve.keys())
+        _check(keys == list(range(keys[0], keys[0] + len(keys))), where, "keys are not consecutive")
+        return [curve[key] for key in keys]
+
+    def groupData(group, where):
+        curve = group['utilityFunction']
+        _check(isinstance(curve, utilityCurves.PiecewiseLinearUtility), where, "the utility function is not a curve described as data")
+        utility = {'utilityFunction': curve.spec()} if (curve.peak() is None) else {'utilityPeak': curve.peak()}
+        return dict({'fraction': group['fraction']}, **utility, discountRate=group['discountRate'])
+
+    data = {}
+    for (key, value) in parameters.items():
+        if (key == 'carTypes'):
+            data[key] = {model: dict(carType, depreciationCurve=series(carType['depreciationCurve'], "carTypes." + model))
+                         for (model, carType) in value.items()}
+        elif (key == 'peopleGroups'):
+            data[key] = {str(incomeLevel): groupData(group, "peopleGroups." + str(incomeLevel)) for (incomeLevel, group) in value.items()}
+        elif (key in YEAR_SERIES):
+            data[key] = {'startYear': min(value.keys()), 'values': series(value, key)}
+        elif (key == 'batteryDepreciationCurve'):
+            data[key] = series(value, key)
+        else:
+            data[key] = value
+    return data
+
+def saveParameters(parameters, fileName):
+    with open(fileName, 'w') as f:
+        json.dump(toData(parameters), f, indent=1)
@@ -0,0 +1,161 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# On-disk cache of whole runs, so re-running an identical scenario reads the results instead of simulating again.
+#
+# An entry is keyed by a hash of the canonical form of the parameters (utility curves by their spec()), the start year and the
+#    version of the model code (a hash of the model's source files), and holds the longest run made so far with that key:
+#    a request for fewer years is served from it, and a request for more years continues from its last year and replaces it.
+# Runs are made on the array path (CarRegistry and OwnershipMatrix), so a continued run is bit-identical to one made in one go.
+#
+# Each entry is a directory of uncompressed .npy files, loaded memory-mapped, so a large run is only read as it is used:
+#    meta.json                                     -- key, years, income groups, car columns (model, modelYear, isEV, comparable)
+#    numCars.npy                                   -- [year]: cars registered by that year
+#    fraction.npy, owned.npy                       -- [year, group, car] ownership matrices, zero-padded to the last year's cars
+#    price.npy, quality.npy, batteryValue.npy      -- [year, car] the cars' history
+# Entries are evicted least recently used first (by the time they were last read) when the cache grows beyond maxBytes.
+#
+#    population, cars = resultCache.cachedRun(parameters, 2022, 20)      # an OwnershipMatrix and a CarRegistry
+
+import functools, glob, hashlib, json, os, shutil, tempfile
+from array import array
+
+import numpy as np
+
+from model import carRegistry, genericModel, ownershipMatrix, specificModel, utilityCurves
+
+DEFAULT_DIRECTORY = 'cache'
+HISTORY_KEYS = ('price', 'quality', 'batteryValue')
+
+# a JSON-compatible form of parameters, the same for equal parameters however they were built
+def canonicalForm(value):
+    if (isinstance(value, utilityCurves.PiecewiseLinearUtility)):
+        return value.spec()
+    if (isinstance(value, dict)):
+        return {str(key): canonicalForm(item) for (key, item) in value.items()}
+    if (isinstance(value, (list, tuple))):
+        return [canonicalForm(item) for item in value]
+    if ((value is None) or isinstance(value, (bool, int, float, str))):
+        return value
+    raise TypeError("cannot cache runs with a parameter of type " + type(value).__name__ + "; describe it as data")
+
+# hash of the model's source files, so results are not reused across changes to the model
+@functools.lru_cache(maxsize=None)
+def codeVersion():
+    digest = hashlib.sha256()
+    modelDirectory = os.path.dirname(os.path.abspath(__file__))
+    for fileName in sorted(glob.glob(os.path.join(modelDirectory, '*.py'))):
+        if (os.path.basename(fileName).startswith('test_')): continue
+        with open(fileName, 'rb') as f:
+            digest.update(os.path.basename(fileName).encode() + b'\0' + f.read())
+    return digest.hexdigest()
+
+def cacheKey(parameters, startYear):
+    text = json.dumps({'parameters': canonicalForm(parameters), 'startYear': startYear, 'codeVersion': codeVersion()},
+                      sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+# the first year simulated from startYear whose results may differ between runs with parameters and otherParameters: the years
+#    before it can be shared.  Year y reads the fuel costs of years y to y+4 (genericModel.OPERATING_COST_YEARS), the mandate of
+#    year y, and battery prices up to year y (the first one also for older years); any other difference changes every year.
+#    None when the runs are the same
+def firstDifferentYear(parameters, otherParameters, startYear):
+    lookahead = {'gasCost': genericModel.OPERATING_COST_YEARS - 1, 'electricityCost': genericModel.OPERATING_COST_YEARS - 1,
+                 'newCarEVMandate': 0, 'batteryPriceCurve': 0}
+    if ({key: value for (key, value) in parameters.items() if (key not in lookahead)} !=
+        {key: value for (key, value) in otherParameters.items() if (key not in lookahead)}):
+        return startYear + 1
+    firstYear = None
+    for (key, years) in lookahead.items():
+        (curve, otherCurve) = (parameters.get(key), otherParameters.get(key))
+        if ((curve is None) or (otherCurve is None) or (curve.keys() != otherCurve.keys())):
+            if (curve != otherCurve): return startYear + 1
+            continue
+        differing = [year for year in sorted(curve.keys()) if (curve[year] != otherCurve[year])]
+        if (not differing): continue
+        year = startYear + 1 if ((key == 'batteryPriceCurve') and (differing[0] == min(curve.keys()))) else differing[0] - years
+        firstYear = year if (firstYear is None) else min(firstYear, year)
+    return None if (firstYear is None) else max(firstYear, startYear + 1)
+
+def entrySize(path):
+    return sum(os.path.getsize(fileName) for fileName in glob.glob(os.path.join(path, '*')))
+
+def saveEntry(path, key, population, cars, startYear):
+    years = sorted(population.keys())
+    numCars = [len(cars.history[year]['price']) for year in years]
+    arrays = {'numCars': np.array(numCars),
+              'fraction': np.zeros((len(years), len(population.incomeLevels), numCars[-1])),
+              'owned': np.zeros((len(years), len(population.incomeLevels), numCars[-1]), dtype=bool)}
+    for column in HISTORY_KEYS:
+        arrays[column] = np.zeros((len(years), numCars[-1]))
+    for (y, year) in enumerate(years):
+        arrays['fraction'][y, :, :numCars[y]] = population.fraction[year]
+        arrays['owned'][y, :, :numCars[y]] = population.owned[year]
+        for column in HISTORY_KEYS:
+            arrays[column][y, :numCars[y]] = cars.history[year][column]
+    meta = {'key': key, 'startYear': startYear, 'years': years, 'incomeLevels': population.incomeLevels,
+            'groupFractions': [population.groupFractions[incomeLevel] for incomeLevel in population.incomeLevels],
+            'model': cars.model, 'modelYear': list(cars.modelYear), 'isEV': [bool(isEV) for isEV in cars.isEV],
+            'comparable': list(cars.comparable)}
+
+    # written next to the entry and then moved into place, so a crash never leaves half an entry
+    temporary = tempfile.mkdtemp(dir=os.path.dirname(path))
+    for (name, values) in arrays.items():
+        np.save(os.path.join(temporary, name + '.npy'), values)
+    with open(os.path.join(temporary, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if (os.path.exists(path)):
+        shutil.rmtree(path)
+    os.rename(temporary, path)
+
+# (population, cars) for the years up to lastYear of the entry in path.  Past years are memory-mapped and read-only
+def loadEntry(path, lastYear):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    os.utime(os.path.join(path, 'meta.json'))                       # last used, for eviction
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+              for name in ('numCars', 'fraction', 'owned') + HISTORY_KEYS}
+    years = [year for year in meta['years'] if (year <= lastYear)]
+    numCars = int(arrays['numCars'][len(years)-1])
+
+    cars = carRegistry.fromColumns(meta['model'][:numCars], meta['modelYear'][:numCars], meta['isEV'][:numCars],
+                                   [comparable if (comparable < numCars) else -1 for comparable in meta['comparable'][:numCars]])
+    population = ownershipMatrix.OwnershipMatrix(meta['incomeLevels'], dict(zip(meta['incomeLevels'], meta['groupFractions'])),
+                                                 cars.names)
+    for (y, year) in enumerate(years):
+        n = int(arrays['numCars'][y])
+        cars.history[year] = {column: array('d', arrays[column][y, :n].tobytes()) for column in HISTORY_KEYS}
+        population.fraction[year] = arrays['fraction'][y, :, :n]
+        population.owned[year] = arrays['owned'][y, :, :n]
+    return population, cars
+
+# remove least recently used entries, other than keep, until the cache is no bigger than maxBytes
+def evict(directory, maxBytes, keep=None):
+    entries = [path for path in glob.glob(os.path.join(directory, '*')) if os.path.exists(os.path.join(path, 'meta.json'))]
+    sizes = {path: entrySize(path) for path in entries}
+    total = sum(sizes.values())
+    for path in sorted(entries, key=lambda path: os.path.getmtime(os.path.join(path, 'meta.json'))):
+        if (total <= maxBytes): break
+        if (path == keep): continue
+        shutil.rmtree(path)
+        total -= sizes[path]
+
+# the run of numYears years from startYear under parameters: from the cache if it is there, otherwise simulated (continuing a
+#    shorter cached run if there is one) and stored.  Returns an OwnershipMatrix and a CarRegistry
+def cachedRun(parameters, startYear, numYears, directory=DEFAULT_DIRECTORY, maxBytes=None):
+    key = cacheKey(parameters, startYear)
+    path = os.path.join(directory, key)
+    lastYear = startYear + numYears
+    if (os.path.exists(os.path.join(path, 'meta.json'))):
+        population, cars = loadEntry(path, lastYear)
+        if (max(population.keys()) == lastYear):
+            return population, cars
+    else:
+        population, cars = specificModel.initializeArrays(startYear, parameters)
+
+    population, cars = genericModel.runYears(population, cars, lastYear - max(population.keys()), parameters)
+    os.makedirs(directory, exist_ok=True)
+    saveEntry(path, key, population, cars, startYear)
+    if (maxBytes is not None):
+        evict(directory, maxBytes, keep=path)
+    return population, cars
@@ -0,0 +1,115 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Results in columnar form, for analysis: the files of resultsWriter (or a run still in memory) loaded as numpy arrays, and the
+#    aggregates reports ask for computed as grouped sums over those arrays instead of loops over the population dicts.
+#
+# loadResults(directory) and fromRun(population, cars) return
+#    {'carNames':  array of str                                          -- 'car' columns below index this
+#     'ownership': {'year', 'incomeLevel', 'car', 'fraction'}             -- arrays, one entry per (year, income group, car owned)
+#     'cars':      {'year', 'car', 'modelYear', 'EV', 'price', 'quality', 'batteryValue', 'model'}   -- one entry per (year, car)
+#     'models':    array of str}                                         -- the cars' 'model' column indexes this
+# Each aggregate returns its axes and a 2-d array, e.g. (years, incomeLevels, evShare[year, group]):
+#    shareByPriceBand     share of the population owning a car in each price band
+#    evShareByIncomeGroup share of each income group's cars that are EVs
+#    priceSeries          mean price of the cars owned, by model (or income group), weighted by ownership
+#
+#    results = resultsAnalysis.loadResults("results")
+#    (years, bands, share) = resultsAnalysis.shareByPriceBand(results, [0, 5000, 10000, 20000, 40000])
+
+import csv, os
+
+import numpy as np
+
+from model import resultsWriter
+
+DEFAULT_PRICE_BANDS = [0, 5000, 10000, 20000, 30000, 40000]
+
+# columnar results from columns (dicts of sequences keyed by the names in resultsWriter.OWNERSHIP_COLUMNS and CAR_COLUMNS), which
+#    may still be strings as read from the files
+def fromColumns(ownership, cars):
+    (carNames, carCodes) = np.unique(np.concatenate([np.asarray(cars['car'], dtype=str), np.asarray(ownership['car'], dtype=str)]),
+                                     return_inverse=True)
+    (models, modelCodes) = np.unique(np.asarray(cars['model'], dtype=str), return_inverse=True)
+    isEV = np.asarray(cars['EV'])
+    numCarRows = len(cars['car'])
+    return {'carNames': carNames, 'models': models,
+            'ownership': {'year': np.asarray(ownership['year']).astype(int), 'incomeLevel': np.asarray(ownership['incomeLevel']).astype(int),
+                          'car': carCodes[numCarRows:], 'fraction': np.asarray(ownership['fraction']).astype(float)},
+            'cars': {'year': np.asarray(cars['year']).astype(int), 'car': carCodes[:numCarRows], 'model': modelCodes,
+                     'modelYear': np.asarray(cars['modelYear']).astype(int),
+                     'EV': (isEV == 'True') if (isEV.dtype.kind == 'U') else isEV.astype(bool),
+                     'price': np.asarray(cars['price']).astype(float), 'quality': np.asarray(cars['quality']).astype(float),
+                     'batteryValue': np.asarray(cars['batteryValue']).astype(float)}}
+
+# the columns of one of resultsWriter's files, as tuples of strings keyed by column name
+def readColumns(fileName, columnNames):
+    with open(fileName, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = list(zip(*reader)) or [()] * len(header)
+    return {column: values for (column, values) in zip(header, columns) if (column in columnNames)}
+
+# the results written by resultsWriter into directory
+def loadResults(directory):
+    return fromColumns(readColumns(os.path.join(directory, 'ownership.csv'), resultsWriter.OWNERSHIP_COLUMNS),
+                       readColumns(os.path.join(directory, 'cars.csv'), resultsWriter.CAR_COLUMNS))
+
+# the results of a run in memory (dicts, or an OwnershipMatrix and a CarRegistry)
+def fromRun(population, cars):
+    years = sorted(population.keys())
+    ownershipRows = [row for year in years for row in resultsWriter.ownershipRows(year, population)]
+    carRows = [row for year in years for row in resultsWriter.carRows(year, cars)]
+    return fromColumns({column: [row[i] for row in ownershipRows] for (i, column) in enumerate(resultsWriter.OWNERSHIP_COLUMNS)},
+                       {column: [row[i] for row in carRows] for (i, column) in enumerate(resultsWriter.CAR_COLUMNS)})
+
+# the cars' columns for each ownership row: for every row of results['ownership'], the row of results['cars'] for the same car and
+#    year
+def carRowOfOwnership(results):
+    (ownership, cars) = (results['ownership'], results['cars'])
+    numCars = len(results['carNames'])
+    carKeys = cars['year'] * numCars + cars['car']
+    order = np.argsort(carKeys, kind='stable')
+    return order[np.searchsorted(carKeys[order], ownership['year'] * numCars + ownership['car'])]
+
+# sum of weights grouped by two integer codes: total[i, j] = sum of weights where (first, second) == (i, j)
+def groupedSum(first, second, weights, shape):
+    return np.bincount(first * shape[1] + second, weights=weights, minlength=shape[0] * shape[1]).reshape(shape)
+
+# (years, bands, share[year, band]): the share of the population owning a car whose price is in each band; bands are the lower
+#    edges, the last band is open-ended
+def shareByPriceBand(results, bands=DEFAULT_PRICE_BANDS):
+    ownership = results['ownership']
+    price = results['cars']['price'][carRowOfOwnership(results)]
+    (years, yearCodes) = np.unique(ownership['year'], return_inverse=True)
+    bandCodes = np.clip(np.searchsorted(bands, price, side='right') - 1, 0, len(bands) - 1)
+    return years, np.array(bands), groupedSum(yearCodes, bandCodes, ownership['fraction'], (len(years), len(bands)))
+
+# (years, incomeLevels, share[year, group]): the share of each income group's cars that are EVs
+def evShareByIncomeGroup(results):
+    ownership = results['ownership']
+    isEV = results['cars']['EV'][carRowOfOwnership(results)]
+    (years, yearCodes) = np.unique(ownership['year'], return_inverse=True)
+    (incomeLevels, groupCodes) = np.unique(ownership['incomeLevel'], return_inverse=True)
+    shape = (len(years), len(incomeLevels))
+    owned = groupedSum(yearCodes, groupCodes, ownership['fraction'], shape)
+    evs = groupedSum(yearCodes, groupCodes, ownership['fraction'] * isEV, shape)
+    return years, incomeLevels, np.divide(evs, owned, out=np.zeros(shape), where=(owned > 0))
+
+# (years, keys, meanPrice[year, key]): the mean price of the cars owned, weighted by ownership, grouped by 'model' (keys are model
+#    names) or 'incomeLevel'.  NaN where nothing of that key is owned
+def priceSeries(results, groupBy='model'):
+    ownership = results['ownership']
+    carRows = carRowOfOwnership(results)
+    price = results['cars']['price'][carRows]
+    (years, yearCodes) = np.unique(ownership['year'], return_inverse=True)
+    if (groupBy == 'model'):
+        (keys, keyCodes) = (results['models'], results['cars']['model'][carRows])
+    elif (groupBy == 'incomeLevel'):
+        (keys, keyCodes) = np.unique(ownership['incomeLevel'], return_inverse=True)
+    else:
+        raise ValueError("priceSeries groups by 'model' or 'incomeLevel', not " + repr(groupBy))
+    shape = (len(years), len(keys))
+    owned = groupedSum(yearCodes, keyCodes, ownership['fraction'], shape)
+    total = groupedSum(yearCodes, keyCodes, ownership['fraction'] * price, shape)
+    return years, keys, np.divide(total, owned, out=np.full(shape, np.nan), where=(owned > 0))
@@ -0,0 +1,116 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Streaming output of a run: each year is appended to two tidy CSV files as soon as it is finished, and (optionally) dropped from
+#    memory, so a long run holds only the year it is working on and analysis code can read the files instead of re-running the
+#    simulation.
+#
+#    ownership.csv   year, incomeLevel, car, fraction                                -- one row per (income group, car owned)
+#    cars.csv        year, car, model, modelYear, EV, price, quality, batteryValue   -- one row per car
+#
+# 'car' is the key of the car in the documented cars structure, e.g. 'luxury-2021-False'.  Floats are written with full precision.
+# Works with population dicts or an OwnershipMatrix, and cars dicts or a CarRegistry.
+
+import csv, itertools, os
+
+from model import carRegistry
+
+OWNERSHIP_COLUMNS = ['year', 'incomeLevel', 'car', 'fraction']
+CAR_COLUMNS = ['year', 'car', 'model', 'modelYear', 'EV', 'price', 'quality', 'batteryValue']
+COLUMN_TYPES = {'year': int, 'incomeLevel': int, 'car': str, 'fraction': float, 'model': str, 'modelYear': int,
+                'EV': lambda value: value == 'True', 'price': float, 'quality': float, 'batteryValue': float}
+
+def ownershipRows(year, population):
+    return [[year, incomeLevel, carName, val['fraction']]
+            for (incomeLevel, group) in population[year].items() for (carName, val) in group['cars'].items()]
+
+def carRows(year, cars):
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        columns = cars.history[year]
+        return [[year, cars.names[carId], cars.model[carId], cars.modelYear[carId], bool(cars.isEV[carId]),
+                 columns['price'][carId], columns['quality'][carId], columns['batteryValue'][carId]] for carId in range(len(columns['price']))]
+    return [[year, carName, car['model'], car['year'], car['EV'], car['history'][year]['price'], car['history'][year]['quality'],
+             car['history'][year]['batteryValue']] for (carName, car) in cars.items() if (year in car['history'])]
+
+def appendRows(fileName, columns, rows):
+    isNew = not os.path.exists(fileName)
+    with open(fileName, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if (isNew): writer.writerow(columns)
+        writer.writerows(rows)
+
+# remove every year before firstYearKept from population and from the cars' history
+def dropYears(population, cars, firstYearKept):
+    for year in [year for year in population.keys() if (year < firstYearKept)]:
+        if (isinstance(population, dict)):
+            del(population[year])
+        else:
+            del(population.fraction[year])
+            del(population.owned[year])
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        for year in [year for year in cars.history.keys() if (year < firstYearKept)]:
+            del(cars.history[year])
+    else:
+        for car in cars.values():
+            for year in [year for year in car['history'].keys() if (year < firstYearKept)]:
+                del(car['history'][year])
+
+# returns a function writeYear(year, population, cars) that appends that year to the files in directory, and then keeps only the
+#    last keepYears years in memory (None keeps everything).  It can be passed as an observer to genericModel.runYears; call it
+#    yourself for the starting year.  Existing result files in directory are replaced
+def resultsWriter(directory, keepYears=1):
+    os.makedirs(directory, exist_ok=True)
+    for fileName in ('ownership.csv', 'cars.csv'):
+        if (os.path.exists(os.path.join(directory, fileName))):
+            os.remove(os.path.join(directory, fileName))
+
+    def writeYear(year, population, cars):
+        appendRows(os.path.join(directory, 'ownership.csv'), OWNERSHIP_COLUMNS, ownershipRows(year, population))
+        appendRows(os.path.join(directory, 'cars.csv'), CAR_COLUMNS, carRows(year, cars))
+        if (keepYears is not None):
+            dropYears(population, cars, year - keepYears + 1)
+    return writeYear
+
+# read one of the result files lazily, one year at a time: yields (year, columns), where columns is a dict of lists keyed by
+#    column name.  Only the years in years (default all) are converted
+def readYears(fileName, years=None):
+    with open(fileName, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        types = [COLUMN_TYPES[column] for column in header]
+        for (year, rows) in itertools.groupby(reader, key=lambda row: int(row[0])):
+            if ((years is not None) and (year not in years)): continue
+            columns = {column: [] for column in header}
+            for row in rows:
+                for (column, convert, value) in zip(header, types, row):
+                    columns[column].append(convert(value))
+            yield year, columns
+
+# the last year in one of the result files (years are written in order)
+def lastYear(fileName):
+    with open(fileName, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        year = None
+        for row in reader:
+            year = row[0]
+    return int(year)
+
+# (population, cars) for one year (default: the last one written), in the documented formats, read from a results directory.
+#    The files do not record income-group sizes, so each group's 'fraction' is the total of its cars' fractions
+def loadYear(directory, year=None):
+    if (year is None):
+        year = lastYear(os.path.join(directory, 'cars.csv'))
+    population = {year: {}}
+    for (thisYear, columns) in readYears(os.path.join(directory, 'ownership.csv'), [year]):
+        for (incomeLevel, carName, fraction) in zip(columns['incomeLevel'], columns['car'], columns['fraction']):
+            group = population[year].setdefault(incomeLevel, {'fraction': 0, 'cars': {}})
+            group['cars'][carName] = {'fraction': fraction}
+            group['fraction'] += fraction
+    cars = {}
+    for (thisYear, columns) in readYears(os.path.join(directory, 'cars.csv'), [year]):
+        for row in zip(*[columns[column] for column in CAR_COLUMNS[1:]]):
+            (carName, model, modelYear, isEV, price, quality, batteryValue) = row
+            cars[carName] = {'model': model, 'year': modelYear, 'EV': isEV,
+                             'history': {year: {'price': price, 'quality': quality, 'batteryValue': batteryValue}}}
+    return population, cars
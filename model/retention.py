@@ -0,0 +1,204 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Bounded memory for long runs.  Left alone, a run keeps every car ever made and every year of everything: cars whose quality has
+#    depreciated to 0 and that nobody owns stay in cars, so every later year still adds a year to them, sorts them and prices
+#    them, and the number of cars -- and the cost of a year -- grows linearly with the length of the run.  A retention policy,
+#    run as an observer after each year (genericModel.runYears), bounds both:
+#
+#    - dead cars (quality 0 and owned by no income group) are retired from cars.  Quality never comes back (the depreciation
+#      curves only fall, to 0), and a dead car has no utility, so nobody buys it; once nobody owns it, nobody can sell it either.
+#    - only the last keepYears years of population and of the cars' history are kept (the next year needs only the last one).
+#
+# What is removed goes to an archive, and fullRun(population, cars, archive) puts the whole run back together.  newArchive() keeps
+#    it in memory, in the documented formats: {'population': {year: ...}, 'cars': {carName: {..., 'history'}}}.
+#    newArchive(directory) appends it to ownership.csv and cars.csv in directory, in the formats of resultsWriter, so the history
+#    kept is not resident (resultsAnalysis.loadResults(directory) reads it).  Pass archive=None to discard it instead -- e.g.
+#    after a resultsWriter (which writes every year as it finishes) in the observers list.
+#
+#    archive = retention.newArchive("archive")
+#    population, cars = genericModel.runYears(population, cars, 100, parameters, [retention.retentionPolicy(archive, keepYears=2)])
+#
+# Retiring dead cars changes the results of sequential pricing (the default).  There a dead car still has a term in the
+#    denominators of the owners of the cars ranked below it -- other dead cars, which are still owned until they are traded in
+#    (genericModel.ownedCarDenominators) -- as if they could switch to it, although nobody can sell it.  Those terms pile up as
+#    dead cars accumulate, so runs that keep everything slow the trading-in of dead cars more and more; with the defaults the
+#    prices differ by a few dollars after two years and mean prices by several percent after twenty.  Equilibrium pricing gives
+#    a dead car no part in anyone's choice, so its results are unchanged, to rounding.  Pass retireDead=False to bound only the
+#    history; the results are then those of a run that keeps everything, with either pricing.
+# Works with cars and population dicts, and with a CarRegistry and an OwnershipMatrix, whose car ids are renumbered as cars
+#    retire.
+
+import os
+from array import array
+
+from model import carRegistry, resultsWriter
+
+# an archive in memory, or (given a directory) on disk; existing archive files in directory are replaced
+def newArchive(directory=None):
+    if (directory is None):
+        return {'population': {}, 'cars': {}}
+    os.makedirs(directory, exist_ok=True)
+    for fileName in ('ownership.csv', 'cars.csv'):
+        if (os.path.exists(os.path.join(directory, fileName))):
+            os.remove(os.path.join(directory, fileName))
+    return {'directory': directory}
+
+# archive rows of cars (resultsWriter.CAR_COLUMNS: year, car, model, modelYear, EV, price, quality, batteryValue)
+def _archiveCarRows(archive, rows):
+    if ('directory' in archive):
+        resultsWriter.appendRows(os.path.join(archive['directory'], 'cars.csv'), resultsWriter.CAR_COLUMNS, rows)
+        return
+    for (year, carName, model, modelYear, isEV, price, quality, batteryValue) in rows:
+        if (carName not in archive['cars']):
+            archive['cars'][carName] = {'model': model, 'year': modelYear, 'EV': isEV, 'history': {}}
+        archive['cars'][carName]['history'][year] = {'price': price, 'quality': quality, 'batteryValue': batteryValue}
+
+# archive one year of population, in the documented format
+def _archivePopulationYear(archive, year, populationYear):
+    if ('directory' in archive):
+        resultsWriter.appendRows(os.path.join(archive['directory'], 'ownership.csv'), resultsWriter.OWNERSHIP_COLUMNS,
+                                 resultsWriter.ownershipRows(year, {year: populationYear}))
+    else:
+        _mergePopulationYear(archive['population'], year, populationYear)
+
+# the rows of cars.history[year] for the car ids in carIds
+def _registryCarRows(cars, year, carIds):
+    columns = cars.history[year]
+    return [[year, cars.names[carId], cars.model[carId], cars.modelYear[carId], bool(cars.isEV[carId]),
+             columns['price'][carId], columns['quality'][carId], columns['batteryValue'][carId]] for carId in carIds]
+
+# add one year of population (in the documented format) to the population dict into, merged with what is already there for that year
+def _mergePopulationYear(into, year, populationYear):
+    merged = into.setdefault(year, {})
+    for (incomeLevel, group) in populationYear.items():
+        merged.setdefault(incomeLevel, {'fraction': group['fraction'], 'cars': {}})['cars'].update(group['cars'])
+
+# names of the cars that are dead in year: quality 0, and owned by nobody in population
+def deadCars(year, population, cars):
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        owned = population.owned[year].any(axis=0)
+        quality = cars.history[year]['quality']
+        return [cars.names[carId] for carId in range(len(quality)) if ((quality[carId] == 0) and not owned[carId])]
+    owned = {carName for group in population[year].values() for carName in group['cars'].keys()}
+    return [carName for (carName, car) in cars.items() if ((car['history'][year]['quality'] == 0) and (carName not in owned))]
+
+# move the years of population and cars before firstYearKept into archive (or drop them, if archive is None)
+def archiveYears(population, cars, firstYearKept, archive=None):
+    oldYears = sorted(year for year in population.keys() if (year < firstYearKept))
+    if (archive is not None):
+        for year in oldYears:
+            _archivePopulationYear(archive, year, population[year])      # documented format, also from an OwnershipMatrix
+        historyYears = cars.history.keys() if (isinstance(cars, carRegistry.CarRegistry)) else \
+                       {year for car in cars.values() for year in car['history'].keys()}
+        for year in sorted(year for year in historyYears if (year < firstYearKept)):
+            _archiveCarRows(archive, resultsWriter.carRows(year, cars))
+    for year in oldYears:
+        if (isinstance(population, dict)):
+            del(population[year])
+        else:
+            del(population.fraction[year])
+            del(population.owned[year])
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        for year in [year for year in cars.history.keys() if (year < firstYearKept)]:
+            del(cars.history[year])
+    else:
+        for car in cars.values():
+            for year in [year for year in car['history'].keys() if (year < firstYearKept)]:
+                del(car['history'][year])
+
+# remove the cars named in retired from cars, moving their history to archive.  Past years of a population dict may still list
+#    them; they are archived with their year
+def retireCars(population, cars, retired, archive=None):
+    if (not retired):
+        return
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        retireRegistryCars(population, cars, set(retired), archive)
+        return
+    for carName in retired:
+        car = cars.pop(carName)
+        if (archive is not None):
+            _archiveCarRows(archive, [[year, carName, car['model'], car['year'], car['EV'], history['price'], history['quality'],
+                                       history['batteryValue']] for (year, history) in sorted(car['history'].items())])
+
+# the CarRegistry version of retireCars: the remaining cars are renumbered in registration order, in the registry's columns and
+#    every year of its history and of the OwnershipMatrix, in place (the names list stays the one population shares).  Who owned
+#    the retired cars in past years goes to the archive with those years
+def retireRegistryCars(population, cars, retired, archive=None):
+    import numpy as np                          # imported here so the dict path does not need numpy
+    kept = [carId for carId in range(len(cars)) if (cars.names[carId] not in retired)]
+    newIds = {carId: newId for (newId, carId) in enumerate(kept)}
+    if (archive is not None):
+        for year in sorted(cars.history.keys()):
+            _archiveCarRows(archive, _registryCarRows(cars, year, [carId for carId in range(len(cars.history[year]['price']))
+                                                                   if (carId not in newIds)]))
+        for year in population.keys():
+            retiredIds = [carId for carId in range(population.owned[year].shape[1]) if (carId not in newIds)]
+            owners = {}
+            for (g, r) in zip(*np.nonzero(population.owned[year][:, retiredIds])):
+                incomeLevel = population.incomeLevels[g]
+                group = owners.setdefault(incomeLevel, {'fraction': population.groupFractions[incomeLevel], 'cars': {}})
+                group['cars'][cars.names[retiredIds[r]]] = {'fraction': float(population.fraction[year][g, retiredIds[r]])}
+            _archivePopulationYear(archive, year, owners)
+
+    for year in list(cars.history.keys()):
+        numCars = len(cars.history[year]['price'])
+        keptThisYear = [carId for carId in kept if (carId < numCars)]
+        cars.history[year] = {column: array(values.typecode, [values[carId] for carId in keptThisYear])
+                              for (column, values) in cars.history[year].items()}
+        if (year in population):
+            writable = population.fraction[year].flags.writeable
+            for matrices in (population.fraction, population.owned):
+                matrices[year] = matrices[year][:, keptThisYear]
+                matrices[year].setflags(write=writable)
+    cars.comparable = array('l', [newIds.get(cars.comparable[carId], -1) for carId in kept])
+    cars.model = [cars.model[carId] for carId in kept]
+    cars.modelYear = array('l', [cars.modelYear[carId] for carId in kept])
+    cars.isEV = array('b', [cars.isEV[carId] for carId in kept])
+    cars.names[:] = [cars.names[carId] for carId in kept]
+    cars.ids = {key: newIds[carId] for (key, carId) in cars.ids.items() if (carId in newIds)}
+
+# returns an observer for genericModel.runYears that, after each year, retires the dead cars (if retireDead) and keeps the last
+#    keepYears years in memory (None keeps them all), moving what it removes into archive (None discards it)
+def retentionPolicy(archive=None, keepYears=2, retireDead=True):
+    if ((keepYears is not None) and (keepYears < 1)):
+        raise ValueError("keepYears must be at least 1: the next year starts from the last one")
+    def retain(year, population, cars):
+        if (keepYears is not None):
+            archiveYears(population, cars, year - keepYears + 1, archive)
+        if (retireDead):
+            retireCars(population, cars, deadCars(year, population, cars), archive)
+    return retain
+
+# an archive on disk read back into memory.  The files do not record income-group sizes; they are taken from groupFractions
+def readArchive(archive, groupFractions):
+    inMemory = newArchive()
+    (ownershipFile, carsFile) = (os.path.join(archive['directory'], 'ownership.csv'), os.path.join(archive['directory'], 'cars.csv'))
+    for (year, columns) in (resultsWriter.readYears(ownershipFile) if (os.path.exists(ownershipFile)) else []):
+        populationYear = {}
+        for (incomeLevel, carName, fraction) in zip(columns['incomeLevel'], columns['car'], columns['fraction']):
+            group = populationYear.setdefault(incomeLevel, {'fraction': groupFractions[incomeLevel], 'cars': {}})
+            group['cars'][carName] = {'fraction': fraction}
+        _mergePopulationYear(inMemory['population'], year, populationYear)
+    for (year, columns) in (resultsWriter.readYears(carsFile) if (os.path.exists(carsFile)) else []):
+        _archiveCarRows(inMemory, zip(*[columns[column] for column in resultsWriter.CAR_COLUMNS]))
+    return inMemory
+
+# the whole run -- (population, cars) in the documented formats -- from what is still in memory and its archive
+def fullRun(population, cars, archive):
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        (population, cars) = (population.toPopulation(), cars.toCars())
+    if ('directory' in archive):
+        lastGroups = population[max(population.keys())]
+        archive = readArchive(archive, {incomeLevel: group['fraction'] for (incomeLevel, group) in lastGroups.items()})
+    fullPopulation = {}
+    for source in (archive['population'], population):
+        for year in sorted(source.keys()):
+            _mergePopulationYear(fullPopulation, year, source[year])
+    fullCars = {carName: dict(car, history=dict(car['history'])) for (carName, car) in archive['cars'].items()}
+    for (carName, car) in cars.items():
+        if (carName in fullCars):
+            fullCars[carName]['history'].update(car['history'])
+        else:
+            fullCars[carName] = dict(car, history=dict(car['history']))
+    return {year: fullPopulation[year] for year in sorted(fullPopulation.keys())}, fullCars
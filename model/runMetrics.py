@@ -0,0 +1,90 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Built-in instrumentation of a run: where each simulated year spends its time, how much work it does, and how well the market
+#    cleared, without attaching a profiler.
+#
+# A run keeps its metrics in its run state (genericModel.newRunState), as {'current': ..., 'lastYear': ...}, so runs in different
+#    threads do not mix.  Metrics for a year start when genericModel.initializeYear begins it and are finished by
+#    genericModel.determinePrices; the finished year is then in the state's 'lastYear', so observers of genericModel.runYears can
+#    pick it up, e.g. metricsWriter(directory, runState).  While the year runs, its metrics are also in the denominator table (or
+#    the numpy market) as 'metrics', where the pricing functions count into them.
+#    Format of a year (plain data):
+#    {'year': 2023,
+#     'stages': {'initializeYear': {'seconds': 0.0002, 'calls': 1},    -- adding the year to cars and population
+#                'operatingCosts': {...},                               -- operating-cost table (numpy: all per-year arrays)
+#                'determineBuyers': {...},                              -- buy probabilities at the initial price, once per car
+#                'adjustPrice': {...},                                  -- price change that clears the market, once per car
+#                'updateOwnership': {...}},                             -- moving buyers into the car, once per car
+#     'pairs': 5400,              -- (income group, owned car, candidate car) combinations whose buy probability was evaluated
+#     'denominatorTerms': 9000,   -- terms of the buy-probability denominators computed
+#     'iterations': 0,            -- price iterations of the equilibrium solver (0 for sequential pricing)
+#     'residual': 0.013, 'maxResidual': 0.006}    -- sum and largest |buyers - sellers| over the cars, after the price adjustment
+
+import os, time
+
+from model import resultsWriter
+
+STAGES = ('initializeYear', 'operatingCosts', 'determineBuyers', 'adjustPrice', 'updateOwnership')
+
+clock = time.perf_counter
+
+def newRunMetrics():
+    return {'current': None, 'lastYear': None}
+
+def newYearMetrics():
+    return {'year': None, 'stages': {stage: {'seconds': 0, 'calls': 0} for stage in STAGES}, 'pairs': 0, 'denominatorTerms': 0,
+            'iterations': 0, 'residual': 0, 'maxResidual': 0}
+
+# state is the run's metrics, from newRunMetrics; returns the new year's metrics
+def beginYear(state):
+    state['current'] = newYearMetrics()
+    return state['current']
+
+# metrics of the year being simulated in state
+def currentYear(state):
+    if (state['current'] is None): beginYear(state)     # the year was not started by initializeYear, e.g. a benchmark pricing a copy
+    return state['current']
+
+# add the time since start to stage of a year's metrics; returns the time now, so consecutive stages can be chained
+def endStage(metrics, stage, start):
+    now = clock()
+    stageMetrics = metrics['stages'][stage]
+    stageMetrics['seconds'] += now - start
+    stageMetrics['calls'] += 1
+    return now
+
+def count(metrics, key, n):
+    metrics[key] += n
+
+# buyers minus sellers of one car after its price has been adjusted
+def recordResidual(metrics, residual):
+    metrics['residual'] += abs(residual)
+    metrics['maxResidual'] = max(metrics['maxResidual'], abs(residual))
+
+def endYear(state, year):
+    state['lastYear'] = currentYear(state)
+    state['lastYear']['year'] = year
+    state['current'] = None
+    return state['lastYear']
+
+METRICS_COLUMNS = (['year'] + [stage + suffix for stage in STAGES for suffix in ('Seconds', 'Calls')] +
+                   ['pairs', 'denominatorTerms', 'iterations', 'residual', 'maxResidual'])
+
+def metricsRow(metrics):
+    return ([metrics['year']] + [metrics['stages'][stage][key] for stage in STAGES for key in ('seconds', 'calls')] +
+            [metrics['pairs'], metrics['denominatorTerms'], metrics['iterations'], metrics['residual'], metrics['maxResidual']])
+
+# returns an observer for genericModel.runYears that appends each year's metrics to metrics.csv in directory, one row per year,
+#    next to the files of resultsWriter.  runState is the one given to runYears.  An existing metrics.csv is replaced
+def metricsWriter(directory, runState):
+    os.makedirs(directory, exist_ok=True)
+    fileName = os.path.join(directory, 'metrics.csv')
+    if (os.path.exists(fileName)):
+        os.remove(fileName)
+
+    def writeMetrics(year, population, cars):
+        lastYear = runState['metrics']['lastYear']
+        if ((lastYear is not None) and (lastYear['year'] == year)):
+            resultsWriter.appendRows(fileName, METRICS_COLUMNS, [metricsRow(lastYear)])
+    return writeMetrics
@@ -0,0 +1,173 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# A local HTTP service that runs scenarios for interactive tools (e.g. a dashboard asking many near-identical what-if questions),
+#    so each question pays neither process startup nor the simulation it shares with earlier ones.
+#
+#    python -m model.scenarioService --port 8765 --cache cache
+#    POST /scenario   {"overrides": {"utilityScale": 0.2, "gasCost": {"startYear": 2022, "values": [...]}},
+#                      "startYear": 2022, "numYears": 10}
+#                  -> {"key": ..., "source": "memory" | "disk" | "simulated", "sharedYears": 3, "rows": [...]}
+#    GET /health  -> {"status": "ok", "warmRuns": 5}
+# overrides are in the form of a parameter file (see parameterFiles) and are merged into the service's base parameters; rows
+#    are scenarioSweep.yearSummary for every year from startYear.  requestScenario() is a client for Python callers.
+#
+# Warm state.  The base parameters are read once, and every finished run is kept in memory (the maxRuns most recently used) and
+#    on disk in the resultCache, on the array path (CarRegistry and OwnershipMatrix).  A request is answered from a kept run
+#    with the same parameters if there is one.  Otherwise it is simulated, starting from the kept run that shares the most years
+#    with it -- runs whose parameters only differ in later years of the cost, battery or mandate series are identical until then
+#    (resultCache.firstDifferentYear) -- so its past years are shared rather than simulated again (sharedYears in the reply).
+# Batching.  Each run keeps its own state (genericModel.newRunState), but modelLog's sinks are shared by the process, so one
+#    thread simulates while the HTTP threads wait.  It takes every request that has arrived as one batch; identical requests are simulated once, and the others
+#    are run in order of their parameters so runs that share years follow each other.
+
+import argparse, collections, concurrent.futures, http.server, json, os, queue, threading, urllib.request
+
+from model import genericModel, parameterFiles, resultCache, scenarioSweep, specificModel
+
+DEFAULT_PORT = 8765
+Run = collections.namedtuple('Run', ['parameters', 'startYear', 'population', 'cars'])
+
+class ScenarioService:
+    def __init__(self, baseParameters=None, directory=resultCache.DEFAULT_DIRECTORY, maxRuns=32, maxBytes=None):
+        baseParameters = parameterFiles.loadParameters() if (baseParameters is None) else baseParameters
+        self.baseData = parameterFiles.toData(baseParameters)
+        self.directory = directory
+        self.maxRuns = maxRuns
+        self.maxBytes = maxBytes
+        self.runs = collections.OrderedDict()           # cache key -> Run, least recently used first
+        self.requests = queue.Queue()
+        threading.Thread(target=self.simulate, daemon=True).start()
+
+    # the reply to one request (a dict, as posted).  Called from any thread; waits for the simulation thread
+    def submit(self, request):
+        reply = concurrent.futures.Future()
+        self.requests.put((request, reply))
+        return reply.result()
+
+    # the simulation thread: answer the requests that have arrived, a batch at a time
+    def simulate(self):
+        while True:
+            batch = [self.requests.get()]
+            while (not self.requests.empty()):
+                batch.append(self.requests.get_nowait())
+            jobs = collections.OrderedDict()            # identical requests are run once
+            for (request, reply) in batch:
+                jobs.setdefault(json.dumps(request, sort_keys=True), []).append(reply)
+            for text in sorted(jobs.keys()):            # requests with similar overrides are run one after another
+                try:
+                    result = self.run(json.loads(text))
+                except Exception as error:              # reported to the caller rather than ending the thread
+                    for reply in jobs[text]: reply.set_exception(error)
+                    continue
+                for reply in jobs[text]: reply.set_result(result)
+
+    def parameters(self, overrides):
+        return parameterFiles.fromData(parameterFiles.mergeData(self.baseData, overrides))
+
+    # the kept run, or the run on disk, that shares the most years with a run of parameters from startYear.  Returns (run or None,
+    #    the last year that can be taken from it, where it is: 'disk' for this run's own cache entry, 'memory' for a kept run)
+    def startingPoint(self, key, parameters, startYear):
+        path = os.path.join(self.directory, key)
+        if (os.path.exists(os.path.join(path, 'meta.json'))):
+            (population, cars) = resultCache.loadEntry(path, float('inf'))
+            return Run(parameters, startYear, population, cars), max(population.keys()), 'disk'
+        (best, bestYear) = (None, startYear)
+        for run in self.runs.values():
+            if (run.startYear != startYear): continue
+            differentYear = resultCache.firstDifferentYear(parameters, run.parameters, startYear)
+            lastShared = max(run.population.keys()) if (differentYear is None) else min(differentYear - 1, max(run.population.keys()))
+            if (lastShared > bestYear):
+                (best, bestYear) = (run, lastShared)
+        return best, bestYear, 'memory'
+
+    # the reply to one request, from memory or disk, or simulated
+    def run(self, request):
+        parameters = self.parameters(request.get('overrides', {}))
+        startYear = int(request.get('startYear', 2022))
+        lastYear = startYear + int(request.get('numYears', 10))
+        key = resultCache.cacheKey(parameters, startYear)
+
+        if ((key in self.runs) and (max(self.runs[key].population.keys()) >= lastYear)):
+            (run, source, sharedYears) = (self.runs[key], 'memory', lastYear - startYear)
+            self.runs.move_to_end(key)
+        else:
+            (start, startLastYear, origin) = self.startingPoint(key, parameters, startYear)
+            if (start is None):
+                population, cars = specificModel.initializeArrays(startYear, parameters)
+            else:
+                population, cars = start.population, start.cars
+                if (startLastYear >= lastYear):
+                    (source, sharedYears) = (origin, lastYear - startYear)
+                cars = cars.upToYear(min(startLastYear, lastYear))
+                population = population.upToYear(min(startLastYear, lastYear), cars.names)
+            if ((start is None) or (startLastYear < lastYear)):
+                (source, sharedYears) = ('simulated', max(population.keys()) - startYear)
+                population, cars = genericModel.runYears(population, cars, lastYear - max(population.keys()), parameters)
+            if (source != 'disk'):              # everything but this run's own cache entry is saved under its key
+                os.makedirs(self.directory, exist_ok=True)
+                resultCache.saveEntry(os.path.join(self.directory, key), key, population, cars, startYear)
+                if (self.maxBytes is not None):
+                    resultCache.evict(self.directory, self.maxBytes, keep=os.path.join(self.directory, key))
+            run = Run(parameters, startYear, population, cars)
+            self.runs[key] = run
+            while (len(self.runs) > self.maxRuns):
+                self.runs.popitem(last=False)
+
+        rows = [scenarioSweep.yearSummary(year, run.population, run.cars) for year in range(startYear, lastYear+1)]
+        return {'key': key, 'source': source, 'sharedYears': sharedYears, 'rows': rows}
+
+# HTTP front end; server.service is the ScenarioService
+class ScenarioHandler(http.server.BaseHTTPRequestHandler):
+    def reply(self, status, body):
+        text = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def do_GET(self):
+        if (self.path == '/health'):
+            self.reply(200, {'status': 'ok', 'warmRuns': len(self.server.service.runs)})
+        else:
+            self.reply(404, {'error': "unknown path " + self.path})
+
+    def do_POST(self):
+        if (self.path != '/scenario'):
+            self.reply(404, {'error': "unknown path " + self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            self.reply(200, self.server.service.submit(request))
+        except (ValueError, TypeError, KeyError) as error:           # a bad request: malformed JSON or parameters
+            self.reply(400, {'error': str(error)})
+        except Exception as error:                                   # the service failed; the client still gets a JSON reply
+            self.reply(500, {'error': type(error).__name__ + ": " + str(error)})
+
+    def log_message(self, format, *args):
+        pass                                    # requests are not logged to stderr
+
+# an HTTP server for service on localhost (port 0 picks a free port, see server.server_address); call serve_forever() to run it
+def makeServer(service, port=DEFAULT_PORT):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), ScenarioHandler)
+    server.service = service
+    return server
+
+# client: post a scenario to the service at url (e.g. "http://127.0.0.1:8765") and return its reply
+def requestScenario(url, overrides=None, startYear=2022, numYears=10):
+    body = json.dumps({'overrides': overrides or {}, 'startYear': startYear, 'numYears': numYears}).encode('utf-8')
+    request = urllib.request.Request(url + '/scenario', data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="serve scenario runs on localhost")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache', default=resultCache.DEFAULT_DIRECTORY, help="directory of the on-disk result cache")
+    parser.add_argument('--parameters', default=parameterFiles.DEFAULT_FILE, help="parameter file the overrides apply to")
+    parser.add_argument('--maxRuns', type=int, default=32, help="finished runs kept in memory")
+    args = parser.parse_args()
+    server = makeServer(ScenarioService(parameterFiles.loadParameters(args.parameters), args.cache, args.maxRuns), args.port)
+    print("serving scenarios on http://127.0.0.1:%d" % server.server_address[1])
+    server.serve_forever()
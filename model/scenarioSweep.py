@@ -0,0 +1,102 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Run the model over many variants of globalParameters and collect a per-year summary of each into one table.
+#
+# A scenario is a dict of overrides on top of model/defaultGlobalParameters.py, e.g.
+#    {'utilityScale': 0.2, 'transactionCost': 250}
+#    {'gasCost': {2022: 5.0, 2023: 5.25, ...}}               # nested dicts are merged, so this replaces some or all years
+#    {'peopleGroups': {10000: {'discountRate': 0.2}}}
+# parameterGrid() builds the cartesian product of lists of values.  Scenarios are fanned out across a process pool; each one is
+#    simulated with its own parameters passed explicitly to the model, so nothing depends on module globals.  Rows come back
+#    in (scenario, year) order whatever the number of workers.
+
+import concurrent.futures, csv, itertools
+
+from model import carRegistry, genericModel, specificModel
+from model.defaultGlobalParameters import globalParameters as defaultGlobalParameters
+
+# copy of parameters with overrides applied; dicts are merged key by key, anything else is replaced.  Parts that are not
+#    overridden are shared with parameters, which the model never changes
+def mergeParameters(parameters, overrides):
+    merged = dict(parameters)
+    for (key, value) in overrides.items():
+        if (isinstance(value, dict) and isinstance(parameters.get(key), dict)):
+            merged[key] = mergeParameters(parameters[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+# {'utilityScale': [0.1, 0.15], 'transactionCost': [250, 500]} -> a list of 4 scenarios, one for each combination
+def parameterGrid(axes):
+    keys = list(axes.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[axes[key] for key in keys])]
+
+# one row of summary results for a year of a finished run: ownership-weighted mean price and quality, and the shares of the
+#    population owning a car, a car new this year, and an EV
+def yearSummary(year, population, cars):
+    if (isinstance(cars, carRegistry.CarRegistry)):
+        return arrayYearSummary(year, population, cars)
+    row = {'year': year, 'ownedShare': 0, 'newCarShare': 0, 'evShare': 0, 'meanPrice': 0, 'meanQuality': 0}
+    for group in population[year].values():
+        for (carName, val) in group['cars'].items():
+            history = cars[carName]['history'][year]
+            row['ownedShare'] += val['fraction']
+            row['newCarShare'] += val['fraction'] if (cars[carName]['year'] == year) else 0
+            row['evShare'] += val['fraction'] if (cars[carName]['EV']) else 0
+            row['meanPrice'] += val['fraction'] * history['price']
+            row['meanQuality'] += val['fraction'] * history['quality']
+    if (row['ownedShare'] > 0):
+        row['meanPrice'] /= row['ownedShare']
+        row['meanQuality'] /= row['ownedShare']
+    return row
+
+# yearSummary of a run kept in an OwnershipMatrix and a CarRegistry, from the columns
+def arrayYearSummary(year, population, cars):
+    import numpy as np                          # imported here so the dict path does not need numpy
+    fraction = population.fraction[year].sum(axis=0)                 # [car id]
+    numCars = len(fraction)
+    price = np.frombuffer(cars.history[year]['price'])
+    quality = np.frombuffer(cars.history[year]['quality'])
+    ownedShare = float(fraction.sum())
+    row = {'year': year, 'ownedShare': ownedShare,
+           'newCarShare': float(fraction[np.array(cars.modelYear[:numCars]) == year].sum()),
+           'evShare': float(fraction[np.array(cars.isEV[:numCars], dtype=bool)].sum()),
+           'meanPrice': float(fraction @ price), 'meanQuality': float(fraction @ quality)}
+    if (ownedShare > 0):
+        row['meanPrice'] /= ownedShare
+        row['meanQuality'] /= ownedShare
+    return row
+
+# simulate one scenario and return its summary rows.  Takes a single tuple so it can be handed to a process pool
+def runScenario(args):
+    (scenario, overrides, startYear, numYears, baseParameters) = args
+    parameters = mergeParameters(baseParameters, overrides)
+    cars = specificModel.initializeCars(startYear, parameters)
+    population = specificModel.initializePopulation(cars, startYear, parameters)
+    population, cars = genericModel.runYears(population, cars, numYears, parameters)
+    return [dict(yearSummary(year, population, cars), scenario=scenario) for year in sorted(population.keys())]
+
+# run every scenario (a list of override dicts) and return all summary rows as one list, ordered by scenario then year.
+#    workers=1 runs in this process; None uses one process per CPU.  Each task sent to a worker process carries batchSize
+#    scenarios, which saves round trips when there are many short ones
+def runSweep(scenarios, startYear=2022, numYears=10, workers=None, baseParameters=None, batchSize=1):
+    baseParameters = defaultGlobalParameters if (baseParameters is None) else baseParameters
+    jobs = [(scenario, overrides, startYear, numYears, baseParameters) for (scenario, overrides) in enumerate(scenarios)]
+    if (workers == 1):
+        results = list(map(runScenario, jobs))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(runScenario, jobs, chunksize=batchSize))     # map returns results in job order
+    return [row for rows in results for row in rows]
+
+# write summary rows as CSV, with the scenario's scalar overrides as extra columns
+def writeTable(rows, scenarios, fileName):
+    overrideKeys = sorted({key for overrides in scenarios for (key, value) in overrides.items() if not isinstance(value, dict)})
+    columns = ['scenario', 'year', 'ownedShare', 'newCarShare', 'evShare', 'meanPrice', 'meanQuality'] + overrideKeys
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            overrides = scenarios[row['scenario']]
+            writer.writerow(dict(row, **{key: overrides.get(key) for key in overrideKeys}))
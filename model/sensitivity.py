@@ -0,0 +1,103 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Sensitivity of one result of a run (e.g. the EV share in 2035) to the model's inputs, by central finite differences: each input
+#    is scaled by 1+step and by 1-step in turn, and
+#        derivative = (high - low) / (2 * step * value)          elasticity = (high - low) / (2 * step * base)
+#    where value is the input's value and base is the result of the unperturbed run.  The inputs are named:
+#    'transactionCost', 'utilityScale'      -- those parameters
+#    'gasPriceLevel'                        -- a factor on every year of gasCost (its value is 1)
+#    'discountRate.10000', ...              -- one income group's discountRate
+#    'discountRate'                         -- a factor on every group's discountRate (its value is 1)
+# The result is a column of scenarioSweep.yearSummary ('evShare', 'meanPrice', ...) in resultYear.
+#
+# The inputs change at forkYear: the run with the base parameters is simulated once up to forkYear and checkpointed (see
+#    checkpoint), and every perturbed run -- and the base run -- continues from that checkpoint, so the common years are not
+#    simulated again.  forkYear=startYear perturbs every simulated year.  The runs from the checkpoint are spread over a process
+#    pool, which loads the checkpoint file rather than being sent the state.
+#
+#    table = sensitivity.sensitivityTable(sensitivity.inputNames(globalParameters), 'evShare', 2035)
+#    sensitivity.writeTable(table, "sensitivity.csv")
+
+import concurrent.futures, csv, math, tempfile
+
+from model import checkpoint, genericModel, scenarioSweep, specificModel
+from model.defaultGlobalParameters import globalParameters as defaultGlobalParameters
+
+DEFAULT_STEP = 0.05
+COLUMNS = ['input', 'value', 'metric', 'year', 'base', 'low', 'high', 'derivative', 'elasticity']
+
+# every input of parameters: the scalars, the gas price level, and each group's discount rate
+def inputNames(parameters):
+    return (['transactionCost', 'utilityScale', 'gasPriceLevel'] +
+            ['discountRate.' + str(incomeLevel) for incomeLevel in sorted(parameters['peopleGroups'].keys())])
+
+def inputValue(parameters, name):
+    if (name in ('gasPriceLevel', 'discountRate')):
+        return 1
+    if (name.startswith('discountRate.')):
+        return parameters['peopleGroups'][int(name.split('.')[1])]['discountRate']
+    if (name not in parameters):
+        raise ValueError("unknown input " + name)
+    return parameters[name]
+
+# a copy of parameters with the input scaled by factor
+def perturbed(parameters, name, factor):
+    if (name == 'gasPriceLevel'):
+        overrides = {'gasCost': {year: cost * factor for (year, cost) in parameters['gasCost'].items()}}
+    elif (name == 'discountRate'):
+        overrides = {'peopleGroups': {incomeLevel: {'discountRate': group['discountRate'] * factor}
+                                      for (incomeLevel, group) in parameters['peopleGroups'].items()}}
+    elif (name.startswith('discountRate.')):
+        overrides = {'peopleGroups': {int(name.split('.')[1]): {'discountRate': inputValue(parameters, name) * factor}}}
+    else:
+        overrides = {name: inputValue(parameters, name) * factor}
+    return scenarioSweep.mergeParameters(parameters, overrides)
+
+# the metric in resultYear of a run continued from the checkpoint in fileName.  Takes a single tuple so it can be handed to a
+#    process pool
+def runFromCheckpoint(args):
+    (fileName, parameters, metric, resultYear) = args
+    population, cars = checkpoint.loadCheckpoint(fileName)
+    population, cars = genericModel.runYears(population, cars, resultYear - max(population.keys()), parameters)
+    return scenarioSweep.yearSummary(resultYear, population, cars)[metric]
+
+# one row per input (in COLUMNS) of the sensitivity of metric in resultYear.  workers=1 runs in this process; None uses one process
+#    per CPU
+def sensitivityTable(inputs, metric='evShare', resultYear=2035, startYear=2022, forkYear=None, step=DEFAULT_STEP, workers=None,
+                     baseParameters=None):
+    baseParameters = defaultGlobalParameters if (baseParameters is None) else baseParameters
+    forkYear = startYear if (forkYear is None) else forkYear
+    if (not (startYear <= forkYear < resultYear)):
+        raise ValueError("need startYear <= forkYear < resultYear, not " + str((startYear, forkYear, resultYear)))
+
+    population, cars = specificModel.initializeArrays(startYear, baseParameters)
+    population, cars = genericModel.runYears(population, cars, forkYear - startYear, baseParameters)
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = checkpoint.checkpointFileName(directory, forkYear)
+        checkpoint.saveCheckpoint(fileName, population, cars, forkYear)
+        jobs = [(fileName, baseParameters, metric, resultYear)]
+        for name in inputs:
+            jobs += [(fileName, perturbed(baseParameters, name, 1 + step), metric, resultYear),
+                     (fileName, perturbed(baseParameters, name, 1 - step), metric, resultYear)]
+        if (workers == 1):
+            results = list(map(runFromCheckpoint, jobs))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(runFromCheckpoint, jobs))
+
+    base = results[0]
+    table = []
+    for (i, name) in enumerate(inputs):
+        (high, low) = results[1 + 2*i: 3 + 2*i]
+        value = inputValue(baseParameters, name)
+        table.append({'input': name, 'value': value, 'metric': metric, 'year': resultYear, 'base': base, 'low': low, 'high': high,
+                      'derivative': (high - low) / (2 * step * value) if (value != 0) else math.nan,
+                      'elasticity': (high - low) / (2 * step * base) if (base != 0) else math.nan})
+    return table
+
+def writeTable(table, fileName):
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(table)
@@ -1,16 +1,18 @@
-import functools
-
 from model.genericModel import carsSortedByQuality
+from model import carRegistry, utilityCurves
+
+globalParameters = {}    # this will be replaced by whoever calls us; or pass parameters explicitly to each function
 
-globalParameters = {}    # this will be replaced by whoever calls us
+def _parameters(parameters): return globalParameters if (parameters is None) else parameters
 
-def initializeCarsForModelType(year, modelType, isEV):
-    initialQuality = globalParameters['carTypes'][modelType]['initialQuality']
-    depreciationCurve = globalParameters['carTypes'][modelType]['depreciationCurve']
+def initializeCarsForModelType(year, modelType, isEV, parameters=None):
+    parameters = _parameters(parameters)
+    initialQuality = parameters['carTypes'][modelType]['initialQuality']
+    depreciationCurve = parameters['carTypes'][modelType]['depreciationCurve']
     numYears = len(depreciationCurve) - 1   # -1 since last entry is 0
     carsThisModel = {}
     for age in range(numYears):
-        name = modelType + "-" + str(year - age) + "-" + str(isEV)
+        name = carRegistry.carName(modelType, year - age, isEV)
         # arbitrary assumption -- initially, price = quality
         carsThisModel[name] = {'model': modelType, 'year': year - age, 'EV': isEV,
             'history': {
@@ -24,37 +26,31 @@ def initializeCarsForModelType(year, modelType, isEV):
     return carsThisModel
 
 # create the cars object -- just called once per simulation
-def initializeCars(year):
+def initializeCars(year, parameters=None):
+    parameters = _parameters(parameters)
     # arbitrary assumptions -- equal shares of each model type and each year until the quality is 0.
     allCars = {}
-    for modelType in globalParameters['carTypes'].keys():
-        allCars.update(initializeCarsForModelType(year, modelType, False))
+    for modelType in parameters['carTypes'].keys():
+        allCars.update(initializeCarsForModelType(year, modelType, False, parameters))
     return allCars
 
 # arbitrary assumption for shape of utility curve -- for qualities near the peak, utility is equal to
 #    quality; curve drops to zero from 1.5*peak to 2.0*peak, and from 0.75*peak to 0.5*peak
-def myUtility(peak, quality):
-    if (quality < 0.5*peak):
-        return 0
-    if (quality < 0.75*peak):
-        return 0.75*peak*(quality - 0.5*peak)/(0.75*peak - 0.5*peak)
-    if (quality < 1.5*peak):
-        return quality
-    if (quality < 2.0*peak):
-        return 1.5*peak*(2.0*peak - quality)/(2.0*peak - 1.5*peak)
-    return 0
+# The curve is data (a PiecewiseLinearUtility), so it can be pickled, hashed and evaluated on arrays; it can be stored directly
+#    as the utility function for a demographic group.  It is defined in utilityCurves, so parameter files can be read without
+#    importing the model
+peakedUtility = utilityCurves.peakedUtility
 
-# curry myUtility -- this function returns a function of quality only; that function can be stored as the utility
-#    function for a demographic group
-def peakedUtility(peak):
-    return functools.partial(myUtility, peak)
+def myUtility(peak, quality):
+    return peakedUtility(peak)(quality)
 
 # arbitrary assumption for initial ownership of cars -- lowest quality cars owned by lowest income-level groups
-def initializePopulation(cars, year):
+def initializePopulation(cars, year, parameters=None):
+    parameters = _parameters(parameters)
     # initialize population for this year with empty car lists
     populationThisYear = {
         year: {
-            incomeLevel: {'fraction': val['fraction'], 'cars': {}} for incomeLevel,val in globalParameters['peopleGroups'].items()
+            incomeLevel: {'fraction': val['fraction'], 'cars': {}} for incomeLevel,val in parameters['peopleGroups'].items()
         }
     }
 
@@ -64,9 +60,10 @@ def initializePopulation(cars, year):
     modelShare = 1.0 / len(allModels)           # e.g. if there are 20 models, 5% of population has each model
     currentModel = 0
     modelShareRemaining = modelShare
-    for incomeLevel in sorted(globalParameters['peopleGroups'].keys()):   #[peopleGroup['income'] for peopleGroup in globalParameters['peopleGroups']]:
-        populationRemaining = populationThisYear[year][incomeLevel]['fraction']
-        while (populationRemaining > 0.0001):     # don't continue if only roundoff error remains
+    for incomeLevel in sorted(parameters['peopleGroups'].keys()):   #[peopleGroup['income'] for peopleGroup in parameters['peopleGroups']]:
+        groupFraction = populationThisYear[year][incomeLevel]['fraction']
+        populationRemaining = groupFraction
+        while (populationRemaining > 0.0001 * groupFraction):     # don't continue if only roundoff error remains
             if (populationRemaining >= modelShareRemaining):
                 populationThisYear[year][incomeLevel]['cars'][allModels[currentModel]] = {'fraction': modelShareRemaining}
                 populationRemaining -= modelShareRemaining
@@ -79,5 +76,14 @@ def initializePopulation(cars, year):
 
     return populationThisYear
 
+# cars and population for the array path -- a CarRegistry and an OwnershipMatrix -- with the same initial state as
+#    initializeCars and initializePopulation
+def initializeArrays(year, parameters=None):
+    from model import ownershipMatrix          # imported here so the dict path does not need numpy
+    cars = initializeCars(year, parameters)
+    population = initializePopulation(cars, year, parameters)
+    registry = carRegistry.fromCars(cars)
+    return ownershipMatrix.fromPopulation(population, registry), registry
+
 if __name__ == "__main__":
     import test_model
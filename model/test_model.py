@@ -1,6 +1,8 @@
+import logging, math, os
+
 from model.defaultGlobalParameters import globalParameters
 
-from model import specificModel, genericModel
+from model import specificModel, genericModel, carRegistry, ownershipMatrix
 genericModel.globalParameters = globalParameters
 specificModel.globalParameters = globalParameters
 
@@ -20,4 +22,485 @@ for incomeLevel in population[thisYear].keys():
 
 #print("\n\nPopulation:\n", population, "\n\nCars:\n", cars, "\n\n\n")
 
-print("\n\n\n")
\ No newline at end of file
+print("\n\n\n")
+
+# run the model forward from a fresh start, with sequential pricing on the given backend; if useRegistry, cars are kept in a
+#    CarRegistry and population in an OwnershipMatrix
+def runYears(numYears, pricingBackend, useRegistry=False):
+    parameters = dict(globalParameters, pricingMode='sequential', pricingBackend=pricingBackend)
+    cars = specificModel.initializeCars(thisYear, parameters)
+    population = specificModel.initializePopulation(cars, thisYear, parameters)
+    if (useRegistry):
+        cars = carRegistry.fromCars(cars)
+        population = ownershipMatrix.fromPopulation(population, cars)
+    for i in range(numYears):
+        population, cars = genericModel.determinePrices(*genericModel.initializeYear(population, cars, parameters), parameters)
+    if (useRegistry):
+        return population.toPopulation(), cars.toCars()
+    return population, cars
+
+def assertSameResults(reference, results):
+    (referencePopulation, referenceCars) = reference
+    (population, cars) = results
+    for (year, groups) in referencePopulation.items():
+        for (incomeLevel, group) in groups.items():
+            assert(group['cars'].keys() == population[year][incomeLevel]['cars'].keys())
+            for (carName, val) in group['cars'].items():
+                assert(math.isclose(val['fraction'], population[year][incomeLevel]['cars'][carName]['fraction'], rel_tol=1e-9, abs_tol=1e-12))
+    assert(referenceCars.keys() == cars.keys())
+    for (carName, car) in referenceCars.items():
+        for (year, val) in car['history'].items():
+            assert(math.isclose(val['price'], cars[carName]['history'][year]['price'], rel_tol=1e-9, abs_tol=1e-9))
+
+# determineBuyers as it was before its denominators became running sums: every denominator summed afresh, car by car
+def referenceBuyers(year, population, cars, sortedCarNames, carName, denominatorTable=None, parameters=None):
+    parameters = denominatorTable['parameters']
+    priceThisCar = cars[carName]['history'][year]['price']
+    qualityThisCar = cars[carName]['history'][year]['quality']
+    lowerQualityCarNames = sortedCarNames[sortedCarNames.index(carName)+1:]
+    transactionCost = parameters['transactionCost']
+    buyerMemory = {}
+    numBought = 0
+    for (incomeLevel, peopleGroup) in population[year].items():
+        operatingCostsThisCar = genericModel.operatingCosts(cars, carName, incomeLevel, year, parameters)
+        utilityFunction = parameters['peopleGroups'][incomeLevel]['utilityFunction']
+        if (utilityFunction(qualityThisCar) == 0): continue
+        for otherCarName in lowerQualityCarNames:
+            if (otherCarName not in peopleGroup['cars'].keys()): continue
+            priceOtherCar = cars[otherCarName]['history'][year]['price']
+            utilityScale = max(priceOtherCar * parameters['utilityScale'], 500)
+            scaledExp = genericModel.scaledExpCurried(utilityScale)
+            qualityOtherCar = cars[otherCarName]['history'][year]['quality']
+            operatingCostsOtherCar = genericModel.operatingCosts(cars, otherCarName, incomeLevel, year, parameters)
+            numerator = scaledExp(utilityFunction(qualityThisCar) - priceThisCar + priceOtherCar - operatingCostsThisCar +
+                                  operatingCostsOtherCar - transactionCost)
+            denominator = scaledExp(utilityFunction(qualityOtherCar) - operatingCostsOtherCar) if (utilityFunction(qualityOtherCar) > 0) else 0
+            for thirdCarName in sortedCarNames[sortedCarNames.index(carName):sortedCarNames.index(otherCarName)]:
+                denominator += scaledExp(utilityFunction(cars[thirdCarName]['history'][year]['quality']) -
+                                         cars[thirdCarName]['history'][year]['price'] + priceOtherCar -
+                                         genericModel.operatingCosts(cars, thirdCarName, incomeLevel, year, parameters) +
+                                         operatingCostsOtherCar - transactionCost)
+            numBuyer = peopleGroup['cars'][otherCarName]['fraction'] * numerator / denominator
+            numBought += numBuyer
+            buyerMemory.setdefault(incomeLevel, {'cars': []})['cars'].append(
+                {'model': otherCarName, 'numerator': numerator, 'denominator': denominator, 'utilityFunction': utilityFunction,
+                 'utilityScale': utilityScale, 'numBuyer': numBuyer})
+    return numBought, buyerMemory
+
+# the running-sum denominators must agree with the per-car loop they replaced (without EVs, as that loop predates them)
+def test_runningSumsMatchPerCarLoop(monkeypatch):
+    parameters = {key: value for (key, value) in globalParameters.items() if (key != 'newCarEVMandate')}
+    def run():
+        cars = specificModel.initializeCars(thisYear, parameters)
+        population = specificModel.initializePopulation(cars, thisYear, parameters)
+        return genericModel.runYears(population, cars, 3, parameters)
+    results = run()
+    assert(not any(car['EV'] for car in results[1].values()))
+    monkeypatch.setattr(genericModel, 'determineBuyers', referenceBuyers)
+    assertSameResults(run(), results)
+
+# the numpy backend must agree with the dict-based reference
+def test_numpyBackendMatchesDictBackend():
+    assertSameResults(runYears(5, 'dict'), runYears(5, 'numpy'))
+
+# and so must a run that keeps its cars in a CarRegistry and its population in an OwnershipMatrix
+def test_carRegistryMatchesCarsDict():
+    assertSameResults(runYears(5, 'dict'), runYears(5, 'numpy', useRegistry=True))
+
+# the utility curves are data: they must evaluate the same on numbers and arrays, and survive pickling for worker processes
+def test_peakedUtilityIsData():
+    import pickle
+    import numpy as np
+    from model import utilityCurves
+    utilityFunction = specificModel.peakedUtility(10000)
+    qualities = np.linspace(0, 25000, 101)
+    assert(list(utilityFunction(qualities)) == [utilityFunction(float(q)) for q in qualities])
+    assert(utilityFunction(4999) == 0 and utilityFunction(6250) == 3750 and utilityFunction(12000) == 12000 and utilityFunction(20000) == 0)
+    assert(pickle.loads(pickle.dumps(utilityFunction)) == utilityFunction)
+    assert(hash(utilityFunction) == hash(specificModel.peakedUtility(10000)))
+    assert(utilityFunction.peak() == 10000 and specificModel.peakedUtility(0.1).peak() == 0.1)
+    assert(utilityCurves.PiecewiseLinearUtility((1000, 2000, 3000), (0, 2000, 0)).peak() is None)
+
+# resuming from a checkpoint must give exactly the results of the uninterrupted run
+def test_checkpointResumeIsBitIdentical(tmp_path):
+    import numpy as np
+    from model import checkpoint
+    cars = specificModel.initializeCars(thisYear, globalParameters)
+    population = specificModel.initializePopulation(cars, thisYear, globalParameters)
+    cars = carRegistry.fromCars(cars)
+    population = ownershipMatrix.fromPopulation(population, cars)
+    population, cars = genericModel.runYears(population, cars, 6, globalParameters, [checkpoint.checkpointWriter(str(tmp_path))])
+
+    resumedPopulation, resumedCars = checkpoint.loadCheckpoint(checkpoint.checkpointFileName(str(tmp_path), thisYear+3))
+    resumedPopulation, resumedCars = genericModel.runYears(resumedPopulation, resumedCars, 3, globalParameters)
+    for year in range(thisYear+4, thisYear+7):
+        assert(np.array_equal(population.fraction[year], resumedPopulation.fraction[year]))
+        assert(cars.history[year]['price'] == resumedCars.history[year]['price'])
+
+# a run kept in dicts resumes from its checkpoint as dicts, with results bit-identical to the uninterrupted run
+def test_checkpointResumeOfDictRunIsBitIdentical(tmp_path):
+    from model import checkpoint
+    parameters = dict(globalParameters, pricingMode='sequential', pricingBackend='dict')
+    cars = specificModel.initializeCars(thisYear, parameters)
+    population = specificModel.initializePopulation(cars, thisYear, parameters)
+    population, cars = genericModel.runYears(population, cars, 6, parameters, [checkpoint.checkpointWriter(str(tmp_path))])
+
+    resumedPopulation, resumedCars = checkpoint.loadCheckpoint(checkpoint.checkpointFileName(str(tmp_path), thisYear+3))
+    assert(isinstance(resumedPopulation, dict) and isinstance(resumedCars, dict))
+    resumedPopulation, resumedCars = genericModel.runYears(resumedPopulation, resumedCars, 3, parameters)
+    for year in range(thisYear+4, thisYear+7):
+        assert(population[year] == resumedPopulation[year])
+        assert({carName: car['history'][year] for (carName, car) in cars.items() if (year in car['history'])} ==
+               {carName: car['history'][year] for (carName, car) in resumedCars.items() if (year in car['history'])})
+
+# both backends must report the same market fix-ups as events
+def test_backendsRecordSameEvents():
+    from model import modelLog
+    counts = []
+    for pricingBackend in ('dict', 'numpy'):
+        events = []
+        modelLog.eventSinks.append(events.append)
+        try:
+            runYears(5, pricingBackend)
+        finally:
+            modelLog.eventSinks.remove(events.append)
+        counts.append(sorted((event['kind'], event['year'], event['car']) for event in events))
+    assert(counts[0] == counts[1] and len(counts[0]) > 0)
+
+# run metrics are reported after every year, and both backends evaluate the same (group, owned car, candidate car) pairs
+def test_runMetricsPerYear():
+    from model import runMetrics
+    pairs = {}
+    for pricingBackend in ('dict', 'numpy'):
+        parameters = dict(globalParameters, pricingMode='sequential', pricingBackend=pricingBackend)
+        cars = specificModel.initializeCars(thisYear, parameters)
+        population = specificModel.initializePopulation(cars, thisYear, parameters)
+        (metrics, runState) = ([], genericModel.newRunState())
+        genericModel.runYears(population, cars, 3, parameters, [lambda year, population, cars: metrics.append(runState['metrics']['lastYear'])],
+                              runState)
+        assert([m['year'] for m in metrics] == [thisYear+1, thisYear+2, thisYear+3])
+        assert(all(m['stages'][stage]['calls'] > 0 for m in metrics for stage in runMetrics.STAGES))
+        pairs[pricingBackend] = [m['pairs'] for m in metrics]
+    assert(pairs['dict'] == pairs['numpy'])
+
+# runs in different threads keep their metrics apart
+def test_runMetricsOfConcurrentRuns():
+    import threading
+    parameters = dict(globalParameters, pricingMode='sequential')
+    years = {}
+    def run(numYears):
+        cars = specificModel.initializeCars(thisYear, parameters)
+        population = specificModel.initializePopulation(cars, thisYear, parameters)
+        (metrics, runState) = ([], genericModel.newRunState())
+        genericModel.runYears(population, cars, numYears, parameters,
+                              [lambda year, population, cars: metrics.append(runState['metrics']['lastYear'])], runState)
+        years[numYears] = [m['year'] for m in metrics]
+    threads = [threading.Thread(target=run, args=(numYears,)) for numYears in (2, 4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert(years == {2: [thisYear+1, thisYear+2], 4: [thisYear+1, thisYear+2, thisYear+3, thisYear+4]})
+
+# the equilibrium solver must clear every used-car market each year, and leave every income group's total ownership unchanged
+def test_equilibriumPricingClearsMarket(caplog):
+    import pytest
+    parameters = dict(globalParameters, pricingMode='equilibrium')
+    cars = specificModel.initializeCars(thisYear, parameters)
+    population = specificModel.initializePopulation(cars, thisYear, parameters)
+    (metrics, runState) = ([], genericModel.newRunState())
+    population, cars = genericModel.runYears(population, cars, 5, parameters,
+                                             [lambda year, population, cars: metrics.append(runState['metrics']['lastYear'])], runState)
+    assert(all(m['maxResidual'] < 1e-8 and 0 < m['iterations'] < 50 for m in metrics))
+    for (incomeLevel, group) in population[thisYear+5].items():
+        assert(math.isclose(sum(val['fraction'] for val in group['cars'].values()),
+                            sum(val['fraction'] for val in population[thisYear][incomeLevel]['cars'].values())))
+
+    # a solver stopped short warns, and the solver takes no pricingBackend
+    cars = specificModel.initializeCars(thisYear, parameters)
+    population = specificModel.initializePopulation(cars, thisYear, parameters)
+    with caplog.at_level(logging.WARNING, logger='model'):
+        genericModel.runYears(population, cars, 1, dict(parameters, equilibriumMaxIterations=1))
+    assert("did not converge" in caplog.text)
+    with pytest.raises(ValueError, match="pricingBackend"):
+        genericModel.runYears(population, cars, 1, dict(parameters, pricingBackend='numpy'))
+
+# ensemble members are seeded individually, so results do not depend on the number of members or of worker processes
+def test_ensembleIsReproducible():
+    import numpy as np
+    from model import monteCarlo
+    uncertainty = {'gasCost': {'distribution': 'randomWalk', 'drift': 0.02, 'volatility': 0.1},
+                   'utilityScale': {'distribution': 'uniform', 'low': 0.1, 'high': 0.2}}
+    (years, values) = monteCarlo.runEnsemble(uncertainty, 3, seed=7, numYears=2, workers=1, baseParameters=globalParameters)
+    (moreYears, moreValues) = monteCarlo.runEnsemble(uncertainty, 4, seed=7, numYears=2, workers=2, baseParameters=globalParameters)
+    assert(years == moreYears == [thisYear, thisYear+1, thisYear+2])
+    assert(np.array_equal(values, moreValues[:3]))
+    assert(len(list(monteCarlo.percentileBands(years, values))) == len(years) * len(monteCarlo.METRICS))
+
+# a cached run is served from disk, and a longer run continues the cached one with exactly the results of a run made in one go
+def test_resultCacheContinuesCachedRun(tmp_path):
+    import numpy as np
+    from model import resultCache
+    directory = str(tmp_path)
+    shortPopulation, shortCars = resultCache.cachedRun(globalParameters, thisYear, 3, directory)
+    population, cars = resultCache.cachedRun(globalParameters, thisYear, 5, directory)
+    cachedPopulation, cachedCars = resultCache.cachedRun(globalParameters, thisYear, 4, directory)
+    assert(len(os.listdir(directory)) == 1)
+    assert(sorted(cachedPopulation.keys()) == list(range(thisYear, thisYear+5)))
+
+    freshCars = carRegistry.fromCars(specificModel.initializeCars(thisYear, globalParameters))
+    freshPopulation = ownershipMatrix.fromPopulation(specificModel.initializePopulation(freshCars.toCars(), thisYear, globalParameters),
+                                                     freshCars)
+    freshPopulation, freshCars = genericModel.runYears(freshPopulation, freshCars, 5, globalParameters)
+    for year in range(thisYear, thisYear+5):
+        assert(np.array_equal(cachedPopulation.fraction[year], freshPopulation.fraction[year]))
+        assert(cachedCars.history[year]['price'] == freshCars.history[year]['price'])
+    assert(population.fraction[thisYear+5].tobytes() == freshPopulation.fraction[thisYear+5].tobytes())
+
+# EVs are offered once there is a mandate, and the mandate caps the sales of each model's new gas car
+def test_evMandateCapsNewGasCars():
+    from model import equilibriumSolver
+    parameters = dict(globalParameters, newCarEVMandate={2023: 0.5, 2024: 1.0})
+    cars = specificModel.initializeCars(thisYear, parameters)
+    population = specificModel.initializePopulation(cars, thisYear, parameters)
+    population, cars = genericModel.runYears(population, cars, 2, parameters)
+    def newCarsOwned(year, isEV):
+        return {model: sum(group['cars'].get(carRegistry.carName(model, year, isEV), {'fraction': 0})['fraction']
+                           for group in population[year].values()) for model in parameters['carTypes'].keys()}
+    (evs, gasCars) = (newCarsOwned(2023, True), newCarsOwned(2023, False))
+    assert(sum(evs.values()) > 0)
+    assert(all(gasCars[model] <= evs[model] + equilibriumSolver.DEFAULT_TOLERANCE for model in evs.keys()))
+    assert(carRegistry.carName('economy', 2024, False) not in cars)
+    assert(cars[carRegistry.carName('economy', 2023, True)]['history'][2024]['batteryValue'] > 0)
+
+# at a high mandate the cap binds, and no model sells more new gas cars than the cap allows, on either backend; equilibrium
+#    pricing enforces it as sequential pricing does, raising the price of the gas car until demand fits the cap
+def test_evMandateCapBinds():
+    from model import equilibriumSolver
+    for share in (0.8, 0.95):
+        binding = []
+        for (pricingMode, backend) in [('sequential', {'pricingBackend': 'dict'}), ('sequential', {'pricingBackend': 'numpy'}),
+                                       ('equilibrium', {})]:
+            parameters = dict(globalParameters, pricingMode=pricingMode, newCarEVMandate={year: share for year in range(2023, 2027)},
+                              **backend)
+            cars = specificModel.initializeCars(thisYear, parameters)
+            population = specificModel.initializePopulation(cars, thisYear, parameters)
+            population, cars = genericModel.runYears(population, cars, 4, parameters)
+            binding.append([])
+            slack = equilibriumSolver.DEFAULT_TOLERANCE if (pricingMode == 'equilibrium') else 1e-12    # the solver's residual
+            for year in range(2023, 2027):
+                for model in parameters['carTypes'].keys():
+                    (ev, gas) = [sum(group['cars'].get(carRegistry.carName(model, year, isEV), {'fraction': 0})['fraction']
+                                     for group in population[year].values()) for isEV in (True, False)]
+                    cap = ev * (1 - share) / share
+                    assert(ev > 0)
+                    assert(gas <= cap * (1 + 1e-9) + slack)
+                    price = cars[carRegistry.carName(model, year, False)]['history'][year]['price']
+                    binding[-1].append(math.isclose(gas, cap, rel_tol=1e-6) and (price > parameters['carTypes'][model]['initialQuality']))
+        assert(binding[0] == binding[1] == binding[2] and any(binding[0]))
+
+# income groups loaded from a file: with many groups the array path still agrees with the dict reference
+def test_incomeGroupsFromFile(tmp_path, monkeypatch):
+    from model import equilibriumSolver, incomeGroups, numpyBackend
+    fileName = str(tmp_path / "groups.csv")
+    with open(fileName, 'w') as f:
+        f.write(",".join(incomeGroups.COLUMNS) + "\n")
+        for i in range(40):
+            f.write("%d,%r,%r,%r\n" % (10000 + 2500 * i, 1 / 40, 2000 + 1800 * i, 0.10 - 0.0015 * i))
+    parameters = dict(globalParameters, peopleGroups=incomeGroups.loadPeopleGroups(fileName))
+    assert(len(parameters['peopleGroups']) == 40)
+
+    cars = specificModel.initializeCars(thisYear, parameters)
+    population = specificModel.initializePopulation(cars, thisYear, parameters)
+    reference = genericModel.runYears(population, cars, 3, parameters)
+    # a many-group run is priced by the vectorized sequential path, never by the equilibrium solver
+    pricedYears = []
+    vectorized = numpyBackend.determinePrices
+    monkeypatch.setattr(numpyBackend, 'determinePrices', lambda *args: pricedYears.append(args) or vectorized(*args))
+    monkeypatch.setattr(equilibriumSolver, 'solvePrices', None)
+    parameters = dict(parameters, pricingMode='sequential', pricingBackend='numpy')       # as in testQQQ/runIncomeGroups.py
+    population, cars = genericModel.runYears(*specificModel.initializeArrays(thisYear, parameters), 3, parameters)
+    assert(len(pricedYears) == 3)
+    assertSameResults(reference, (population.toPopulation(), cars.toCars()))
+
+# parameters read from files: a scenario file overrides its base, and the loader rejects what it cannot use
+def test_parameterFiles(tmp_path):
+    import json, pytest
+    from model import parameterFiles
+    fileName = str(tmp_path / "highGas.json")
+    with open(fileName, 'w') as f:
+        json.dump({'base': parameterFiles.DEFAULT_FILE, 'gasCost': {'startYear': 2022, 'values': [5.0] * 30},
+                   'peopleGroups': {'10000': {'discountRate': 0.2}}}, f)
+    parameters = parameterFiles.loadParameters(fileName)
+    assert(parameters['gasCost'][2051] == 5.0 and parameters['peopleGroups'][10000]['discountRate'] == 0.2)
+    assert(parameters['peopleGroups'][10000]['utilityFunction'] == globalParameters['peopleGroups'][10000]['utilityFunction'])
+    assert(parameters['carTypes'] == globalParameters['carTypes'])
+
+    parameterFiles.saveParameters(parameters, fileName)
+    assert(parameterFiles.loadParameters(fileName) == parameters)
+    with pytest.raises(ValueError, match="gasCosts"):
+        parameterFiles.fromData(dict(parameterFiles.toData(parameters), gasCosts=[]))
+    with pytest.raises(ValueError, match="carTypes.economy.mpg"):
+        parameterFiles.fromData(parameterFiles.mergeData(parameterFiles.toData(parameters), {'carTypes': {'economy': {'mpg': "40"}}}))
+    data = parameterFiles.toData(parameters)
+    del(data['peopleGroups']['10000']['fraction'])
+    with pytest.raises(ValueError, match="peopleGroups.10000: missing entries fraction"):
+        parameterFiles.fromData(data)
+    # every bad entry is a ValueError naming it
+    for (overrides, where) in [({'transactionCost': "500"}, "transactionCost"), ({'utilityScale': None}, "utilityScale"),
+                               ({'pricingMode': 'fast'}, "pricingMode"), ({'pricingBackend': 'gpu'}, "pricingBackend"),
+                               ({'pricingMode': 'equilibrium', 'pricingBackend': 'numpy'}, "pricingBackend"),
+                               ({'equilibriumMaxIterations': 2.5}, "equilibriumMaxIterations"),
+                               ({'carTypes': {'economy': {'mpg': 0}}}, "carTypes.economy.mpg"),
+                               ({'carTypes': {'economy': {'mpkwh': -1}}}, "carTypes.economy.mpkwh"),
+                               ({'peopleGroups': {'10000': {'utilityPeak': 0}}}, "peopleGroups.10000.utilityPeak"),
+                               ({'peopleGroups': {'10000': {'fraction': -0.5}, '20000': {'fraction': 0.7}}}, "peopleGroups.10000.fraction"),
+                               ({'newCarEVMandate': {'values': [0.5, 3]}}, "newCarEVMandate")]:
+        with pytest.raises(ValueError, match=where):
+            parameterFiles.fromData(parameterFiles.mergeData(parameterFiles.toData(parameters), overrides))
+    for key in ('batteryPriceCurve', 'batteryDepreciationCurve'):
+        data = parameterFiles.toData(parameters)
+        del(data[key])
+        with pytest.raises(ValueError, match="newCarEVMandate: needs entries " + key):
+            parameterFiles.fromData(data)
+    for (spec, where) in [({'type': 'spline'}, "peopleGroups.10000.utilityFunction"),
+                          ({'type': 'piecewiseLinear', 'qualities': [2, 1], 'utilities': [0, 0]}, "peopleGroups.10000.utilityFunction.qualities")]:
+        data = parameterFiles.toData(parameters)
+        data['peopleGroups']['10000'] = {'fraction': 0.05, 'utilityFunction': spec, 'discountRate': 0.1}
+        with pytest.raises(ValueError, match=where):
+            parameterFiles.fromData(data)
+
+# the scenario service forks a run from a warm one sharing its early years, with the same results as a fresh run
+def test_scenarioServiceForksWarmRuns(tmp_path):
+    import json, threading, urllib.error, pytest
+    from model import parameterFiles, resultCache, scenarioService, scenarioSweep
+    service = scenarioService.ScenarioService(globalParameters, str(tmp_path))
+    server = scenarioService.makeServer(service, 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    try:
+        base = scenarioService.requestScenario(url, numYears=4)
+        assert(base['source'] == 'simulated' and base['sharedYears'] == 0)
+        assert(scenarioService.requestScenario(url, numYears=4) == dict(base, source='memory', sharedYears=4))
+
+        gasCost = {year: cost * (1.5 if (year >= 2030) else 1) for (year, cost) in globalParameters['gasCost'].items()}
+        overrides = {'gasCost': parameterFiles.toData({'gasCost': gasCost})['gasCost']}
+        forked = scenarioService.requestScenario(url, overrides, numYears=4)
+        assert(forked['source'] == 'simulated' and forked['sharedYears'] == 2030 - 4 - 1 - thisYear)
+        parameters = dict(globalParameters, gasCost=gasCost)
+        population, cars = genericModel.runYears(*specificModel.initializeArrays(thisYear, parameters), 4, parameters)
+        assert(forked['key'] == resultCache.cacheKey(parameters, thisYear))
+        assert(forked['rows'] == [scenarioSweep.yearSummary(year, population, cars) for year in range(thisYear, thisYear+5)])
+        assert(forked['rows'][:4] == base['rows'][:4] and forked['rows'][4] != base['rows'][4])
+        # years all shared with a kept run come from memory, and are cached under their own key
+        later = {'gasCost': {'startYear': thisYear, 'values': [cost * (2 if (year >= 2030) else 1) for (year, cost) in sorted(gasCost.items())]}}
+        truncated = scenarioService.requestScenario(url, later, numYears=3)
+        assert(truncated['source'] == 'memory' and truncated['sharedYears'] == 3 and truncated['rows'] == base['rows'][:4])
+        assert(os.path.exists(os.path.join(str(tmp_path), truncated['key'], 'meta.json')))
+
+        assert(scenarioService.ScenarioService(globalParameters, str(tmp_path)).submit({'numYears': 3})['source'] == 'disk')
+        # a bad request is a 400 and a failure of the service a 500, both with a JSON error
+        with pytest.raises(urllib.error.HTTPError) as error:
+            scenarioService.requestScenario(url, {'gasCosts': []})
+        assert(error.value.code == 400 and 'gasCosts' in json.loads(error.value.read())['error'])
+        with pytest.raises(urllib.error.HTTPError) as error:
+            scenarioService.requestScenario(url, {'carTypes': {'economy': {'mpg': 0}}})
+        assert(error.value.code == 400 and 'carTypes.economy.mpg' in json.loads(error.value.read())['error'])
+        def fail(request):
+            raise RuntimeError("simulation failed")
+        service.run = fail
+        with pytest.raises(urllib.error.HTTPError) as error:
+            scenarioService.requestScenario(url, numYears=4)
+        assert(error.value.code == 500 and json.loads(error.value.read()) == {'error': "RuntimeError: simulation failed"})
+    finally:
+        server.shutdown()
+
+# a sweep gives the same rows, in (scenario, year) order, whether it runs in this process or in a pool, one scenario or several
+#    per task
+def test_sweepIsIndependentOfWorkers():
+    from model import scenarioSweep
+    scenarios = scenarioSweep.parameterGrid({'utilityScale': [0.1, 0.15], 'transactionCost': [250, 500]})
+    rows = scenarioSweep.runSweep(scenarios, thisYear, 2, workers=1, baseParameters=globalParameters)
+    assert([(row['scenario'], row['year']) for row in rows] == [(s, year) for s in range(4) for year in range(thisYear, thisYear+3)])
+    assert(rows[2] != rows[5])                          # the scenarios differ
+    for batchSize in (1, 3):
+        assert(scenarioSweep.runSweep(scenarios, thisYear, 2, workers=2, baseParameters=globalParameters, batchSize=batchSize) == rows)
+
+# sensitivities come from runs forked at forkYear, the same whether run in this process or in a pool
+def test_sensitivityTable():
+    from model import scenarioSweep, sensitivity
+    table = sensitivity.sensitivityTable(['gasPriceLevel', 'discountRate.10000'], 'evShare', 2026, thisYear, 2024, workers=1,
+                                         baseParameters=globalParameters)
+    assert(sensitivity.sensitivityTable(['gasPriceLevel', 'discountRate.10000'], 'evShare', 2026, thisYear, 2024, workers=2,
+                                        baseParameters=globalParameters) == table)
+    population, cars = genericModel.runYears(*specificModel.initializeArrays(thisYear, globalParameters), 2, globalParameters)
+    highGas = sensitivity.perturbed(globalParameters, 'gasPriceLevel', 1 + sensitivity.DEFAULT_STEP)
+    assert(highGas['gasCost'][2030] == globalParameters['gasCost'][2030] * (1 + sensitivity.DEFAULT_STEP))
+    forkedCars = cars.upToYear(2024)
+    forked = genericModel.runYears(population.upToYear(2024, forkedCars.names), forkedCars, 2, highGas)
+    assert(table[0]['high'] == scenarioSweep.yearSummary(2026, *forked)['evShare'])
+    base = genericModel.runYears(population, cars, 2, globalParameters)
+    assert(table[0]['base'] == scenarioSweep.yearSummary(2026, *base)['evShare'])
+    assert(table[0]['elasticity'] > 0)
+
+# a retention policy retires dead cars and keeps a window of years, and the archive gives back the whole run
+def test_retentionPolicy(tmp_path):
+    from model import retention
+    cars = specificModel.initializeCars(thisYear, globalParameters)
+    reference = genericModel.runYears(specificModel.initializePopulation(cars, thisYear, globalParameters), cars, 5, globalParameters)
+    for directory in (None, str(tmp_path / "archive")):
+        cars = specificModel.initializeCars(thisYear, globalParameters)
+        population = specificModel.initializePopulation(cars, thisYear, globalParameters)
+        archive = retention.newArchive(directory)
+        population, cars = genericModel.runYears(population, cars, 5, globalParameters,
+                                                 [retention.retentionPolicy(archive, keepYears=1, retireDead=False)])
+        assert(list(population.keys()) == [thisYear+5] and all(len(car['history']) == 1 for car in cars.values()))
+        assertSameResults(reference, retention.fullRun(population, cars, archive))
+
+    # retiring dead cars changes sequential results, but not equilibrium ones
+    parameters = dict(globalParameters, pricingMode='equilibrium')
+    cars = specificModel.initializeCars(thisYear, parameters)
+    reference = genericModel.runYears(specificModel.initializePopulation(cars, thisYear, parameters), cars, 5, parameters)
+    numCars = []
+    results = []
+    for (useRegistry, directory) in ((False, None), (True, None), (False, str(tmp_path / "dicts")), (True, str(tmp_path / "arrays"))):
+        cars = specificModel.initializeCars(thisYear, parameters)
+        population = specificModel.initializePopulation(cars, thisYear, parameters)
+        if (useRegistry):
+            cars = carRegistry.fromCars(cars)
+            population = ownershipMatrix.fromPopulation(population, cars)
+        archive = retention.newArchive(directory)
+        population, cars = genericModel.runYears(population, cars, 5, parameters,
+                                                 [retention.retentionPolicy(archive, keepYears=2), lambda year, p, c: numCars.append(len(c))])
+        assert(not retention.deadCars(thisYear+5, population, cars))
+        results.append(retention.fullRun(population, cars, archive))
+    assert(numCars[:5] == numCars[5:10] and max(numCars) < len(reference[1]))
+    for result in results[1:]:
+        assertSameResults(results[0], result)
+    assertSameResults(results[0], reference)                # dead cars play no part in equilibrium pricing
+
+# columnar aggregates agree with the per-year summaries, whether loaded from the result files or taken from the run
+def test_resultsAnalysis(tmp_path):
+    import numpy as np
+    from model import resultsAnalysis, resultsWriter, scenarioSweep
+    cars = specificModel.initializeCars(thisYear, globalParameters)
+    population = specificModel.initializePopulation(cars, thisYear, globalParameters)
+    writeYear = resultsWriter.resultsWriter(str(tmp_path), keepYears=None)
+    writeYear(thisYear, population, cars)
+    population, cars = genericModel.runYears(population, cars, 3, globalParameters, [writeYear])
+
+    results = resultsAnalysis.loadResults(str(tmp_path))
+    (years, bands, share) = resultsAnalysis.shareByPriceBand(results)
+    (evYears, incomeLevels, evShare) = resultsAnalysis.evShareByIncomeGroup(results)
+    (priceYears, models, meanPrice) = resultsAnalysis.priceSeries(results, 'incomeLevel')
+    assert(list(years) == list(evYears) == list(priceYears) == list(range(thisYear, thisYear+4)))
+    assert(list(incomeLevels) == sorted(globalParameters['peopleGroups'].keys()))
+    for (y, year) in enumerate(years):
+        summary = scenarioSweep.yearSummary(year, population, cars)
+        assert(math.isclose(share[y].sum(), summary['ownedShare']))
+        owned = np.array([sum(val['fraction'] for val in population[year][incomeLevel]['cars'].values()) for incomeLevel in incomeLevels])
+        assert(math.isclose((owned * evShare[y]).sum(), summary['evShare'], abs_tol=1e-12))
+    inMemory = resultsAnalysis.fromRun(population, cars)
+    assert(np.allclose(resultsAnalysis.priceSeries(inMemory, 'incomeLevel')[2], meanPrice, equal_nan=True))
+
+    from analysis import reportFigures
+    fileNames = reportFigures.renderReport([('base', str(tmp_path))], str(tmp_path / "report"), workers=1)
+    assert(len(fileNames) == len(reportFigures.KINDS) and all(os.path.getsize(fileName) > 0 for fileName in fileNames))
@@ -0,0 +1,85 @@
+# copyright 2022 Bob Nolty
+# if you are interested in using it, hit me up on github (rnolty)
+
+# Utility curves (utility as a function of car quality) described as data rather than as closures, so they can be pickled across
+#    process boundaries, hashed into cache keys, saved in scenario files, and evaluated on a whole array of qualities at once.
+#
+# A PiecewiseLinearUtility is linear between consecutive breakpoints and zero below the first and at or above the last:
+#    PiecewiseLinearUtility(qualities=(1000, 1500, 3000, 4000), utilities=(0, 1500, 3000, 0))
+# Calling it with a number returns a number; calling it with a numpy array returns an array of the same shape.  groupUtilities
+#    evaluates the curves of many income groups on an array of qualities in one batch.
+
+import bisect, collections
+
+class PiecewiseLinearUtility(collections.namedtuple('PiecewiseLinearUtility', ['qualities', 'utilities'])):
+    __slots__ = ()
+
+    def __new__(cls, qualities, utilities):
+        qualities = tuple(float(q) for q in qualities)
+        utilities = tuple(float(u) for u in utilities)
+        assert((len(qualities) == len(utilities)) and (len(qualities) >= 2))
+        assert(all(q0 < q1 for (q0, q1) in zip(qualities, qualities[1:])))
+        return super().__new__(cls, qualities, utilities)
+
+    def __call__(self, quality):
+        if (isinstance(quality, (int, float))):
+            return self.scalarUtility(quality)
+        return self.arrayUtility(quality)
+
+    def scalarUtility(self, quality):
+        (qualities, utilities) = self
+        if ((quality < qualities[0]) or (quality >= qualities[-1])):
+            return 0
+        k = bisect.bisect_right(qualities, quality) - 1          # qualities[k] <= quality < qualities[k+1]
+        if ((utilities[k] == qualities[k]) and (utilities[k+1] == qualities[k+1])):
+            return quality                                         # utility equals quality on this segment; keep it exact
+        return (utilities[k] * (qualities[k+1] - quality) + utilities[k+1] * (quality - qualities[k])) / (qualities[k+1] - qualities[k])
+
+    # same arithmetic as scalarUtility, element by element, so the two agree exactly
+    def arrayUtility(self, quality):
+        import numpy as np              # only array callers need numpy
+        qualities = np.array(self.qualities)
+        utilities = np.array(self.utilities)
+        quality = np.asarray(quality, dtype=float)
+        k = np.clip(np.searchsorted(qualities, quality, side='right') - 1, 0, len(qualities) - 2)
+        utility = (utilities[k] * (qualities[k+1] - quality) + utilities[k+1] * (quality - qualities[k])) / (qualities[k+1] - qualities[k])
+        utility = np.where((utilities[k] == qualities[k]) & (utilities[k+1] == qualities[k+1]), quality, utility)
+        return np.where((quality < qualities[0]) | (quality >= qualities[-1]), 0.0, utility)
+
+    # the peak of a curve made by peakedUtility (its first breakpoint, at 0.5*peak, gives it back exactly), or None for any other
+    #    curve
+    def peak(self):
+        peak = self.qualities[0] * 2
+        return peak if (self == peakedUtility(peak)) else None
+
+    # JSON-compatible description, e.g. for scenario files and cache keys
+    def spec(self):
+        return {'type': 'piecewiseLinear', 'qualities': list(self.qualities), 'utilities': list(self.utilities)}
+
+# the curve of specificModel.peakedUtility: utility equals quality near the peak, and drops to zero from 1.5*peak to 2.0*peak and
+#    from 0.75*peak to 0.5*peak
+def peakedUtility(peak):
+    return PiecewiseLinearUtility((0.5*peak, 0.75*peak, 1.5*peak, 2.0*peak), (0, 0.75*peak, 1.5*peak, 0))
+
+# utility[g, c] of curve functions[g] at quality[c], for many income groups at once.  Piecewise-linear curves with the same
+#    number of breakpoints are evaluated together, with the arithmetic of scalarUtility; any other mix is evaluated curve by curve
+def groupUtilities(functions, quality):
+    import numpy as np
+    quality = np.asarray(quality, dtype=float)
+    if ((len(functions) == 0) or not all(isinstance(function, PiecewiseLinearUtility) and (len(function.qualities) == len(functions[0].qualities))
+                                         for function in functions)):
+        return np.array([function(quality) if (isinstance(function, PiecewiseLinearUtility)) else [function(q) for q in quality]
+                         for function in functions], dtype=float).reshape(len(functions), len(quality))
+    qualities = np.array([function.qualities for function in functions])          # [g, breakpoint]
+    utilities = np.array([function.utilities for function in functions])
+    k = np.clip((qualities[:, :, np.newaxis] <= quality).sum(axis=1) - 1, 0, qualities.shape[1] - 2)     # [g, c], as searchsorted
+    (q0, q1) = (np.take_along_axis(qualities, k, axis=1), np.take_along_axis(qualities, k+1, axis=1))
+    (u0, u1) = (np.take_along_axis(utilities, k, axis=1), np.take_along_axis(utilities, k+1, axis=1))
+    utility = (u0 * (q1 - quality) + u1 * (quality - q0)) / (q1 - q0)
+    utility = np.where((u0 == q0) & (u1 == q1), quality, utility)
+    return np.where((quality < qualities[:, :1]) | (quality >= qualities[:, -1:]), 0.0, utility)
+
+# inverse of spec()
+def fromSpec(spec):
+    assert(spec['type'] == 'piecewiseLinear')
+    return PiecewiseLinearUtility(spec['qualities'], spec['utilities'])
@@ -0,0 +1,12 @@
+from model import monteCarlo
+
+# uncertainty about fuel costs, consumer behaviour and market friction
+uncertainty = {'gasCost': {'distribution': 'randomWalk', 'drift': 0.02, 'volatility': 0.1},
+               'electricityCost': {'distribution': 'randomWalk', 'drift': 0.0, 'volatility': 0.05},
+               'discountRate': {'distribution': 'lognormal', 'sigma': 0.2},
+               'utilityScale': {'distribution': 'uniform', 'low': 0.1, 'high': 0.2}}
+
+if __name__ == "__main__":
+    years, values = monteCarlo.runEnsemble(uncertainty, 100, seed=2022, startYear=2022, numYears=10)
+    monteCarlo.writeBands(monteCarlo.percentileBands(years, values), "ensemble.csv")
+    print(values.shape[0], "members; percentile bands for", years[0], "to", years[-1], "written to ensemble.csv")
@@ -0,0 +1,40 @@
+import csv, sys, time
+
+from model.defaultGlobalParameters import globalParameters
+from model import genericModel, incomeGroups, resultsWriter, runMetrics, specificModel
+
+# an example file of 1000 equal groups, with incomes, utility peaks and discount rates interpolated between the default groups
+def writeExampleGroups(fileName, numGroups=1000):
+    baseGroups = sorted(globalParameters['peopleGroups'].items())
+    peaks = [group['utilityFunction'].peak() for (incomeLevel, group) in baseGroups]
+    if (None in peaks):
+        raise ValueError("the example groups interpolate utility peaks, so every default group needs a peaked utility curve")
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(incomeGroups.COLUMNS)
+        for i in range(numGroups):
+            position = i * (len(baseGroups)-1) / (numGroups-1)
+            (low, high, weight) = (int(position), min(int(position)+1, len(baseGroups)-1), position - int(position))
+            writer.writerow([round(baseGroups[low][0] * (1-weight) + baseGroups[high][0] * weight), 1 / numGroups,
+                             peaks[low] * (1-weight) + peaks[high] * weight,
+                             baseGroups[low][1]['discountRate'] * (1-weight) + baseGroups[high][1]['discountRate'] * weight])
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 1):
+        fileName = sys.argv[1]
+    else:
+        fileName = "incomeGroups.csv"
+        writeExampleGroups(fileName)
+    # sequential pricing on arrays: the equilibrium solver is far too slow for this many groups
+    parameters = dict(globalParameters, peopleGroups=incomeGroups.loadPeopleGroups(fileName), pricingMode='sequential',
+                      pricingBackend='numpy')
+
+    start = time.perf_counter()
+    population, cars = specificModel.initializeArrays(2022, parameters)
+    writeYear = resultsWriter.resultsWriter("results")
+    writeYear(2022, population, cars)
+    runState = genericModel.newRunState()
+    population, cars = genericModel.runYears(population, cars, 25, parameters, observers=[writeYear, runMetrics.metricsWriter("results", runState)],
+                                             runState=runState)
+    print(len(parameters['peopleGroups']), "income groups from", fileName, "simulated for 25 years in", round(time.perf_counter() - start), "seconds;",
+          "results written to results/")
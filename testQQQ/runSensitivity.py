@@ -0,0 +1,11 @@
+from model.defaultGlobalParameters import globalParameters
+from model import sensitivity
+
+# how the EV share in 2035 responds to each input changed from 2025 on
+if __name__ == "__main__":
+    inputs = sensitivity.inputNames(globalParameters) + ['discountRate']
+    table = sensitivity.sensitivityTable(inputs, 'evShare', 2035, startYear=2022, forkYear=2025)
+    sensitivity.writeTable(table, "sensitivity.csv")
+    for row in table:
+        print("%-20s elasticity %8.4f" % (row['input'], row['elasticity']))
+    print(len(table), "inputs written to sensitivity.csv")
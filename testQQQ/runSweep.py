@@ -0,0 +1,11 @@
+from model import scenarioSweep
+
+# gas price trajectories: flat, and rising 5% per year
+gasCostPaths = [{year: 3.50 for year in range(2022, 2052)},
+                {year: 3.50 * pow(1.05, year - 2022) for year in range(2022, 2052)}]
+
+if __name__ == "__main__":
+    scenarios = scenarioSweep.parameterGrid({'utilityScale': [0.1, 0.15, 0.2], 'transactionCost': [250, 500], 'gasCost': gasCostPaths})
+    rows = scenarioSweep.runSweep(scenarios, startYear=2022, numYears=10)
+    scenarioSweep.writeTable(rows, scenarios, "sweep.csv")
+    print(len(scenarios), "scenarios,", len(rows), "rows written to sweep.csv")
@@ -1,5 +1,5 @@
 from model.defaultGlobalParameters import globalParameters
-from model import specificModel, genericModel
+from model import specificModel, genericModel, resultsWriter, runMetrics
 specificModel.globalParameters = globalParameters
 genericModel.globalParameters = globalParameters
 
@@ -8,9 +8,10 @@ thisYear = 2022
 cars = specificModel.initializeCars(thisYear)
 population = specificModel.initializePopulation(cars, thisYear)
 
-for i in range(10):
-    population, cars = genericModel.determinePrices(*genericModel.initializeYear(population, cars))
+# each year is written to results/ as it finishes, and only the latest year is kept in memory
+writeYear = resultsWriter.resultsWriter("results")
+writeYear(thisYear, population, cars)
+runState = genericModel.newRunState()
+population, cars = genericModel.runYears(population, cars, 10, observers=[writeYear, runMetrics.metricsWriter("results", runState)], runState=runState)
 
-print("\n\nPopulation:\n", population)
-print("\n\nCars:\n", cars)
-print("\n\n\n")
\ No newline at end of file
+print("\n\nResults for", thisYear, "to", thisYear+10, "written to results/ownership.csv and results/cars.csv; timings in results/metrics.csv")